@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Stand-in for airspy_rx that replays a recorded or synthetic capture, so the
+whole pipeline runs without an Airspy (dev boxes, CI, soak tests).
+
+It takes the airspy_rx options capture_and_process.py uses (-n samples,
+-r file or "-" for stdout, -a sample rate; the gain/frequency/bias-T options
+are accepted and ignored) and writes interleaved int16 IQ exactly as
+airspy_rx -r does, either at the real sample rate or as fast as possible:
+
+    python3 capture_and_process.py --mode on --name test --airspy-rx "./airspy_replay.py --source sky.bin"
+    AIRSPY_RX="./airspy_replay.py --rate max" ./observe.sh --runs 100 --pause 0 --mode on --network noop
+
+Source: --source FILE (a capture from airspy_rx -r or synthetic_iq.py,
+looped if shorter than -n), or, without one, synthetic noise plus a tone at
++150 kHz (synthetic_iq.generate). Defaults can also come from
+$AIRSPY_REPLAY_SOURCE and $AIRSPY_REPLAY_RATE.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import synthetic_iq
+
+RATES = ("realtime", "max")
+CHUNK_SAMPLES = 1 << 16
+SYNTHETIC_TONE_HZ = 150e3
+
+
+def build_parser():
+    # add_help=False: airspy_rx uses -h for the sensitivity gain
+    parser = argparse.ArgumentParser(description="Replay IQ like airspy_rx", add_help=False)
+    parser.add_argument("--help", action="help", help="Show this help message and exit")
+    parser.add_argument("-r", dest="output", default=None, help="Output file, '-' for stdout")
+    parser.add_argument("-n", dest="samples", type=int, default=0, help="Samples to write (default: the whole source)")
+    parser.add_argument("-a", dest="sample_rate", type=float, default=synthetic_iq.SAMPLE_RATE, help="Sample rate in Hz (or MSPS if < 1000)")
+    parser.add_argument("-t", dest="sample_type", type=int, default=2, help="Sample type; only 2 (INT16_IQ) is supported")
+    # Accepted for compatibility, no effect on a replay
+    for flag in ("-f", "-l", "-m", "-v", "-g", "-h", "-s", "-p", "-d"):
+        parser.add_argument(flag, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("-b", nargs="?", const="1", default=None, help=argparse.SUPPRESS)
+    # Replay options
+    parser.add_argument("--source", default=os.environ.get("AIRSPY_REPLAY_SOURCE"), help="IQ file to replay (default: $AIRSPY_REPLAY_SOURCE, else synthetic)")
+    parser.add_argument("--rate", choices=RATES, default=os.environ.get("AIRSPY_REPLAY_RATE", "realtime"), help="Pace output at the sample rate or as fast as possible (default: $AIRSPY_REPLAY_RATE or realtime)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic source (default: 0)")
+    return parser
+
+
+def file_chunks(path, n_samples, chunk_samples=CHUNK_SAMPLES):
+    """Yield n_samples of path as bytes (all of it once if n_samples is 0), looping at the end"""
+    if os.path.getsize(path) < 4:
+        raise ValueError(f"{path} holds no IQ samples")
+    buf = bytearray(chunk_samples * 4)
+    view = memoryview(buf)
+    remaining = n_samples * 4 if n_samples else None
+    with open(path, "rb", buffering=0) as f:
+        while remaining is None or remaining > 0:
+            want = len(buf) if remaining is None else min(len(buf), remaining)
+            got = f.readinto(view[:want])
+            got -= got % 4
+            if not got:
+                if remaining is None:
+                    return
+                f.seek(0)
+                continue
+            if remaining is not None:
+                remaining -= got
+            yield view[:got]
+
+
+def synthetic_chunks(n_samples, sample_rate, seed, chunk_samples=CHUNK_SAMPLES):
+    """Yield synthetic noise + tone as bytes (without end if n_samples is 0)"""
+    block = n_samples or 1 << 62
+    tone = synthetic_iq.bin_centred(SYNTHETIC_TONE_HZ, 8192, sample_rate)
+    for chunk in synthetic_iq.generate(block, tone_offset_hz=tone, sample_rate=sample_rate, seed=seed,
+                                       chunk_samples=chunk_samples):
+        yield chunk.tobytes()
+
+
+def replay(out, chunks, sample_rate, realtime):
+    """Write chunks to out, paced at sample_rate if realtime; returns samples written"""
+    written = 0
+    t0 = time.perf_counter()
+    for chunk in chunks:
+        if realtime:
+            ahead = t0 + written / sample_rate - time.perf_counter()
+            if ahead > 0:
+                time.sleep(ahead)
+        out.write(chunk)
+        written += len(chunk) // 4
+    out.flush()
+    return written
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.output is None:
+        print("airspy_replay: -r <file> or -r - is required", file=sys.stderr)
+        return 1
+    if args.sample_type != 2:
+        print(f"airspy_replay: sample type {args.sample_type} not supported (only 2 = INT16_IQ)", file=sys.stderr)
+        return 1
+    sample_rate = args.sample_rate * 1e6 if args.sample_rate < 1000 else args.sample_rate
+
+    if args.source:
+        if not os.path.exists(args.source):
+            print(f"airspy_replay: source {args.source} not found", file=sys.stderr)
+            return 1
+        chunks = file_chunks(args.source, args.samples)
+        source = args.source
+    else:
+        chunks = synthetic_chunks(args.samples, sample_rate, args.seed)
+        source = "synthetic"
+
+    to_stdout = args.output == "-"
+    out = sys.stdout.buffer if to_stdout else open(args.output, "wb")
+    count = f"{args.samples:,}" if args.samples else "all"
+    print(f"airspy_replay: {count} samples from {source} at {sample_rate / 1e6:g} MSPS "
+          f"({args.rate}) → {'stdout' if to_stdout else args.output}", file=sys.stderr)
+    t0 = time.perf_counter()
+    try:
+        written = replay(out, chunks, sample_rate, args.rate == "realtime")
+    except BrokenPipeError:
+        # Reader went away (like airspy_rx, just stop); keep Python from complaining at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except (OSError, ValueError) as e:
+        print(f"airspy_replay: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if not to_stdout:
+            out.close()
+    elapsed = time.perf_counter() - t0
+    print(f"airspy_replay: wrote {written:,} samples in {elapsed:.1f}s "
+          f"({written / max(elapsed, 1e-9) / 1e6:.1f} MSPS)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,108 +1,391 @@
 #!/usr/bin/env python3
 """
 Quick analysis tool to view spectrum statistics from .npz files
-Usage: python3 analyze_spectrum.py spectrum_20251224_143022.npz
+
+Usage:
+    python3 analyze_spectrum.py spectrum_20251224_143022.npz             # Full report for one file
+    python3 analyze_spectrum.py ../output/                                # Campaign summary
+    python3 analyze_spectrum.py "../output/cassiopeia_*.npz" --format csv > runs.csv
+    python3 analyze_spectrum.py ../output/ --format json --spectrum       # Also fit the H-line peak
+    python3 analyze_spectrum.py ../output/cassiopeia.campaign             # Every run of a campaign container
+
+Batch mode reads only the scalar fields of each file, in parallel, so the
+spectra are never decompressed unless --spectrum asks for them. Campaign
+containers are summarised from their column files alone.
 """
 
-import numpy as np
-import sys
+import argparse
+import csv
+import json
 import os
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 
-if len(sys.argv) < 2:
-    print("Usage: python3 analyze_spectrum.py <npz_file>")
-    print("\nExample: python3 analyze_spectrum.py ../output/spectrum_20251224_143022.npz")
-    sys.exit(1)
-
-npz_path = sys.argv[1]
-
-if not os.path.exists(npz_path):
-    print(f"Error: File not found: {npz_path}")
-    sys.exit(1)
-
-# Load the data
-data = np.load(npz_path)
-
-print("\n" + "="*60)
-print(f"  Analysis of: {os.path.basename(npz_path)}")
-print("="*60)
-
-# Basic info
-print("\n📊 OBSERVATION INFO:")
-print(f"  Timestamp:     {data['timestamp']}")
-print(f"  Mode:          {data['mode']} (antenna {'ON source' if data['mode'] == 'on' else 'OFF source'})")
-print(f"  Sample Rate:   {data['sample_rate']/1e6:.1f} MSPS")
-print(f"  FFT Size:      {data['fft_size']}")
-print(f"  FFT Windows:   {data['averaging_windows']}")
-
-# Hardware settings
-print("\n⚙️  HARDWARE SETTINGS:")
-print(f"  LNA Gain:      {data['lna_gain']} dB")
-print(f"  Mixer Gain:    {data['mix_gain']} dB")
-print(f"  VGA Gain:      {data['vga_gain']} dB")
-
-# Signal quality
-print("\n📡 SIGNAL QUALITY:")
-print(f"  Peak Power:    {data['peak_power_db']:.1f} dB")
-print(f"  Noise Floor:   {data['noise_floor_db']:.1f} dB")
-print(f"  Median Power:  {data['median_power_db']:.1f} dB")
-print(f"  SNR:           {data['snr_db']:.1f} dB", end="")
-if data['snr_db'] > 10:
-    print("  ✅ Excellent")
-elif data['snr_db'] > 5:
-    print("  ✅ Good")
-elif data['snr_db'] > 3:
-    print("  ⚠️  Fair")
-else:
-    print("  ❌ Poor")
-
-# Frequency analysis
-print("\n🔭 FREQUENCY ANALYSIS:")
-print(f"  Peak at:       {data['peak_frequency_hz']/1e6:.6f} MHz")
-print(f"  H-line (21cm): 1420.405751 MHz")
-print(f"  Doppler Shift: {data['hydrogen_offset_khz']:+.2f} kHz")
-
-# Convert frequency offset to velocity (using Doppler formula)
-c = 299792.458  # Speed of light in km/s
-velocity_km_s = (data['hydrogen_offset_khz'] / 1420405.751) * c
-print(f"  Radial Velocity: {velocity_km_s:+.1f} km/s")
-if abs(velocity_km_s) < 50:
-    print("    (Low velocity - local hydrogen or Earth motion)")
-elif abs(velocity_km_s) < 200:
-    print("    (Galactic hydrogen)")
-else:
-    print("    (High velocity - galactic rotation or unusual source)")
-
-# RFI assessment
-print("\n📻 RFI ASSESSMENT:")
-print(f"  RFI Indicator: {data['rfi_percentage']:.1f}% bins >10dB")
-if data['rfi_percentage'] < 5:
-    print("  Status:        ✅ Clean data (< 5%)")
-elif data['rfi_percentage'] < 15:
-    print("  Status:        ⚠️  Moderate RFI (5-15%)")
-else:
-    print("  Status:        ❌ High RFI (> 15%) - consider re-observation")
-
-# Data size
-print("\n💾 DATA SIZE:")
-spectrum_size = data['spectrum'].nbytes / (1024 * 1024)
-total_size = sum(data[k].nbytes for k in data.files) / (1024 * 1024)
-print(f"  Spectrum:      {spectrum_size:.2f} MB")
-print(f"  Total (all):   {total_size:.2f} MB")
-print(f"  Compression:   ~{os.path.getsize(npz_path)/(1024*1024):.2f} MB on disk")
-
-print("\n" + "="*60)
-
-# List all available fields
-print("\n📋 Available data fields:")
-for key in sorted(data.files):
-    value = data[key]
-    if hasattr(value, 'shape'):
-        if value.shape == ():
-            print(f"  {key:25s} = {value}")
-        else:
-            print(f"  {key:25s} : array shape {value.shape}")
+import numpy as np
+
+from campaign_store import CampaignStore, find_campaigns, is_campaign, run_ref
+from catalog import find_npz
+
+H_LINE_HZ = 1420.405751e6
+C_KM_S = 299792.458          # Speed of light in km/s
+H_WINDOW_KHZ = 500           # --spectrum: search for the H-line peak within this of the tuned frequency
+RFI_HIGH = 15                # % bins >10dB counted as high RFI
+
+SUMMARY_FIELDS = ["timestamp", "observation_name", "mode", "snr_db", "rfi_percentage", "peak_power_db",
+                  "noise_floor_db", "peak_frequency_hz", "averaging_windows", "fft_size", "sample_rate",
+                  "spectrum_sample_rate", "lna_gain", "mix_gain", "vga_gain"]
+TABLE_COLUMNS = ["timestamp", "observation_name", "mode", "snr_db", "rfi_percentage", "peak_offset_khz",
+                 "velocity_km_s", "averaging_windows", "integration_s", "file"]
+SPECTRUM_COLUMNS = ["hline_offset_khz", "hline_velocity_km_s", "hline_snr_db"]
+
+
+def peak_offset_khz(peak_frequency_hz):
+    """
+    Offset of the peak from the tuned H-line frequency in kHz. freq_axis (and
+    so peak_frequency_hz) is relative to the tuned frequency; the stored
+    hydrogen_offset_khz subtracts 1420.405751 MHz once more, so it isn't used.
+    """
+    if abs(peak_frequency_hz) > H_LINE_HZ / 2:
+        # An absolute frequency
+        peak_frequency_hz -= H_LINE_HZ
+    return peak_frequency_hz / 1e3
+
+
+def radial_velocity_km_s(offset_khz):
+    """Radial velocity for a Doppler offset from the H line (positive = receding)"""
+    return -offset_khz * 1e3 / H_LINE_HZ * C_KM_S
+
+
+def npz_members(path):
+    """
+    {field: (shape, dtype, uncompressed bytes)} from the .npy headers, without
+    decompressing the arrays themselves
+    """
+    members = {}
+    with zipfile.ZipFile(path) as z:
+        for info in z.infolist():
+            if not info.filename.endswith(".npy"):
+                continue
+            with z.open(info) as f:
+                if np.lib.format.read_magic(f) == (1, 0):
+                    shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+            members[info.filename[:-4]] = (shape, dtype, info.file_size)
+    return members
+
+
+def _scalar(value):
+    value = value.item() if isinstance(value, np.ndarray) and value.ndim == 0 else value
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def hline_fit(spectrum, freq_axis, window_khz=H_WINDOW_KHZ):
+    """Strongest bin within window_khz of the tuned frequency (DC bin excluded): offset kHz, SNR dB"""
+    offsets = freq_axis / 1e3
+    if abs(offsets[len(offsets) // 2]) > H_LINE_HZ / 2e3:
+        offsets = offsets - H_LINE_HZ / 1e3
+    bin_khz = abs(offsets[1] - offsets[0])
+    near = (np.abs(offsets) <= window_khz) & (np.abs(offsets) > bin_khz)
+    if not near.any():
+        return None, None
+    idx = np.flatnonzero(near)[np.argmax(spectrum[near])]
+    floor = np.percentile(spectrum, 25)
+    return float(offsets[idx]), float(10 * np.log10((spectrum[idx] + 1e-10) / (floor + 1e-10)))
+
+
+def summarize_file(path, with_spectrum=False):
+    """
+    One summary row for path. Only scalar fields are read (np.load decompresses
+    per field on access), plus spectrum/freq_axis with with_spectrum.
+    """
+    row = {"file": os.path.basename(path), "path": os.path.abspath(path)}
+    try:
+        with np.load(path) as data:
+            for key in SUMMARY_FIELDS:
+                row[key] = _scalar(data[key]) if key in data.files else None
+            if with_spectrum:
+                row["hline_offset_khz"], row["hline_snr_db"] = hline_fit(data["spectrum"], data["freq_axis"])
+                row["hline_velocity_km_s"] = (radial_velocity_km_s(row["hline_offset_khz"])
+                                              if row["hline_offset_khz"] is not None else None)
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+        return row
+    _derive(row)
+    row["file_mb"] = os.path.getsize(path) / (1024 * 1024)
+    return row
+
+
+def _derive(row):
+    """Offset, velocity and integration time of a summary row"""
+    if row["peak_frequency_hz"] is not None:
+        row["peak_offset_khz"] = peak_offset_khz(row["peak_frequency_hz"])
+        row["velocity_km_s"] = radial_velocity_km_s(row["peak_offset_khz"])
+    if row["averaging_windows"] is not None and row["fft_size"]:
+        rate = row["spectrum_sample_rate"] or row["sample_rate"]
+        row["integration_s"] = row["averaging_windows"] * row["fft_size"] / rate if rate else None
+
+
+def summarize_campaign(container, with_spectrum=False):
+    """
+    Summary rows for every run of a campaign container, each field read once
+    for all runs from its column file; spectra only with with_spectrum
+    """
+    name = os.path.basename(os.path.normpath(container))
+    try:
+        store = CampaignStore(container)
+        table = {key: store.values(key) for key in SUMMARY_FIELDS if key in store.columns}
+    except Exception as e:
+        return [{"file": name, "path": os.path.abspath(container), "error": f"{type(e).__name__}: {e}"}]
+    row_mb = (store.schema["fft_size"] * 4 + 8 * len(store.columns)) / (1024 * 1024)
+    rows = []
+    for i in range(store.rows):
+        row = {"file": f"{name}#{i}", "path": run_ref(os.path.abspath(container), i)}
+        for key in SUMMARY_FIELDS:
+            row[key] = table[key][i] if key in table else None
+        if with_spectrum:
+            row["hline_offset_khz"], row["hline_snr_db"] = hline_fit(store.spectrum(i), store.freq_axis)
+            row["hline_velocity_km_s"] = (radial_velocity_km_s(row["hline_offset_khz"])
+                                          if row["hline_offset_khz"] is not None else None)
+        _derive(row)
+        row["file_mb"] = row_mb
+        rows.append(row)
+    return rows
+
+
+def summarize(paths, jobs=None, with_spectrum=False, campaigns=()):
+    """Summary rows for paths (and campaign containers), read in jobs processes, sorted by timestamp"""
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(paths) < 4:
+        rows = [summarize_file(p, with_spectrum) for p in paths]
     else:
-        print(f"  {key:25s} = {value}")
+        with ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as pool:
+            rows = list(pool.map(summarize_file, paths, [with_spectrum] * len(paths), chunksize=8))
+    for container in campaigns:
+        rows += summarize_campaign(container, with_spectrum)
+    return sorted(rows, key=lambda r: (r.get("timestamp") or "", r["file"]))
+
+
+def distribution(values):
+    """min / p25 / median / p75 / max / mean / std of the finite values (None if there are none)"""
+    v = np.array([x for x in values if x is not None], dtype=float)
+    v = v[np.isfinite(v)]
+    if not len(v):
+        return None
+    p25, median, p75 = np.percentile(v, [25, 50, 75])
+    return {"n": int(len(v)), "min": float(v.min()), "p25": float(p25), "median": float(median),
+            "p75": float(p75), "max": float(v.max()), "mean": float(v.mean()), "std": float(v.std())}
+
+
+def aggregate(rows, rfi_high=RFI_HIGH):
+    """
+    Campaign aggregates: run counts, integration time, SNR / Doppler / RFI
+    distributions, and RFI outliers (above rfi_high %, or more than 3 robust
+    standard deviations above the campaign median)
+    """
+    ok = [r for r in rows if "error" not in r]
+    rfi = [r["rfi_percentage"] for r in ok if r["rfi_percentage"] is not None]
+    median = float(np.median(rfi)) if rfi else 0.0
+    mad = float(np.median(np.abs(np.array(rfi) - median))) * 1.4826 if rfi else 0.0
+    outliers = [r["file"] for r in ok if r["rfi_percentage"] is not None and
+                (r["rfi_percentage"] > rfi_high or (mad > 0 and r["rfi_percentage"] > median + 3 * mad))]
+    timestamps = sorted(r["timestamp"] for r in ok if r["timestamp"])
+    agg = {
+        "runs": len(ok),
+        "unreadable": [r["file"] for r in rows if "error" in r],
+        "by_mode": {m: sum(r["mode"] == m for r in ok) for m in sorted({r["mode"] for r in ok if r["mode"]})},
+        "names": sorted({r["observation_name"] for r in ok if r["observation_name"]}),
+        "first": timestamps[0] if timestamps else None,
+        "last": timestamps[-1] if timestamps else None,
+        "integration_s": sum(r.get("integration_s") or 0 for r in ok),
+        "snr_db": distribution(r["snr_db"] for r in ok),
+        "peak_offset_khz": distribution(r.get("peak_offset_khz") for r in ok),
+        "velocity_km_s": distribution(r.get("velocity_km_s") for r in ok),
+        "rfi_percentage": distribution(rfi),
+        "rfi_outliers": outliers,
+    }
+    if any("hline_offset_khz" in r for r in ok):
+        agg["hline_velocity_km_s"] = distribution(r.get("hline_velocity_km_s") for r in ok)
+        agg["hline_snr_db"] = distribution(r.get("hline_snr_db") for r in ok)
+    return agg
+
+
+def _cell(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.1f}"
+    return str(value)
+
+
+def print_batch(rows, agg, columns, out=sys.stdout):
+    """Per-run table followed by the campaign aggregates"""
+    shown = [[_cell(r.get(c)) for c in columns] for r in rows if "error" not in r]
+    widths = [max([len(c)] + [len(s[i]) for s in shown]) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)), file=out)
+    for s in shown:
+        print("  ".join(v.ljust(w) for v, w in zip(s, widths)), file=out)
+    for r in rows:
+        if "error" in r:
+            print(f"❌ {r['file']}: {r['error']}", file=out)
+
+    print("\n" + "="*60, file=out)
+    print(f"  Campaign: {agg['runs']} runs ({', '.join(f'{n} {m}' for m, n in agg['by_mode'].items())})", file=out)
+    print("="*60, file=out)
+    print(f"  Names:         {', '.join(agg['names']) or '-'}", file=out)
+    print(f"  Span:          {agg['first']} → {agg['last']}", file=out)
+    print(f"  Integration:   {agg['integration_s'] / 60:.1f} min ({agg['integration_s']:.0f} s)", file=out)
+    print(f"\n  {'':16s}{'min':>9s}{'p25':>9s}{'median':>9s}{'p75':>9s}{'max':>9s}", file=out)
+    for key, label in (("snr_db", "SNR dB"), ("peak_offset_khz", "Offset kHz"), ("velocity_km_s", "Velocity km/s"),
+                       ("hline_velocity_km_s", "H-line km/s"), ("hline_snr_db", "H-line SNR dB"),
+                       ("rfi_percentage", "RFI %")):
+        d = agg.get(key)
+        if d:
+            print(f"  {label:16s}{d['min']:>9.1f}{d['p25']:>9.1f}{d['median']:>9.1f}{d['p75']:>9.1f}{d['max']:>9.1f}", file=out)
+    if agg["rfi_outliers"]:
+        print(f"\n  ⚠️  RFI outliers ({len(agg['rfi_outliers'])}): {', '.join(agg['rfi_outliers'])}", file=out)
+    else:
+        print("\n  ✅ No RFI outliers", file=out)
+    if agg["unreadable"]:
+        print(f"  ❌ Unreadable: {', '.join(agg['unreadable'])}", file=out)
+
+
+def report(npz_path):
+    """Full report for a single file"""
+    # Load the data
+    data = np.load(npz_path)
+
+    print("\n" + "="*60)
+    print(f"  Analysis of: {os.path.basename(npz_path)}")
+    print("="*60)
+
+    # Basic info
+    print("\n📊 OBSERVATION INFO:")
+    print(f"  Timestamp:     {data['timestamp']}")
+    print(f"  Mode:          {data['mode']} (antenna {'ON source' if data['mode'] == 'on' else 'OFF source'})")
+    print(f"  Sample Rate:   {data['sample_rate']/1e6:.1f} MSPS")
+    print(f"  FFT Size:      {data['fft_size']}")
+    print(f"  FFT Windows:   {data['averaging_windows']}")
+
+    # Hardware settings
+    print("\n⚙️  HARDWARE SETTINGS:")
+    print(f"  LNA Gain:      {data['lna_gain']} dB")
+    print(f"  Mixer Gain:    {data['mix_gain']} dB")
+    print(f"  VGA Gain:      {data['vga_gain']} dB")
+
+    # Signal quality
+    print("\n📡 SIGNAL QUALITY:")
+    print(f"  Peak Power:    {data['peak_power_db']:.1f} dB")
+    print(f"  Noise Floor:   {data['noise_floor_db']:.1f} dB")
+    print(f"  Median Power:  {data['median_power_db']:.1f} dB")
+    print(f"  SNR:           {data['snr_db']:.1f} dB", end="")
+    if data['snr_db'] > 10:
+        print("  ✅ Excellent")
+    elif data['snr_db'] > 5:
+        print("  ✅ Good")
+    elif data['snr_db'] > 3:
+        print("  ⚠️  Fair")
+    else:
+        print("  ❌ Poor")
+
+    # Frequency analysis
+    offset_khz = peak_offset_khz(float(data['peak_frequency_hz']))
+    print("\n🔭 FREQUENCY ANALYSIS:")
+    print(f"  Peak at:       {(H_LINE_HZ + offset_khz * 1e3)/1e6:.6f} MHz")
+    print(f"  H-line (21cm): 1420.405751 MHz")
+    print(f"  Doppler Shift: {offset_khz:+.2f} kHz")
+
+    # Convert frequency offset to velocity (using Doppler formula)
+    velocity_km_s = radial_velocity_km_s(offset_khz)
+    print(f"  Radial Velocity: {velocity_km_s:+.1f} km/s")
+    if abs(velocity_km_s) < 50:
+        print("    (Low velocity - local hydrogen or Earth motion)")
+    elif abs(velocity_km_s) < 200:
+        print("    (Galactic hydrogen)")
+    else:
+        print("    (High velocity - galactic rotation or unusual source)")
+
+    # RFI assessment
+    print("\n📻 RFI ASSESSMENT:")
+    print(f"  RFI Indicator: {data['rfi_percentage']:.1f}% bins >10dB")
+    if data['rfi_percentage'] < 5:
+        print("  Status:        ✅ Clean data (< 5%)")
+    elif data['rfi_percentage'] < 15:
+        print("  Status:        ⚠️  Moderate RFI (5-15%)")
+    else:
+        print("  Status:        ❌ High RFI (> 15%) - consider re-observation")
+
+    # Data size (from the array headers; nothing is decompressed for this)
+    members = npz_members(npz_path)
+    print("\n💾 DATA SIZE:")
+    spectrum_size = members['spectrum'][2] / (1024 * 1024)
+    total_size = sum(m[2] for m in members.values()) / (1024 * 1024)
+    print(f"  Spectrum:      {spectrum_size:.2f} MB")
+    print(f"  Total (all):   {total_size:.2f} MB")
+    print(f"  Compression:   ~{os.path.getsize(npz_path)/(1024*1024):.2f} MB on disk")
+
+    print("\n" + "="*60)
+
+    # List all available fields
+    print("\n📋 Available data fields:")
+    for key in sorted(members):
+        shape = members[key][0]
+        if shape == ():
+            print(f"  {key:25s} = {data[key]}")
+        else:
+            print(f"  {key:25s} : array shape {shape}")
+
+    print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="View spectrum statistics from .npz files and campaign containers")
+    parser.add_argument("paths", nargs="+", help=".npz files, directories, glob patterns or campaign containers (one file: full report)")
+    parser.add_argument("--format", choices=["table", "csv", "json"], default="table", help="Batch output format (default: table)")
+    parser.add_argument("--output", type=str, default=None, help="Write the batch output to this file instead of stdout")
+    parser.add_argument("--jobs", type=int, default=0, help="Reader processes (0 = one per CPU core, default: 0)")
+    parser.add_argument("--spectrum", action="store_true", help=f"Also decompress each spectrum and find the strongest bin within {H_WINDOW_KHZ} kHz of the H line")
+    parser.add_argument("--rfi-threshold", type=float, default=RFI_HIGH, help=f"RFI %% above which a run is an outlier (default: {RFI_HIGH})")
+    args = parser.parse_args(argv)
+
+    if len(args.paths) == 1 and os.path.isfile(args.paths[0]) and args.format == "table" and not args.spectrum:
+        npz_path = args.paths[0]
+        report(npz_path)
+        return 0
+    for p in args.paths:
+        if not os.path.exists(p) and not any(c in p for c in "*?["):
+            print(f"Error: File not found: {p}")
+            return 1
+
+    campaigns = find_campaigns(args.paths)
+    files = find_npz([p for p in args.paths if not is_campaign(p)])
+    if not files and not campaigns:
+        print("No .npz files or campaign containers found")
+        return 1
+    rows = summarize(files, jobs=args.jobs or None, with_spectrum=args.spectrum, campaigns=campaigns)
+    agg = aggregate(rows, args.rfi_threshold)
+    columns = TABLE_COLUMNS[:-1] + (SPECTRUM_COLUMNS if args.spectrum else []) + TABLE_COLUMNS[-1:]
+
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        if args.format == "json":
+            json.dump({"runs": rows, "aggregates": agg}, out, indent=2)
+            out.write("\n")
+        elif args.format == "csv":
+            fields = ["file"] + [k for k in SUMMARY_FIELDS if k != "file"] + ["peak_offset_khz", "velocity_km_s",
+                     "integration_s", "file_mb"] + (SPECTRUM_COLUMNS if args.spectrum else []) + ["path", "error"]
+            writer = csv.DictWriter(out, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            print_batch(rows, agg, columns, out)
+    finally:
+        if args.output:
+            out.close()
+            print(f"Saved {len(rows)} run(s) to {args.output}")
+    return 1 if agg["unreadable"] else 0
 
-print()
 
+if __name__ == "__main__":
+    sys.exit(main())
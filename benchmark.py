@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Processing benchmarks that run without an Airspy attached.
+
+  python3 benchmark.py io [--windows 2000] [--fft-size 8192]
+  python3 benchmark.py suite [--fft-sizes 2048,8192,32768] [--seconds 2] [--modes plain,pfb,zoom]
+                             [--output results.json] [--baseline old_results.json]
+
+io: Compares the original read loop (f.read + np.frombuffer + astype copies per
+window) with the engine's preallocated readinto path on the same synthetic
+capture file. Each variant runs in its own process and reports time per
+window, peak RSS, the engine's preallocated buffers, and the transient
+allocation in the steady-state loop: the largest between two reads, and the
+sum of those per window.
+
+suite: Runs capture_and_process.py --from-file on synthetic captures (noise, a
+tone at a known offset and, for the rfi/blank modes, impulsive RFI; see
+synthetic_iq.py) for every FFT size x capture length x mode. Each case runs
+in its own process and reports throughput and peak RSS, and checks that the
+peak frequency and SNR match the injected tone. Results are written as JSON;
+with --baseline, any case slower or bigger than the baseline by more than the
+thresholds counts as a regression. Exits 1 on a regression or failed check.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import synthetic_iq
+from spectrum_engine import SpectrumAccumulator
+
+IO_VARIANTS = ["legacy", "engine"]
+
+# Suite modes: capture_and_process.py flags, which capture, and how to check the SNR
+# ("match" = expected Hann SNR within tolerance, "min" = at least that, None = report only).
+# PFB and zoom spectra have a narrower noise bandwidth, so their SNR only has a floor.
+SUITE_MODES = {
+    "plain": (["--no-sk"], "clean", "match"),
+    "sk": ([], "clean", "match"),
+    "single": (["--no-sk", "--precision", "single"], "clean", "match"),
+    # plain/single/single-numpy/double-scipy separate the precision from the FFT library
+    "single-numpy": (["--no-sk", "--precision", "single", "--fft-backend", "numpy"], "clean", "match"),
+    "double-scipy": (["--no-sk", "--fft-backend", "scipy"], "clean", "match"),
+    "workers": (["--no-sk", "--workers", "0"], "clean", "match"),
+    "pfb": (["--no-sk", "--channelizer", "pfb"], "clean", "min"),
+    "zoom": (["--no-sk", "--zoom-bandwidth", "300000"], "clean", "min"),
+    "waterfall": (["--no-sk", "--waterfall-seconds", "0.5"], "clean", "match"),
+    "rfi": (["--no-sk"], "rfi", None),
+    "blank": (["--no-sk", "--blank", "zero"], "rfi", "match"),
+}
+SUITE_TONE_OFFSET = 150e3
+SUITE_IMPULSES_PER_S = 200
+
+
+def legacy_loop(f, fft_size, on_window=None):
+    """The per-window read loop capture_and_process.py originally used"""
+    spectrum_accum = np.zeros(fft_size)
+    n_chunks = 0
+    while True:
+        if on_window:
+            on_window()
+        data = np.frombuffer(f.read(fft_size * 4), dtype=np.int16)
+        if len(data) < fft_size * 2:
+            break
+        iq = data[::2].astype(np.float32) + 1j * data[1::2].astype(np.float32)
+        iq = iq - np.mean(iq)
+        windowed = iq * np.hanning(fft_size)
+        fft = np.fft.fftshift(np.fft.fft(windowed))
+        spectrum_accum += np.abs(fft)**2
+        n_chunks += 1
+    return n_chunks
+
+
+class _ReadHook:
+    """Reads through to f, calling hook before every readinto (once per batch)"""
+
+    def __init__(self, f, hook):
+        self.f = f
+        self.hook = hook
+
+    def readinto(self, b):
+        self.hook()
+        return self.f.readinto(b)
+
+
+class _AllocMeter:
+    """
+    Transient allocation between consecutive ticks (one per window or batch),
+    measured with tracemalloc. The first tick after setup starts the count.
+    """
+
+    def __init__(self):
+        self.ticks = 0
+        self.transient_bytes = 0
+        self.peak_bytes = 0
+
+    def tick(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if self.ticks >= 2:
+            # Everything before the second tick is setup and the first window/batch
+            self.transient_bytes += peak - current
+            self.peak_bytes = max(self.peak_bytes, peak - current)
+        self.ticks += 1
+        tracemalloc.reset_peak()
+
+
+def _vmhwm_kb(pid="self"):
+    """VmHWM (peak RSS) of a process in KB, or None if it can't be read"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def peak_rss_kb():
+    """
+    Peak RSS of this process in KB. VmHWM starts over at exec; ru_maxrss
+    doesn't on Linux, so a child would report its parent's high-water mark.
+    """
+    kb = _vmhwm_kb()
+    return kb if kb is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _record_child_peaks(pid, peaks):
+    """Update peaks ({pid: KB}) with the VmHWM of each live child process of pid"""
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; the parent pid is the second field after it
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        if ppid == pid:
+            kb = _vmhwm_kb(entry)
+            if kb is not None:
+                peaks[int(entry)] = max(peaks.get(int(entry), 0), kb)
+
+
+def run_io_variant(variant, path, fft_size):
+    """Process path with one variant; returns a result dict (runs in a child process)"""
+    meter = _AllocMeter()
+    buffer_bytes = 0
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    with open(path, "rb") as f:
+        if variant == "legacy":
+            n_windows = legacy_loop(f, fft_size, meter.tick)
+            steady_windows = max(n_windows - 1, 1)
+        else:
+            engine = SpectrumAccumulator(fft_size)
+            buffer_bytes = engine.buffer_bytes
+            engine.consume(_ReadHook(f, meter.tick))
+            n_windows = engine.n_windows
+            steady_windows = max(n_windows - engine.batch_windows, 1)
+    elapsed = time.perf_counter() - t0
+    tracemalloc.stop()
+    return {
+        "variant": variant,
+        "windows": n_windows,
+        "seconds": elapsed,
+        "us_per_window": elapsed / max(n_windows, 1) * 1e6,
+        "steady_state_peak_alloc_bytes": meter.peak_bytes,
+        "alloc_bytes_per_window": meter.transient_bytes / steady_windows,
+        "buffer_bytes": buffer_bytes,
+        "max_rss_kb": peak_rss_kb(),
+    }
+
+
+def write_random_capture(path, n_windows, fft_size, seed=0):
+    """Gaussian-noise capture file in airspy_rx format (interleaved int16 IQ)"""
+    synthetic_iq.write_capture(path, n_windows * fft_size, seed=seed)
+
+
+def benchmark_io(n_windows, fft_size):
+    fd, path = tempfile.mkstemp(suffix=".bin")
+    os.close(fd)
+    try:
+        write_random_capture(path, n_windows, fft_size)
+        results = []
+        for variant in IO_VARIANTS:
+            r = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "_io-variant", variant, path, str(fft_size)],
+                check=True, capture_output=True, text=True,
+            )
+            results.append(json.loads(r.stdout))
+    finally:
+        os.remove(path)
+
+    print(f"\nI/O path: {n_windows} windows of {fft_size} samples ({n_windows * fft_size * 4 / 1e6:.0f} MB)")
+    print(f"{'variant':<8s} {'us/window':>10s} {'peak RSS':>10s} {'buffers':>10s} {'loop alloc':>12s} {'alloc/window':>13s}")
+    for r in results:
+        print(f"{r['variant']:<8s} {r['us_per_window']:>10.1f} {r['max_rss_kb'] / 1024:>8.1f}MB "
+              f"{r['buffer_bytes'] / 2**20:>8.1f}MB {r['steady_state_peak_alloc_bytes'] / 1024:>10.1f}KB "
+              f"{r['alloc_bytes_per_window'] / 1024:>11.1f}KB")
+    return results
+
+
+def run_suite_case(path, fft_size, flags, out_dir):
+    """Process path with capture_and_process.py; returns a result dict (runs in a child process)"""
+    import capture_and_process
+
+    capture_and_process.output_dir = out_dir
+    cfg = capture_and_process.parse_config(["--mode", "on", "--name", "benchmark", "--from-file", path,
+                                            "--keep-bin", "--catalog", "", "--fft-size", str(fft_size), *flags])
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        result = capture_and_process.Observer().run(cfg)
+    with np.load(result.npz_path) as z:
+        bin_hz = float(z["freq_axis"][1] - z["freq_axis"][0])
+        decimation = int(z["decimation"]) if "decimation" in z else 1
+    os.remove(result.npz_path)
+    process = result.stages["process"]
+    return {
+        "windows": result.windows,
+        "processing_s": result.timings["processing_s"],
+        "fft_s": result.timings["fft_s"],
+        "samples_per_s": process["samples_per_s"],
+        "realtime_factor": process["samples_per_s"] / capture_and_process.sample_rate,
+        "cpu_s": process["cpu_s"],
+        "peak_rss_kb": peak_rss_kb(),
+        # Largest single worker (--workers); _suite_child() adds up all of them
+        "max_child_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        "peak_frequency_hz": float(result.stats["peak_frequency_hz"]),
+        "snr_db": float(result.stats["snr_db"]),
+        "bin_hz": bin_hz,
+        "decimation": decimation,
+    }
+
+
+def _suite_child(path, fft_size, flags, out_dir, poll_interval=0.05):
+    """
+    run_suite_case() in a fresh process; its JSON is the last line of stdout.
+
+    The worker pool of --workers runs in that process's children, whose peak
+    RSS is gone once they exit, so their VmHWM is polled while the case runs.
+    peak_rss_kb is the case process plus the sum over its workers (an upper
+    bound: the peaks may not coincide, and pages shared after fork count in
+    each), workers_peak_rss_kb the workers' part.
+    """
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "_suite-case", path, str(fft_size), out_dir, *flags],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    peaks = {}
+    while True:
+        try:
+            stdout, stderr = proc.communicate(timeout=poll_interval)
+            break
+        except subprocess.TimeoutExpired:
+            _record_child_peaks(proc.pid, peaks)
+    if proc.returncode != 0:
+        raise RuntimeError(stderr.strip().splitlines()[-1] if stderr.strip() else f"exit {proc.returncode}")
+    result = json.loads(stdout.strip().splitlines()[-1])
+    # A worker that came and went between polls still has its ru_maxrss
+    workers_kb = max(sum(peaks.values()), result.pop("max_child_rss_kb"))
+    result["workers_peak_rss_kb"] = workers_kb
+    result["peak_rss_kb"] += workers_kb
+    return result
+
+
+def check_case(case, tone_hz, tone_amplitude, noise_rms, snr_check, snr_tolerance):
+    """Add expected_snr_db and the frequency/SNR checks to a suite result"""
+    expected = float(synthetic_iq.expected_snr_db(tone_amplitude, noise_rms, case["fft_size"], case["decimation"]))
+    case["tone_offset_hz"] = tone_hz
+    case["expected_snr_db"] = expected
+    case["frequency_ok"] = bool(abs(case["peak_frequency_hz"] - tone_hz) <= case["bin_hz"])
+    if snr_check == "match":
+        case["snr_ok"] = bool(abs(case["snr_db"] - expected) <= snr_tolerance)
+    elif snr_check == "min":
+        case["snr_ok"] = bool(case["snr_db"] >= expected - snr_tolerance)
+    else:
+        case["snr_ok"] = None
+    case["ok"] = case["frequency_ok"] and case["snr_ok"] is not False
+    return case
+
+
+def compare_baseline(results, baseline, max_slowdown, max_rss_growth):
+    """Mark each result against the baseline case of the same name; returns the regressed names"""
+    base = {r["case"]: r for r in baseline.get("results", []) if "error" not in r}
+    regressions = []
+    for r in results:
+        b = base.get(r["case"])
+        if b is None or "error" in r:
+            continue
+        r["baseline_samples_per_s"] = b["samples_per_s"]
+        r["baseline_peak_rss_kb"] = b["peak_rss_kb"]
+        r["speed_ratio"] = r["samples_per_s"] / b["samples_per_s"]
+        reasons = []
+        if r["samples_per_s"] < b["samples_per_s"] * (1 - max_slowdown):
+            reasons.append(f"{(1 - r['speed_ratio']) * 100:.0f}% slower")
+        if r["peak_rss_kb"] > b["peak_rss_kb"] * (1 + max_rss_growth):
+            reasons.append(f"{(r['peak_rss_kb'] / b['peak_rss_kb'] - 1) * 100:.0f}% more memory")
+        r["regression"] = ", ".join(reasons)
+        if reasons:
+            regressions.append(r["case"])
+    return regressions
+
+
+def benchmark_suite(fft_sizes, seconds_list, modes, output=None, baseline=None, repeat=1,
+                    tone_offset=SUITE_TONE_OFFSET, tone_amplitude=synthetic_iq.TONE_AMPLITUDE,
+                    noise_rms=synthetic_iq.NOISE_RMS, impulses_per_s=SUITE_IMPULSES_PER_S,
+                    snr_tolerance=1.0, max_slowdown=0.15, max_rss_growth=0.20):
+    """
+    Sweep fft_sizes x seconds_list x modes; returns (report dict, number of
+    failed checks and regressions)
+    """
+    # On a bin centre of the smallest FFT, and so of every larger power-of-two size
+    tone_hz = synthetic_iq.bin_centred(tone_offset, min(fft_sizes))
+    results = []
+    with tempfile.TemporaryDirectory(prefix="spartanpi_bench_") as tmp:
+        for seconds in seconds_list:
+            n_samples = int(seconds * synthetic_iq.SAMPLE_RATE)
+            captures = {}
+            for kind in sorted({SUITE_MODES[m][1] for m in modes}):
+                captures[kind] = os.path.join(tmp, f"{kind}_{seconds:g}s.bin")
+                print(f"Writing {seconds:g}s {kind} capture ({n_samples * 4 / 1e6:.0f} MB)...")
+                synthetic_iq.write_capture(captures[kind], n_samples, tone_offset_hz=tone_hz,
+                                           tone_amplitude=tone_amplitude, noise_rms=noise_rms,
+                                           impulses_per_s=impulses_per_s if kind == "rfi" else 0)
+            for fft_size in fft_sizes:
+                for mode in modes:
+                    flags, kind, snr_check = SUITE_MODES[mode]
+                    if mode == "zoom":
+                        # Zoom centred on the tone (DC is removed before down-conversion, so it survives)
+                        flags = flags + ["--zoom-offset", str(tone_hz)]
+                    name = f"{mode}/fft{fft_size}/{seconds:g}s"
+                    case = {"case": name, "mode": mode, "fft_size": fft_size, "seconds": seconds,
+                            "samples": n_samples, "flags": flags}
+                    try:
+                        # Fastest of repeat runs; peak RSS is the same every time
+                        runs = [_suite_child(captures[kind], fft_size, flags, tmp) for _ in range(repeat)]
+                    except (RuntimeError, ValueError) as e:
+                        case["error"] = str(e)
+                        case["ok"] = False
+                        print(f"  {name:<28s} ❌ {e}")
+                        results.append(case)
+                        continue
+                    case.update(max(runs, key=lambda r: r["samples_per_s"]))
+                    check_case(case, tone_hz, tone_amplitude, noise_rms, snr_check, snr_tolerance)
+                    print(f"  {name:<28s} {case['samples_per_s'] / 1e6:>7.2f} Msamp/s  "
+                          f"SNR {case['snr_db']:5.1f} dB  {'✅' if case['ok'] else '❌'}")
+                    results.append(case)
+            for path in captures.values():
+                os.remove(path)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "tone_offset_hz": tone_hz,
+        "tone_amplitude": tone_amplitude,
+        "noise_rms": noise_rms,
+        "impulses_per_s": impulses_per_s,
+        "thresholds": {"snr_tolerance_db": snr_tolerance, "max_slowdown": max_slowdown,
+                       "max_rss_growth": max_rss_growth},
+        "results": results,
+    }
+    regressions = []
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare_baseline(results, json.load(f), max_slowdown, max_rss_growth)
+        report["baseline"] = baseline
+    report["regressions"] = regressions
+    failed = [r["case"] for r in results if not r["ok"]]
+    report["failed"] = failed
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print(f"\nSuite: tone at {tone_hz:+.1f} Hz, {tone_amplitude:g} counts in {noise_rms:g} counts RMS noise")
+    print(f"{'case':<28s} {'Msamp/s':>8s} {'realtime':>9s} {'peak RSS':>9s} {'peak Hz':>10s} "
+          f"{'SNR dB':>7s} {'expect':>7s} {'check':>6s} {'vs base':>8s}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['case']:<28s} error: {r['error']}")
+            continue
+        vs_base = f"{r['speed_ratio']:>7.2f}x" if "speed_ratio" in r else f"{'-':>8s}"
+        print(f"{r['case']:<28s} {r['samples_per_s'] / 1e6:>8.2f} {r['realtime_factor']:>8.1f}x "
+              f"{r['peak_rss_kb'] / 1024:>7.0f}MB {r['peak_frequency_hz']:>10.1f} {r['snr_db']:>7.1f} "
+              f"{r['expected_snr_db']:>7.1f} {'✅' if r['ok'] else '❌':>5s} {vs_base}"
+              + (f"  ⚠️  {r['regression']}" if r.get("regression") else ""))
+    if output:
+        print(f"\nResults saved to {output}")
+    if failed:
+        print(f"❌ {len(failed)} case(s) failed the frequency/SNR check: {', '.join(failed)}")
+    if regressions:
+        print(f"⚠️  {len(regressions)} regression(s) against {baseline}: {', '.join(regressions)}")
+    return report, len(failed) + len(regressions)
+
+
+def _csv_list(text, kind):
+    return [kind(v) for v in text.split(",") if v.strip()]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "_io-variant":
+        # Internal: one variant in a fresh process so RSS figures don't mix
+        print(json.dumps(run_io_variant(sys.argv[2], sys.argv[3], int(sys.argv[4]))))
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "_suite-case":
+        # Internal: one suite case in a fresh process (path, fft_size, output dir, flags...)
+        print(json.dumps(run_suite_case(sys.argv[2], int(sys.argv[3]), sys.argv[5:], sys.argv[4])))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Benchmark the processing path without an Airspy")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_io = sub.add_parser("io", help="Compare raw IQ read/convert paths")
+    p_io.add_argument("--windows", type=int, default=2000, help="FFT windows in the synthetic capture (default: 2000)")
+    p_io.add_argument("--fft-size", type=int, default=8192, help="FFT window size (default: 8192)")
+    p_suite = sub.add_parser("suite", help="Sweep FFT size, capture length and processing mode on synthetic captures")
+    p_suite.add_argument("--fft-sizes", type=str, default="2048,8192,32768", help="Comma-separated FFT sizes (default: 2048,8192,32768)")
+    p_suite.add_argument("--seconds", type=str, default="2", help="Comma-separated capture lengths in seconds (default: 2)")
+    p_suite.add_argument("--modes", type=str, default=",".join(SUITE_MODES), help=f"Comma-separated modes (default: all of {','.join(SUITE_MODES)})")
+    p_suite.add_argument("--repeat", type=int, default=1, help="Runs per case; the fastest counts (default: 1)")
+    p_suite.add_argument("--output", type=str, default="benchmark_results.json", help="JSON results file (default: benchmark_results.json)")
+    p_suite.add_argument("--baseline", type=str, default=None, help="Earlier results JSON to check for regressions against")
+    p_suite.add_argument("--max-slowdown", type=float, default=0.15, help="Throughput drop vs the baseline that counts as a regression (default: 0.15)")
+    p_suite.add_argument("--max-rss-growth", type=float, default=0.20, help="Peak RSS growth vs the baseline that counts as a regression (default: 0.20)")
+    p_suite.add_argument("--snr-tolerance", type=float, default=1.0, help="Allowed SNR deviation from the expected value, dB (default: 1)")
+    p_suite.add_argument("--tone-offset", type=float, default=SUITE_TONE_OFFSET, help=f"Injected tone offset, Hz (default: {SUITE_TONE_OFFSET:g})")
+    p_suite.add_argument("--tone-amplitude", type=float, default=synthetic_iq.TONE_AMPLITUDE, help=f"Injected tone amplitude, counts (default: {synthetic_iq.TONE_AMPLITUDE:g})")
+    p_suite.add_argument("--impulses-per-s", type=float, default=SUITE_IMPULSES_PER_S, help=f"Impulsive RFI rate in the rfi/blank captures (default: {SUITE_IMPULSES_PER_S})")
+    args = parser.parse_args()
+
+    if args.command == "io":
+        benchmark_io(args.windows, args.fft_size)
+    elif args.command == "suite":
+        modes = _csv_list(args.modes, str)
+        unknown = [m for m in modes if m not in SUITE_MODES]
+        if unknown:
+            parser.error(f"unknown mode(s) {', '.join(unknown)}; choose from {', '.join(SUITE_MODES)}")
+        _, problems = benchmark_suite(_csv_list(args.fft_sizes, int), _csv_list(args.seconds, float), modes,
+                                      output=args.output, baseline=args.baseline, repeat=max(args.repeat, 1),
+                                      tone_offset=args.tone_offset, tone_amplitude=args.tone_amplitude,
+                                      impulses_per_s=args.impulses_per_s, snr_tolerance=args.snr_tolerance,
+                                      max_slowdown=args.max_slowdown, max_rss_growth=args.max_rss_growth)
+        sys.exit(1 if problems else 0)
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+Campaign container: many runs in one append-only directory instead of one
+compressed .npz each (capture_and_process.py --output-format campaign).
+
+    cassiopeia.campaign/
+        schema.json          rows committed so far, column types, chunking
+        freq_axis.npy        written once, shared by every run
+        spectra/00000.f32    float32 spectra, chunk_rows rows per file
+        columns/snr_db.f8    one file per scalar field: float64, one value per row
+        columns/mode.jsonl   ... or one JSON string per line
+        extras/000012.npz    other array fields of a run, if any (sk, rfi_mask, waterfall)
+
+Appending a run writes only that run's bytes: no compression, no rewrite of
+earlier rows, and an upload only sends the files that changed (the current
+spectra chunk and the column files). A row only exists once schema.json
+counts it, so a run cut short by a crash or power loss is ignored and
+overwritten by the next append.
+
+    store = CampaignStore("../output/cassiopeia.campaign")
+    store.column("snr_db")              # One field of every run, without touching the spectra
+    store.spectrum(12)                  # One run's spectrum
+    with store.run(12) as run: ...      # Everything of one run, used like np.load() of its .npz
+
+    python3 campaign_store.py convert ../output/cassiopeia.campaign ../output/cassiopeia_*.npz
+    python3 campaign_store.py info ../output/cassiopeia.campaign
+    python3 campaign_store.py export ../output/cassiopeia.campaign 12 run12.npz
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from catalog import find_npz
+
+FORMAT = "spartanpi-campaign"
+VERSION = 1
+CHUNK_ROWS = 8               # Spectra per chunk file; smaller = less re-uploaded per run, more files
+SPECTRUM_DTYPE = np.float32
+# Column kinds; "int" and "f8" are both float64 on disk (NaN = missing), "int" reads back as int
+STRING = "str"
+NUMBER = "f8"
+INTEGER = "int"
+
+
+class CampaignMismatch(ValueError):
+    """A run that doesn't fit the container (different FFT size or frequency axis)"""
+
+
+def _kind(value):
+    """Column type for a 0-d field value"""
+    value = value.item() if isinstance(value, (np.ndarray, np.generic)) else value
+    if isinstance(value, str):
+        return STRING
+    return INTEGER if isinstance(value, (bool, int)) else NUMBER
+
+
+def is_campaign(path):
+    """True if path is a campaign container directory"""
+    return os.path.isfile(os.path.join(path, "schema.json"))
+
+
+def find_campaigns(paths):
+    """Campaign containers in paths: given directly, or anywhere inside a given directory"""
+    found = []
+    for p in paths:
+        if is_campaign(p):
+            found.append(p)
+        elif os.path.isdir(p):
+            found += sorted(os.path.join(root, d) for root, dirs, _ in os.walk(p)
+                            for d in dirs if d.endswith(".campaign") and is_campaign(os.path.join(root, d)))
+    return found
+
+
+def run_ref(container, row):
+    """Reference to one run of a container, as recorded in the catalog: <container>#<row>"""
+    return f"{container}#{row}"
+
+
+def split_ref(ref):
+    """(container, row) of a run_ref(), or None if ref isn't one"""
+    container, sep, row = ref.rpartition("#")
+    if not sep or not row.lstrip("-").isdigit() or not is_campaign(container):
+        return None
+    return container, int(row)
+
+
+class CampaignRun:
+    """
+    One run of a container, read lazily like np.load() of an .npz: .files,
+    run[key] (0-d arrays for scalars), `in` and use as a context manager
+    """
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+        self._extras = None
+        # Like the run's .npz: only the fields it had (columns added by later runs are missing here)
+        self.values = store.row_values(row)
+        self.files = ["spectrum", "freq_axis"] + list(self.values) + self._extra_names()
+
+    def _extra_path(self):
+        path = os.path.join(self.store.path, "extras", f"{self.row:06d}.npz")
+        return path if os.path.exists(path) else None
+
+    def _extra_names(self):
+        path = self._extra_path()
+        if path is None:
+            return []
+        with np.load(path) as d:
+            return list(d.files)
+
+    def __contains__(self, key):
+        return key in self.files
+
+    def __getitem__(self, key):
+        if key == "spectrum":
+            return self.store.spectrum(self.row)
+        if key == "freq_axis":
+            return self.store.freq_axis
+        if key in self.values:
+            return np.array(self.values[key])
+        if self._extras is None:
+            path = self._extra_path()
+            if path is None:
+                raise KeyError(key)
+            with np.load(path) as d:
+                self._extras = {k: d[k] for k in d.files}
+        return self._extras[key]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def close(self):
+        pass
+
+
+class CampaignStore:
+    """An existing or new container at path (see the module docstring)"""
+
+    def __init__(self, path, chunk_rows=CHUNK_ROWS):
+        self.path = path
+        self._schema_path = os.path.join(path, "schema.json")
+        self._freq_axis = None
+        self.appended_bytes = 0          # Written by the last append()
+        self._strings = {}               # String columns already read, at self.rows
+        if is_campaign(path):
+            self.schema = self._read_schema()
+        else:
+            self.schema = {"format": FORMAT, "version": VERSION, "rows": 0, "fft_size": None,
+                           "chunk_rows": int(chunk_rows), "spectrum_dtype": np.dtype(SPECTRUM_DTYPE).str,
+                           "columns": {}, "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+    def _read_schema(self):
+        with open(self._schema_path) as f:
+            schema = json.load(f)
+        if schema.get("format") != FORMAT or schema.get("version", 0) > VERSION:
+            raise ValueError(f"{self.path} is not a version {VERSION} {FORMAT} container")
+        return schema
+
+    def _write_schema(self):
+        self.schema["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        tmp = self._schema_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.schema, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._schema_path)
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock for an append, with the schema re-read under it"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if is_campaign(self.path):
+                self.schema = self._read_schema()
+            yield
+
+    @property
+    def rows(self):
+        return self.schema["rows"]
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def columns(self):
+        return list(self.schema["columns"])
+
+    @property
+    def freq_axis(self):
+        if self._freq_axis is None:
+            self._freq_axis = np.load(os.path.join(self.path, "freq_axis.npy"))
+        return self._freq_axis
+
+    # --- Paths ---
+
+    def _chunk_path(self, row):
+        return os.path.join(self.path, "spectra", f"{row // self.schema['chunk_rows']:05d}.f32")
+
+    def _column_path(self, name):
+        ext = "jsonl" if self.schema["columns"][name] == STRING else "f8"
+        return os.path.join(self.path, "columns", f"{name}.{ext}")
+
+    # --- Reading ---
+
+    def spectrum(self, row):
+        """Spectrum of one run (float32), read on its own"""
+        if not 0 <= row < self.rows:
+            raise IndexError(f"row {row} out of range ({self.rows} rows)")
+        fft_size = self.schema["fft_size"]
+        offset = (row % self.schema["chunk_rows"]) * fft_size * np.dtype(SPECTRUM_DTYPE).itemsize
+        return np.fromfile(self._chunk_path(row), dtype=SPECTRUM_DTYPE, count=fft_size, offset=offset)
+
+    def spectra(self, rows=None):
+        """(n_rows, fft_size) float32 array of the given rows (default: all)"""
+        rows = range(self.rows) if rows is None else rows
+        out = np.empty((len(rows), self.schema["fft_size"]), dtype=SPECTRUM_DTYPE)
+        for i, row in enumerate(rows):
+            out[i] = self.spectrum(row)
+        return out
+
+    def column(self, name):
+        """
+        One scalar field of every run: float64 array (NaN = missing, also
+        for integer fields) or list of str (None = missing)
+        """
+        if name not in self.schema["columns"]:
+            raise KeyError(name)
+        path = self._column_path(name)
+        if self.schema["columns"][name] == STRING:
+            cached = self._strings.get(name)
+            if cached is None or len(cached) != self.rows:
+                with open(path) as f:
+                    cached = self._strings[name] = [json.loads(line) for _, line in zip(range(self.rows), f)]
+            return list(cached)
+        return np.fromfile(path, dtype=NUMBER, count=self.rows)
+
+    def values(self, name):
+        """One scalar field of every run as Python values (None = missing, int for integer fields)"""
+        column = self.column(name)
+        if self.schema["columns"][name] == STRING:
+            return column
+        cast = int if self.schema["columns"][name] == INTEGER else float
+        return [None if np.isnan(v) else cast(v) for v in column]
+
+    def value(self, name, row):
+        """One scalar field of one run (None if the run doesn't have it)"""
+        if self.schema["columns"][name] == STRING:
+            return self.column(name)[row]
+        value = float(np.fromfile(self._column_path(name), dtype=NUMBER, count=1, offset=row * 8)[0])
+        if np.isnan(value):
+            return None
+        return int(value) if self.schema["columns"][name] == INTEGER else value
+
+    def row_values(self, row):
+        """{column: value} of the scalar fields one run has"""
+        values = {name: self.value(name, row) for name in self.schema["columns"]}
+        return {name: value for name, value in values.items() if value is not None}
+
+    def table(self, names=None):
+        """{column: values} for names (default: all columns)"""
+        return {name: self.column(name) for name in (names or self.columns)}
+
+    def run(self, row):
+        """CampaignRun for row (negative rows count from the end)"""
+        if row < 0:
+            row += self.rows
+        if not 0 <= row < self.rows:
+            raise IndexError(f"row {row} out of range ({self.rows} rows)")
+        return CampaignRun(self, row)
+
+    def runs(self):
+        """CampaignRun for every row"""
+        return [CampaignRun(self, row) for row in range(self.rows)]
+
+    # --- Appending ---
+
+    def _truncate(self, path, size):
+        """Cut anything an interrupted append left past size bytes"""
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    def _truncate_lines(self, path, lines):
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        keep = data.split(b"\n")[:lines]
+        new = b"".join(line + b"\n" for line in keep)
+        if new != data:
+            with open(path, "wb") as f:
+                f.write(new)
+
+    def append(self, fields):
+        """
+        Append one run (the fields capture_and_process.py would save to its
+        .npz); returns its row number
+
+        Raises:
+            CampaignMismatch: fft_size or freq_axis differ from the container's
+        """
+        spectrum = np.asarray(fields["spectrum"])
+        freq_axis = np.asarray(fields["freq_axis"], dtype=np.float64)
+        # None (e.g. a statistic that wasn't measured) is left as the column's missing value
+        scalars = {k: v for k, v in fields.items()
+                   if k not in ("spectrum", "freq_axis") and v is not None and np.ndim(v) == 0}
+        extras = {k: np.asarray(v) for k, v in fields.items()
+                  if k not in ("spectrum", "freq_axis") and v is not None and np.ndim(v) > 0}
+
+        with self._locked():
+            row = self.rows
+            if self.schema["fft_size"] is None:
+                os.makedirs(os.path.join(self.path, "spectra"), exist_ok=True)
+                os.makedirs(os.path.join(self.path, "columns"), exist_ok=True)
+                np.save(os.path.join(self.path, "freq_axis.npy"), freq_axis)
+                self.schema["fft_size"] = int(len(spectrum))
+                self._freq_axis = freq_axis
+            elif len(spectrum) != self.schema["fft_size"]:
+                raise CampaignMismatch(f"fft_size {len(spectrum)} != {self.schema['fft_size']} in {self.path}")
+            elif not np.allclose(freq_axis, self.freq_axis):
+                raise CampaignMismatch(f"freq_axis differs from the one in {self.path}")
+
+            for name, value in scalars.items():
+                kind = _kind(value)
+                known = self.schema["columns"].get(name)
+                if known is not None and (known == STRING) != (kind == STRING):
+                    raise CampaignMismatch(f"{name} is {kind} but the column is {known}")
+
+            # Spectrum: append to the current chunk, after anything left by a failed append
+            itemsize = np.dtype(SPECTRUM_DTYPE).itemsize
+            chunk = self._chunk_path(row)
+            self._truncate(chunk, (row % self.schema["chunk_rows"]) * self.schema["fft_size"] * itemsize)
+            with open(chunk, "ab") as f:
+                f.write(spectrum.astype(SPECTRUM_DTYPE).tobytes())
+
+            # Columns: one value each; columns new with this run are filled in for earlier rows
+            for name, value in scalars.items():
+                kind = _kind(value)
+                if self.schema["columns"].get(name) == INTEGER and kind == NUMBER:
+                    # Same storage: a float in an integer column only changes how it reads back
+                    self.schema["columns"][name] = NUMBER
+                if name not in self.schema["columns"]:
+                    self.schema["columns"][name] = kind
+                    path = self._column_path(name)
+                    with open(path, "w" if kind == STRING else "wb") as f:
+                        if kind == STRING:
+                            f.write("null\n" * row)
+                        else:
+                            f.write(np.full(row, np.nan).tobytes())
+            for name, kind in self.schema["columns"].items():
+                path = self._column_path(name)
+                value = scalars.get(name)
+                value = value.item() if isinstance(value, (np.ndarray, np.generic)) else value
+                if kind == STRING:
+                    self._truncate_lines(path, row)
+                    with open(path, "a") as f:
+                        f.write(json.dumps(None if value is None else str(value)) + "\n")
+                else:
+                    self._truncate(path, row * 8)
+                    with open(path, "ab") as f:
+                        f.write(np.array([np.nan if value is None else value], dtype=NUMBER).tobytes())
+
+            self.appended_bytes = spectrum.size * itemsize + 8 * len(self.schema["columns"])
+            if extras:
+                os.makedirs(os.path.join(self.path, "extras"), exist_ok=True)
+                # Uncompressed: cheap to write on a Pi (the waterfall already has its own compact dtype)
+                extra = os.path.join(self.path, "extras", f"{row:06d}.npz")
+                np.savez(extra, **extras)
+                self.appended_bytes += os.path.getsize(extra)
+
+            # Commit: the row exists from here on
+            self.schema["rows"] = row + 1
+            self._write_schema()
+        return row
+
+    def files(self):
+        """Every file of the container, e.g. for upload"""
+        found = []
+        for root, _, names in os.walk(self.path):
+            found += [os.path.join(root, n) for n in sorted(names) if not n.startswith(".") and not n.endswith(".tmp")]
+        return sorted(found)
+
+
+def convert(container, paths, delete=False, log=print):
+    """
+    Append .npz run files to container in timestamp order, skipping runs it
+    already has (same observation_name, mode and timestamp); returns rows added
+    """
+    store = CampaignStore(container)
+    have = set()
+    if store.rows:
+        names = store.column("observation_name") if "observation_name" in store.columns else [None] * store.rows
+        modes = store.column("mode") if "mode" in store.columns else [None] * store.rows
+        stamps = store.column("timestamp") if "timestamp" in store.columns else [None] * store.rows
+        have = set(zip(names, modes, stamps))
+    runs = []
+    for path in find_npz(paths):
+        with np.load(path) as d:
+            fields = {k: d[k] for k in d.files}
+        runs.append((str(fields.get("timestamp", "")), path, fields))
+    added = 0
+    for _, path, fields in sorted(runs, key=lambda r: r[:2]):
+        key = tuple(str(fields[k]) if k in fields else None for k in ("observation_name", "mode", "timestamp"))
+        if key in have:
+            log(f"  {os.path.basename(path)}: already in the container")
+            continue
+        try:
+            row = store.append(fields)
+        except CampaignMismatch as e:
+            log(f"  ⚠️  {os.path.basename(path)} not added: {e}")
+            continue
+        have.add(key)
+        added += 1
+        log(f"  {os.path.basename(path)} → row {row}")
+        if delete:
+            os.remove(path)
+    return added
+
+
+def container_bytes(path):
+    return sum(os.path.getsize(f) for f in CampaignStore(path).files())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Campaign container: convert .npz runs, inspect, export")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_convert = sub.add_parser("convert", help="Append .npz runs to a container (created if needed)")
+    p_convert.add_argument("container", help="Container directory, e.g. ../output/cassiopeia.campaign")
+    p_convert.add_argument("paths", nargs="+", help=".npz files, directories or glob patterns")
+    p_convert.add_argument("--delete", action="store_true", help="Delete each .npz once it is in the container")
+    p_info = sub.add_parser("info", help="Show a container's schema and runs")
+    p_info.add_argument("container")
+    p_export = sub.add_parser("export", help="Write one run back out as a standalone .npz")
+    p_export.add_argument("container")
+    p_export.add_argument("row", type=int, help="Row number (negative = from the end)")
+    p_export.add_argument("output", help="Output .npz path")
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        before = sum(os.path.getsize(p) for p in find_npz(args.paths))
+        t0 = time.perf_counter()
+        added = convert(args.container, args.paths, delete=args.delete)
+        print(f"✅ Added {added} run(s) to {args.container} in {time.perf_counter() - t0:.1f}s "
+              f"({before / 1e6:.1f} MB of .npz → {container_bytes(args.container) / 1e6:.1f} MB container)")
+        return 0
+
+    if not is_campaign(args.container):
+        print(f"Error: {args.container} is not a campaign container")
+        return 1
+    store = CampaignStore(args.container)
+    if args.command == "export":
+        with store.run(args.row) as run:
+            fields = {k: run[k] for k in run.files}
+        np.savez_compressed(args.output, **fields)
+        print(f"✅ Row {args.row} → {args.output}")
+        return 0
+
+    s = store.schema
+    print(f"{args.container}: {store.rows} runs, {s['fft_size']}-point float32 spectra in chunks of {s['chunk_rows']}, "
+          f"{len(s['columns'])} columns, {container_bytes(args.container) / 1e6:.1f} MB")
+    shown = [c for c in ("timestamp", "observation_name", "mode", "snr_db", "rfi_percentage", "averaging_windows")
+             if c in s["columns"]]
+    table = {c: store.values(c) for c in shown}
+    print("row  " + "  ".join(f"{c:>16s}" for c in shown))
+    for row in range(store.rows):
+        cells = [table[c][row] for c in shown]
+        print(f"{row:<4d} " + "  ".join(f"{v:>16.2f}" if isinstance(v, float) else f"{str(v):>16s}" for v in cells))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,172 +1,708 @@
+"""
+Capture IQ samples from the Airspy and turn them into an averaged spectrum
+(.npz, or a row of a campaign container with --output-format campaign).
+
+CLI:
+    python3 capture_and_process.py --mode on --name cassiopeia
+
+API (keeps FFT backends, plans and engine buffers warm between runs):
+    observer = Observer()
+    result = observer.run(parse_config(["--mode", "on", "--name", "cassiopeia"]))
+    result.npz_path, result.stats["snr_db"], result.timings["processing_s"]
+
+ObservationWorker runs an Observer in a persistent child process, which is how
+run_observations.py drives a campaign without starting Python for every run.
+"""
+
 import numpy as np
 import subprocess
 import time
 import os
 import shutil
 import argparse
+import cProfile
+import contextlib
+import shlex
+import sys
+import multiprocessing
+import multiprocessing.connection
+import signal
+import traceback
+from dataclasses import dataclass, field
+
+from campaign_store import CampaignMismatch, CampaignStore, run_ref
+from catalog import CATALOG_PATH, record_observation
+from fft_backends import BACKEND_CHOICES, get_backend
+from stage_timer import StageTimer
+from throttle import AdaptiveThrottle
+from spectrum_engine import (SpectrumAccumulator, DownConverter, ImpulseBlanker, SpectralKurtosis, Waterfall,
+                             BLANK_ACTIONS, CHANNELIZERS, DEFAULT_BATCH_WINDOWS, PRECISIONS, SK_EXCLUDE_MODES,
+                             WATERFALL_DTYPES, auto_workers, process_file_parallel)
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--mode", choices=["on", "off"], required=True)
-parser.add_argument("--name", type=str, default="observation", help="Observation name for filename")
-args = parser.parse_args()
+
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["on", "off"], required=True)
+    parser.add_argument("--name", type=str, default="observation", help="Observation name for filename")
+    parser.add_argument("--stream", action="store_true", help="Pipe airspy_rx straight into the FFT loop instead of writing capture.bin to disk")
+    parser.add_argument("--airspy-rx", type=str, default=AIRSPY_RX, help="Capture command, e.g. './airspy_replay.py --source sky.bin' to run without an Airspy (default: $AIRSPY_RX or airspy_rx)")
+    parser.add_argument("--batch-windows", type=int, default=DEFAULT_BATCH_WINDOWS, help=f"FFT windows processed per batch; caps memory use (default: {DEFAULT_BATCH_WINDOWS})")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used for the FFT of capture.bin (0 = one per CPU core, default: 1)")
+    parser.add_argument("--adaptive", action="store_true", help="Scale workers/batch size to CPU temperature and load, and defer optional work when hot (see throttle.py)")
+    parser.add_argument("--fft-backend", choices=BACKEND_CHOICES, default=None, help="FFT implementation (default: $FFT_BACKEND or numpy)")
+    parser.add_argument("--fft-threads", type=int, default=None, help="Threads per FFT for scipy/pyfftw backends (default: $FFT_THREADS or 1)")
+    parser.add_argument("--precision", choices=PRECISIONS, default="double", help="FFT precision; 'single' uses complex64, still accumulating in float64, with scipy.fft unless --fft-backend is given (default: double)")
+    parser.add_argument("--compare-precision", action="store_true", help="With --precision single, also compute the double-precision spectrum and report the deviation")
+    parser.add_argument("--waterfall-seconds", type=float, default=0, help="Also save a waterfall with one row per this many seconds (default: 0 = off)")
+    parser.add_argument("--waterfall-decimate", type=int, default=1, help="Average this many adjacent bins per waterfall channel (default: 1)")
+    parser.add_argument("--waterfall-dtype", choices=WATERFALL_DTYPES, default="float16", help="Waterfall storage type (default: float16)")
+    parser.add_argument("--no-sk", action="store_true", help="Skip spectral-kurtosis RFI flagging")
+    parser.add_argument("--sk-sigma", type=float, default=3.0, help="Spectral-kurtosis flagging threshold in standard deviations (default: 3)")
+    parser.add_argument("--sk-exclude", choices=SK_EXCLUDE_MODES, default="off", help="Drop SK-flagged bins or windows from the spectrum as it accumulates (default: off = flag only)")
+    parser.add_argument("--blank", choices=BLANK_ACTIONS, default=None, help="Blank impulsive RFI before the FFT: zero the samples or drop their windows (default: off)")
+    parser.add_argument("--blank-threshold", type=float, default=6.0, help="Blanking threshold, in multiples of the robust RMS noise amplitude (default: 6)")
+    parser.add_argument("--fft-size", type=int, default=8192, help="FFT window size (default: 8192)")
+    parser.add_argument("--zoom-bandwidth", type=float, default=0, help="Down-convert to this bandwidth (Hz) around the zoom centre before the FFT (default: 0 = full band)")
+    parser.add_argument("--zoom-offset", type=float, default=0, help="Zoom centre, Hz offset from the tuned frequency (default: 0)")
+    parser.add_argument("--zoom-taps", type=int, default=0, help="Low-pass filter taps per decimation phase for --zoom-bandwidth (default: 0 = sized for 70 dB stopband)")
+    parser.add_argument("--channelizer", choices=CHANNELIZERS, default="hann", help="Hann-windowed FFT or polyphase filterbank (default: hann)")
+    parser.add_argument("--pfb-taps", type=int, default=4, help="Polyphase filterbank taps, in FFT windows (default: 4)")
+    parser.add_argument("--capture-only", action="store_true", help="Only capture to --bin-file and print its path (process it later with --from-file)")
+    parser.add_argument("--from-file", type=str, default=None, help="Skip the capture and process this raw IQ file instead")
+    parser.add_argument("--bin-file", type=str, default="capture.bin", help="Raw capture file to write (default: capture.bin)")
+    parser.add_argument("--timestamp", type=str, default=None, help="Timestamp (YYYYMMDD_HHMMSS) for the output name, e.g. the capture time of --from-file")
+    parser.add_argument("--profile", type=str, default=None, help="Save a cProfile dump of the processing stage to this path (view with python3 -m pstats)")
+    parser.add_argument("--keep-bin", action="store_true", help="Keep the raw .bin file after processing")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="npz", help="One .npz per run, or append the run to a campaign container (default: npz)")
+    parser.add_argument("--campaign", type=str, default=None, help="Campaign container for --output-format campaign (default: <output dir>/<name>.campaign)")
+    parser.add_argument("--catalog", type=str, default=CATALOG_PATH, help="SQLite catalog to record the run in, '' to skip (default: $CATALOG_PATH or catalog.sqlite next to the scripts)")
+    return parser
+
+
+def parse_config(argv=None):
+    """Observation config from command-line style arguments (default: sys.argv)"""
+    return build_parser().parse_args(argv)
 
 
 # --- Settings ---
 sample_rate = 3_000_000       # Airspy Mini: 3 MSPS
 lna_gain = 0                  # Airspy LMA Gain = 0 dB (0-14 possible). Sawbird already has LNA gain
-mix_gain = 5                  # Airspy Mix Gain = 5 dB (0-15 possible). 
+mix_gain = 5                  # Airspy Mix Gain = 5 dB (0-15 possible).
 vga_gain = 6                 # Airspy VGA Gain = 6 dB (0-15 possible). .
 sample_count = 100_000_000    # ~33s of data = ~382MB file
 
 freq=1420.405751 	# MHz
-fft_size = 8192               # FFT window size
-bin_file = "capture.bin"
-
-timestamp = time.strftime("%Y%m%d_%H%M%S")
-# Sanitize observation name (replace spaces/special chars with underscores)
-safe_name = "".join(c if c.isalnum() or c in ('-', '_') else '_' for c in args.name)
-npz_file = f"../output/{safe_name}_{timestamp}.npz"
-
-
-# --- Step 1: Capture IQ data ---
-print("\n" + "="*50)
-print("           CAPTURE CONFIGURATION")
-print("="*50)
-print(f"Frequency:       {freq} MHz (Hydrogen line)")
-print(f"Sample Rate:     {sample_rate/1e6:.1f} MSPS")
-print(f"Sample Count:    {sample_count:,} (~{sample_count/sample_rate:.0f}s)")
-print(f"LNA Gain:        {lna_gain} dB")
-print(f"Mixer Gain:      {mix_gain} dB")
-print(f"VGA Gain:        {vga_gain} dB")
-print(f"Output File:     {bin_file}")
-print("="*50 + "\n")
-
-print(f"Starting capture...")
-airspy_rx_command = [
-    "airspy_rx",
-    "-b1",
-    "-l", str(lna_gain),
-    "-m", str(mix_gain),
-    "-v", str(vga_gain),
-    "-f", str(freq),
-    "-a", str(sample_rate),
-    "-n", str(sample_count),
-    "-r", bin_file
-]
-subprocess.run(airspy_rx_command, check=True)
-
-
-
-print("Proceeding to step 2")
-# --- Step 2: Process the .bin file ---
-print("Processing FFT...")
-chunk_samples = fft_size
-spectrum_accum = np.zeros(fft_size)
-n_chunks = 0
-
-with open(bin_file, 'rb') as f:
+output_dir = "../output"
+OUTPUT_FORMATS = ("npz", "campaign")
+# Capture command; airspy_replay.py stands in for it without an Airspy
+AIRSPY_RX = os.environ.get("AIRSPY_RX", "airspy_rx")
+
+
+@dataclass
+class ObservationResult:
+    """What one Observer.run() produced"""
+    npz_path: str                 # None with --capture-only or when appended to a campaign container
+    bin_path: str                 # Raw capture (deleted after processing unless --keep-bin)
+    timestamp: str
+    name: str
+    mode: str
+    windows: int = 0              # FFT windows averaged into the spectrum
+    stats: dict = field(default_factory=dict)     # Spectrum statistics, as saved in the .npz
+    timings: dict = field(default_factory=dict)   # Seconds: capture_s, processing_s, save_s, total_s, fft_s, fft_plan_s
+    stages: dict = field(default_factory=dict)    # StageTimer.as_dict(): wall_s, cpu_s, bytes, samples_per_s per stage
+    campaign_path: str = None     # Container the run was appended to (--output-format campaign)
+    campaign_row: int = None
+
+    @property
+    def output_path(self):
+        """The .npz, or "<container>#<row>" for a campaign run"""
+        if self.campaign_path is not None:
+            return run_ref(self.campaign_path, self.campaign_row)
+        return self.npz_path
+
+
+@contextlib.contextmanager
+def profiled(profiler):
+    """Run the block under profiler (a cProfile.Profile), or as is if None"""
+    if profiler is None:
+        yield
+        return
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+
+def spectrum_statistics(spectrum_accum, freq_axis, fft_size):
+    """Summary statistics of an averaged spectrum, as stored in the .npz"""
+    # 1. Peak signal strength
+    peak_power = np.max(spectrum_accum)
+    peak_power_db = 10 * np.log10(peak_power + 1e-10)  # Convert to dB, avoid log(0)
+
+    # 2. Noise floor estimate (use 25th percentile to avoid outliers)
+    noise_floor = np.percentile(spectrum_accum, 25)
+    noise_floor_db = 10 * np.log10(noise_floor + 1e-10)
+
+    # 3. Signal-to-noise ratio
+    snr_db = peak_power_db - noise_floor_db
+
+    # 4. Frequency of peak signal
+    peak_idx = np.argmax(spectrum_accum)
+    peak_frequency_hz = freq_axis[peak_idx]
+
+    # 5. Offset from hydrogen line (1420.405751 MHz)
+    hydrogen_line_hz = freq * 1e6  # Convert MHz to Hz
+    freq_offset_khz = (peak_frequency_hz - hydrogen_line_hz) / 1000
+
+    # 6. RFI detection - bins with power > 10 dB above noise floor
+    rfi_threshold = noise_floor * 10  # 10 dB = 10x power
+    strong_signals = spectrum_accum > rfi_threshold
+    num_strong_bins = np.sum(strong_signals)
+    rfi_percentage = (num_strong_bins / fft_size) * 100
+
+    # 7. Median power (another robustness metric)
+    median_power = np.median(spectrum_accum)
+    median_power_db = 10 * np.log10(median_power + 1e-10)
+
+    return dict(
+        peak_power_db=float(peak_power_db),
+        noise_floor_db=float(noise_floor_db),
+        median_power_db=float(median_power_db),
+        snr_db=float(snr_db),
+        peak_frequency_hz=float(peak_frequency_hz),
+        hydrogen_offset_khz=float(freq_offset_khz),
+        rfi_percentage=float(rfi_percentage),
+    )
+
+
+class Observer:
+    """
+    Runs observations in this process. FFT backends (and their plans) and
+    SpectrumAccumulator buffers are kept between runs with the same settings,
+    so only the first run pays for them.
+    """
+
+    def __init__(self):
+        self._backends = {}
+        self._engines = {}
+        self._throttle = AdaptiveThrottle()
+
+    def backend(self, cfg):
+        """FFT backend for cfg, created on first use"""
+        key = (cfg.fft_backend, cfg.fft_size, cfg.fft_threads, cfg.precision)
+        if key not in self._backends:
+            self._backends[key] = get_backend(cfg.fft_backend, cfg.fft_size, cfg.fft_threads, cfg.precision)
+        return self._backends[key]
+
+    def engine(self, cfg, backend, **state):
+        """SpectrumAccumulator for cfg, reset with this run's state objects"""
+        key = (cfg.fft_size, cfg.batch_windows, backend.name, cfg.precision, cfg.compare_precision,
+               cfg.channelizer, cfg.pfb_taps)
+        engine = self._engines.get(key)
+        if engine is None:
+            engine = SpectrumAccumulator(cfg.fft_size, batch_windows=cfg.batch_windows, backend=backend,
+                                         precision=cfg.precision, compare_precision=cfg.compare_precision,
+                                         channelizer=cfg.channelizer, pfb_taps=cfg.pfb_taps)
+            self._engines[key] = engine
+        engine.reset(**state)
+        return engine
+
+    def throttle(self, cfg):
+        """
+        cfg adapted to the node's temperature and load if cfg.adaptive, and
+        the fields that record the decision in the .npz
+        """
+        if not cfg.adaptive:
+            return cfg, {}
+        optional = [name for name, enabled in (("compare_precision", cfg.compare_precision),
+                                               ("waterfall", cfg.waterfall_seconds > 0),
+                                               ("sk", not cfg.no_sk and cfg.sk_exclude == "off")) if enabled]
+        plan = self._throttle.plan(cfg.workers or auto_workers(), cfg.batch_windows, optional)
+        changes = dict(workers=plan.workers, batch_windows=plan.batch_windows)
+        if "compare_precision" in plan.deferred:
+            changes["compare_precision"] = False
+        if "waterfall" in plan.deferred:
+            changes["waterfall_seconds"] = 0
+        if "sk" in plan.deferred:
+            changes["no_sk"] = True
+        temp = f"{plan.cpu_temp:.1f}°C" if plan.cpu_temp is not None else "no sensor"
+        print(f"Throttle:        {plan.level} ({temp}, load {plan.load:.2f}/core) → {plan.workers} worker(s), "
+              f"batch {plan.batch_windows}" + (f", deferred {', '.join(plan.deferred)}" if plan.deferred else ""))
+        if plan.reason:
+            print(f"                 {plan.reason}")
+        fields = dict(
+            throttle_level=plan.level,
+            throttle_reason=plan.reason,
+            throttle_deferred=",".join(plan.deferred),
+            throttle_workers=plan.workers,
+            throttle_batch_windows=plan.batch_windows,
+            cpu_temp_c=plan.cpu_temp if plan.cpu_temp is not None else np.nan,
+            load_per_core=plan.load,
+        )
+        return argparse.Namespace(**{**vars(cfg), **changes}), fields
+
+    def run(self, cfg):
+        """
+        Capture (unless cfg.from_file) and process one observation.
+
+        Args:
+            cfg: Config from parse_config()
+
+        Returns:
+            ObservationResult
+        """
+        t_start = time.perf_counter()
+        timings = {}
+        timer = StageTimer()
+        fft_size = cfg.fft_size       # FFT window size (default 8192)
+        bin_file = cfg.from_file or cfg.bin_file
+
+        timestamp = cfg.timestamp or time.strftime("%Y%m%d_%H%M%S")
+        # Sanitize observation name (replace spaces/special chars with underscores)
+        safe_name = "".join(c if c.isalnum() or c in ('-', '_') else '_' for c in cfg.name)
+        npz_file = f"{output_dir}/{safe_name}_{timestamp}.npz"
+        result = ObservationResult(npz_path=None, bin_path=bin_file, timestamp=timestamp,
+                                   name=cfg.name, mode=cfg.mode)
+
+        # --- Step 1: Capture IQ data ---
+        print("\n" + "="*50)
+        print("           CAPTURE CONFIGURATION")
+        print("="*50)
+        print(f"Frequency:       {freq} MHz (Hydrogen line)")
+        print(f"Sample Rate:     {sample_rate/1e6:.1f} MSPS")
+        print(f"Sample Count:    {sample_count:,} (~{sample_count/sample_rate:.0f}s)")
+        print(f"LNA Gain:        {lna_gain} dB")
+        print(f"Mixer Gain:      {mix_gain} dB")
+        print(f"VGA Gain:        {vga_gain} dB")
+        print(f"Output File:     {'stdout (streaming)' if cfg.stream else bin_file}")
+        print("="*50 + "\n")
+
+        # Digital down-conversion (zoom FFT): the FFT then runs at a decimated rate
+        spectrum_rate = sample_rate
+        if cfg.zoom_bandwidth > 0:
+            zoom = DownConverter(sample_rate, cfg.zoom_offset, cfg.zoom_bandwidth, cfg.zoom_taps or None)
+            spectrum_rate = zoom.output_rate
+            print(f"Zoom:            {cfg.zoom_offset/1e3:+.1f} kHz ± {cfg.zoom_bandwidth/2e3:.1f} kHz "
+                  f"(decimate x{zoom.decimation}, {spectrum_rate/fft_size:.1f} Hz/bin)")
+
+        def make_frontend():
+            """Fresh DownConverter for the configured zoom, or None if disabled"""
+            if cfg.zoom_bandwidth <= 0:
+                return None
+            return DownConverter(sample_rate, cfg.zoom_offset, cfg.zoom_bandwidth, cfg.zoom_taps or None)
+
+        def make_waterfall():
+            """Empty Waterfall for the configured sub-integration, or None if disabled"""
+            if cfg.waterfall_seconds <= 0:
+                return None
+            windows_per_row = max(round(cfg.waterfall_seconds * spectrum_rate / fft_size), 1)
+            return Waterfall(fft_size, windows_per_row, decimate=cfg.waterfall_decimate, dtype=cfg.waterfall_dtype)
+
+        def make_sk():
+            """Empty SpectralKurtosis for the configured flagging, or None if disabled"""
+            if cfg.no_sk:
+                return None
+            return SpectralKurtosis(fft_size, sigma=cfg.sk_sigma, exclude=cfg.sk_exclude)
+
+        def make_blanker():
+            """Fresh ImpulseBlanker for the configured blanking, or None if disabled"""
+            if cfg.blank is None:
+                return None
+            return ImpulseBlanker(threshold=cfg.blank_threshold, action=cfg.blank)
+
+        def state_objects():
+            """Fresh per-run state objects for the engine"""
+            return dict(waterfall=make_waterfall(), sk=make_sk(), blanker=make_blanker(), frontend=make_frontend())
+
+        def accumulate_spectrum(f):
+            """Average |FFT|^2 over consecutive fft_size windows of raw int16 IQ read from f"""
+            engine = self.engine(cfg, fft_backend, **state_objects())
+            engine.consume(f)
+            return engine
+
+        fft_backend = self.backend(cfg)
+        fft_backend.fft_seconds = fft_backend.plan_seconds = 0.0
+        print(f"FFT Backend:     {fft_backend.name} ({fft_backend.threads} thread(s))")
+
+        if not cfg.from_file:
+            print(f"Starting capture...")
+        airspy_rx_command = [
+            *shlex.split(cfg.airspy_rx),
+            "-b1",
+            "-l", str(lna_gain),
+            "-m", str(mix_gain),
+            "-v", str(vga_gain),
+            "-f", str(freq),
+            "-a", str(sample_rate),
+            "-n", str(sample_count),
+            "-r", "-" if cfg.stream else bin_file
+        ]
+
+        throttle_fields = {}
+        profiler = cProfile.Profile() if cfg.profile else None
+        t0 = time.perf_counter()
+        if cfg.from_file:
+            print(f"Skipping capture, processing {bin_file} (captured {timestamp})")
+        elif cfg.stream:
+            # --- Steps 1+2 combined: FFT the samples as airspy_rx writes them to the pipe ---
+            cfg, throttle_fields = self.throttle(cfg)
+            print("Processing FFT (streaming)...")
+            if cfg.workers != 1 and not cfg.adaptive:
+                print("Note: --workers is ignored with --stream (samples arrive in order from one pipe)")
+            with timer.stage("capture+fft") as stage, profiled(profiler):
+                proc = subprocess.Popen(airspy_rx_command, stdout=subprocess.PIPE)
+                try:
+                    engine = accumulate_spectrum(proc.stdout)
+                finally:
+                    proc.stdout.close()
+                    returncode = proc.wait()
+                stage.bytes, stage.samples = engine.bytes_in, engine.bytes_in // 4
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, airspy_rx_command)
+        else:
+            with timer.stage("capture") as stage:
+                subprocess.run(airspy_rx_command, check=True)
+                stage.bytes = os.path.getsize(bin_file)
+                stage.samples = stage.bytes // 4
+            timings["capture_s"] = time.perf_counter() - t0
+            if cfg.capture_only:
+                print("Capture complete (processing deferred)")
+                timings["total_s"] = time.perf_counter() - t_start
+                result.timings = timings
+                result.stages = timer.as_dict()
+                return result
+
+        t0 = time.perf_counter()
+        if not cfg.stream:
+            # Decided now rather than before the capture: the node may have warmed up since
+            cfg, throttle_fields = self.throttle(cfg)
+            print("Proceeding to step 2")
+            # --- Step 2: Process the .bin file ---
+            with timer.stage("process") as stage, profiled(profiler):
+                if cfg.workers != 1:
+                    workers = cfg.workers or auto_workers()
+                    print(f"Processing FFT ({workers} workers)...")
+                    engine = process_file_parallel(bin_file, fft_size, workers=workers, batch_windows=cfg.batch_windows,
+                                                   backend=fft_backend, precision=cfg.precision,
+                                                   compare_precision=cfg.compare_precision, channelizer=cfg.channelizer,
+                                                   pfb_taps=cfg.pfb_taps, **state_objects())
+                else:
+                    print("Processing FFT...")
+                    with open(bin_file, 'rb') as f:
+                        engine = accumulate_spectrum(f)
+                stage.bytes, stage.samples = engine.bytes_in, engine.bytes_in // 4
+        # Parts of the stage above, measured inside the engine (wall time only;
+        # with --workers, summed over the workers)
+        processing_stage = "capture+fft" if cfg.stream else "process"
+        if engine.read_seconds:
+            timer.add(f"{processing_stage}.read", engine.read_seconds, nbytes=engine.bytes_in)
+        timer.add(f"{processing_stage}.fft", fft_backend.fft_seconds, samples=engine.bytes_in // 4)
+        if fft_backend.plan_seconds:
+            timer.add(f"{processing_stage}.fft_plan", fft_backend.plan_seconds)
+        if profiler is not None:
+            profiler.dump_stats(cfg.profile)
+            print(f"Profile of the processing stage saved to {cfg.profile}"
+                  + (" (parent process only)" if cfg.workers != 1 and not cfg.stream else ""))
+
+        stats_stage = timer.start("statistics")
+        spectrum_accum, n_chunks = engine.spectrum(), engine.n_windows
+        precision_report = engine.precision_report() or {"max_rel_dev": np.nan, "mean_rel_dev": np.nan}
+        fft_backend.save_wisdom()
+        freq_axis = np.fft.fftshift(np.fft.fftfreq(fft_size, d=1/spectrum_rate))
+        if engine.frontend is not None:
+            freq_axis += cfg.zoom_offset
+
+        # Optional fields, only present in the .npz when the feature is enabled
+        extra_fields = dict(throttle_fields)
+        if engine.waterfall is not None:
+            rows, scales, counts = engine.waterfall.arrays()
+            extra_fields.update(
+                waterfall=rows,
+                waterfall_scale=scales,
+                # Row centre times, seconds from start of capture
+                waterfall_time_s=(np.cumsum(counts) - counts / 2) * fft_size / spectrum_rate,
+                waterfall_freq_axis=freq_axis.reshape(-1, cfg.waterfall_decimate).mean(axis=1),
+            )
+
+        if engine.sk is not None:
+            sk, rfi_mask = engine.rfi_flags()
+            extra_fields.update(
+                sk=sk.astype(np.float32),
+                rfi_mask=rfi_mask,
+                sk_flagged_bins=int(rfi_mask.sum()),
+                sk_flagged_windows=engine.sk.flagged_windows,
+                sk_excluded_fraction=engine.sk.excluded_cells / max(engine.sk.total_cells, 1),
+            )
+
+        if engine.pfb is not None:
+            extra_fields.update(pfb_taps=cfg.pfb_taps)
+        if engine.frontend is not None:
+            extra_fields.update(
+                zoom_offset_hz=cfg.zoom_offset,
+                zoom_bandwidth_hz=cfg.zoom_bandwidth,
+                decimation=engine.frontend.decimation,
+                spectrum_sample_rate=spectrum_rate,
+            )
+        if engine.blanker is not None:
+            extra_fields.update(
+                blanked_fraction=engine.blanker.blanked_fraction,
+                blanked_windows=engine.blanker.blanked_windows,
+            )
+
+        # --- Step 2.5: Calculate Spectrum Statistics ---
+        print("Calculating spectrum statistics...")
+        stats = spectrum_statistics(spectrum_accum, freq_axis, fft_size)
+        rfi_percentage = stats["rfi_percentage"]
+        timer.stop(stats_stage)
+        timings["processing_s"] = time.perf_counter() - t0
+        # Throughput of the FFT stage, for comparing nodes (realtime_factor > 1 keeps up with the SDR)
+        samples_per_s = timer.samples_per_s(processing_stage)
+
+        # Print statistics to console
+        print("\n" + "="*50)
+        print("           SPECTRUM STATISTICS")
+        print("="*50)
+        print(f"Peak Power:        {stats['peak_power_db']:>8.1f} dB")
+        print(f"Noise Floor:       {stats['noise_floor_db']:>8.1f} dB (25th percentile)")
+        print(f"Median Power:      {stats['median_power_db']:>8.1f} dB")
+        print(f"SNR:               {stats['snr_db']:>8.1f} dB")
+        print("-"*50)
+        print(f"Peak Frequency:    {stats['peak_frequency_hz'] / 1e6:>12.6f} MHz")
+        print(f"Target (H-line):   {freq:>12.6f} MHz")
+        print(f"Frequency Offset:  {stats['hydrogen_offset_khz']:>+11.2f} kHz")
+        print("-"*50)
+        print(f"FFT Windows:       {n_chunks:>8d}" + (f" (PFB, {cfg.pfb_taps} taps)" if cfg.channelizer == "pfb" else ""))
+        print(f"FFT Backend:       {fft_backend.name:>8s} ({fft_backend.fft_seconds:.2f}s FFT, {fft_backend.plan_seconds:.2f}s planning)")
+        print(f"FFT Precision:     {cfg.precision:>8s}")
+        if "waterfall" in extra_fields:
+            print(f"Waterfall:         {extra_fields['waterfall'].shape[0]:>8d} rows x {extra_fields['waterfall'].shape[1]} channels ({cfg.waterfall_dtype})")
+        if engine.compare_precision:
+            print(f"  vs double:       {precision_report['max_rel_dev']:>8.1e} max / {precision_report['mean_rel_dev']:.1e} mean relative deviation")
+        print(f"Throughput:        {samples_per_s / 1e6:>8.2f} Msamples/s ({samples_per_s / sample_rate:.1f}x realtime)")
+        print(f"RFI Indicator:     {rfi_percentage:>8.1f}% bins >10dB")
+        if "blanked_fraction" in extra_fields:
+            print(f"Blanked:           {extra_fields['blanked_fraction']*100:>8.4f}% of samples ({cfg.blank}, {extra_fields['blanked_windows']} windows hit)")
+        if "sk" in extra_fields:
+            print(f"SK Flagged Bins:   {extra_fields['sk_flagged_bins']:>8d} ({cfg.sk_sigma:g} sigma)")
+            if cfg.sk_exclude != "off":
+                print(f"SK Excluded:       {extra_fields['sk_excluded_fraction']*100:>8.2f}% of bin-windows, {extra_fields['sk_flagged_windows']} windows dropped")
+        if rfi_percentage < 5:
+            print(f"RFI Assessment:    ✅ Clean (< 5%)")
+        elif rfi_percentage < 15:
+            print(f"RFI Assessment:    ⚠️  Moderate (5-15%)")
+        else:
+            print(f"RFI Assessment:    ❌ High (> 15%)")
+        print("="*50 + "\n")
+
+        # --- Step 3: Save output to .npz (or the campaign container) ---
+        t0 = time.perf_counter()
+        save_stage = timer.start("save")
+        fields = dict(
+            spectrum=spectrum_accum,
+            freq_axis=freq_axis,
+            sample_rate=sample_rate,
+            fft_size=fft_size,
+            averaging_windows=n_chunks,
+            channelizer=cfg.channelizer,
+            timestamp=timestamp,
+            mode=cfg.mode,
+            observation_name=cfg.name,
+            # Spectrum statistics
+            **stats,
+            # Gain settings
+            lna_gain=lna_gain,
+            mix_gain=mix_gain,
+            vga_gain=vga_gain,
+            # FFT backend used, for comparing throughput across nodes
+            fft_backend=fft_backend.name,
+            fft_threads=fft_backend.threads,
+            fft_time_s=fft_backend.fft_seconds,
+            fft_plan_time_s=fft_backend.plan_seconds,
+            # FFT precision and, if measured, its deviation from double precision
+            precision=cfg.precision,
+            precision_max_rel_dev=precision_report["max_rel_dev"],
+            precision_mean_rel_dev=precision_report["mean_rel_dev"],
+            # Per-stage wall/CPU seconds, bytes and samples/s up to this save
+            # (the save itself is only in the log)
+            samples_per_s=samples_per_s,
+            realtime_factor=samples_per_s / sample_rate,
+            **timer.fields(),
+            **extra_fields
+        )
+        saved_path, saved_bytes = npz_file, None
+        if cfg.output_format == "campaign":
+            container = cfg.campaign or f"{output_dir}/{safe_name}.campaign"
+            print(f"Appending result to {container}...")
+            try:
+                store = CampaignStore(container)
+                result.campaign_row = store.append(fields)
+                result.campaign_path = container
+                saved_path, saved_bytes = run_ref(container, result.campaign_row), store.appended_bytes
+            except CampaignMismatch as e:
+                # e.g. a different --fft-size than the container's runs: keep the run as an .npz
+                print(f"⚠️  Not appended ({e}), saving {npz_file} instead")
+        if result.campaign_path is None:
+            print(f"Saving result to {npz_file}...")
+            np.savez_compressed(npz_file, **fields)
+            saved_bytes = os.path.getsize(npz_file)
+            result.npz_path = npz_file
+        save_stage.bytes = saved_bytes
+        timer.stop(save_stage)
+        timings["save_s"] = time.perf_counter() - t0
+
+        # Metadata and statistics into the local catalog, so selecting runs needs no .npz
+        if cfg.catalog:
+            try:
+                with timer.stage("catalog"):
+                    record_observation(saved_path, fields, cfg.catalog, file_size=saved_bytes)
+            except Exception as e:
+                print(f"⚠️  Catalog not updated ({cfg.catalog}): {e}")
+
+        # --- Step 4: Clean up ---
+        if not cfg.stream and not cfg.keep_bin:
+            print("Deleting raw .bin file...")
+            with timer.stage("cleanup"):
+                os.remove(bin_file)
+
+        print("\n" + "="*50)
+        print("           STAGE TIMING")
+        print("="*50)
+        print(timer.report())
+        print("="*50)
+        print("Done ✅")
+        timings.update(fft_s=fft_backend.fft_seconds, fft_plan_s=fft_backend.plan_seconds,
+                       total_s=time.perf_counter() - t_start)
+        result.windows = n_chunks
+        result.stats = stats
+        result.timings = timings
+        result.stages = timer.as_dict()
+        return result
+
+
+def _exit_on_sigterm(signum, frame):
+    # Unwinds through subprocess.run, which then kills airspy_rx instead of orphaning it
+    raise SystemExit(f"terminated by signal {signum}")
+
+
+def _worker_loop(conn):
+    """Child side of ObservationWorker: run each received argv with one Observer"""
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    observer = Observer()
     while True:
-        data = np.frombuffer(f.read(chunk_samples * 4), dtype=np.int16)
-        if len(data) < chunk_samples * 2:
+        try:
+            argv = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if argv is None:
+            break
+        try:
+            reply = ("ok", observer.run(parse_config(argv)))
+        except (KeyboardInterrupt, SystemExit):
+            # Ctrl+C reaches the parent too; a SIGTERM comes from ObservationWorker.kill()
             break
-        iq = data[::2].astype(np.float32) + 1j * data[1::2].astype(np.float32)
-	# DC offset removal (important)
-        iq = iq - np.mean(iq)
-        windowed = iq * np.hanning(chunk_samples)
-        fft = np.fft.fftshift(np.fft.fft(windowed))
-        spectrum_accum += np.abs(fft)**2
-        n_chunks += 1
-
-spectrum_accum /= max(n_chunks, 1)
-freq_axis = np.fft.fftshift(np.fft.fftfreq(fft_size, d=1/sample_rate))
-
-# --- Step 2.5: Calculate Spectrum Statistics ---
-print("Calculating spectrum statistics...")
-
-# 1. Peak signal strength
-peak_power = np.max(spectrum_accum)
-peak_power_db = 10 * np.log10(peak_power + 1e-10)  # Convert to dB, avoid log(0)
-
-# 2. Noise floor estimate (use 25th percentile to avoid outliers)
-noise_floor = np.percentile(spectrum_accum, 25)
-noise_floor_db = 10 * np.log10(noise_floor + 1e-10)
-
-# 3. Signal-to-noise ratio
-snr_db = peak_power_db - noise_floor_db
-
-# 4. Frequency of peak signal
-peak_idx = np.argmax(spectrum_accum)
-peak_frequency_hz = freq_axis[peak_idx]
-peak_frequency_mhz = peak_frequency_hz / 1e6
-
-# 5. Offset from hydrogen line (1420.405751 MHz)
-hydrogen_line_hz = freq * 1e6  # Convert MHz to Hz
-freq_offset_khz = (peak_frequency_hz - hydrogen_line_hz) / 1000
-
-# 6. RFI detection - bins with power > 10 dB above noise floor
-rfi_threshold = noise_floor * 10  # 10 dB = 10x power
-strong_signals = spectrum_accum > rfi_threshold
-num_strong_bins = np.sum(strong_signals)
-rfi_percentage = (num_strong_bins / fft_size) * 100
-
-# 7. Median power (another robustness metric)
-median_power = np.median(spectrum_accum)
-median_power_db = 10 * np.log10(median_power + 1e-10)
-
-# Print statistics to console
-print("\n" + "="*50)
-print("           SPECTRUM STATISTICS")
-print("="*50)
-print(f"Peak Power:        {peak_power_db:>8.1f} dB")
-print(f"Noise Floor:       {noise_floor_db:>8.1f} dB (25th percentile)")
-print(f"Median Power:      {median_power_db:>8.1f} dB")
-print(f"SNR:               {snr_db:>8.1f} dB")
-print("-"*50)
-print(f"Peak Frequency:    {peak_frequency_mhz:>12.6f} MHz")
-print(f"Target (H-line):   {freq:>12.6f} MHz")
-print(f"Frequency Offset:  {freq_offset_khz:>+11.2f} kHz")
-print("-"*50)
-print(f"FFT Windows:       {n_chunks:>8d}")
-print(f"RFI Indicator:     {rfi_percentage:>8.1f}% bins >10dB")
-if rfi_percentage < 5:
-    print(f"RFI Assessment:    ✅ Clean (< 5%)")
-elif rfi_percentage < 15:
-    print(f"RFI Assessment:    ⚠️  Moderate (5-15%)")
-else:
-    print(f"RFI Assessment:    ❌ High (> 15%)")
-print("="*50 + "\n")
-
-# --- Step 3: Save output to .npz ---
-print(f"Saving result to {npz_file}...")
-np.savez_compressed(
-    npz_file,
-    spectrum=spectrum_accum,
-    freq_axis=freq_axis,
-    sample_rate=sample_rate,
-    fft_size=fft_size,
-    averaging_windows=n_chunks,
-    timestamp=timestamp,
-    mode=args.mode,
-    observation_name=args.name,
-    # Spectrum statistics
-    peak_power_db=peak_power_db,
-    noise_floor_db=noise_floor_db,
-    median_power_db=median_power_db,
-    snr_db=snr_db,
-    peak_frequency_hz=peak_frequency_hz,
-    hydrogen_offset_khz=freq_offset_khz,
-    rfi_percentage=rfi_percentage,
-    # Gain settings
-    lna_gain=lna_gain,
-    mix_gain=mix_gain,
-    vga_gain=vga_gain
-)
-
-# --- Step 4: Clean up ---
-print("Deleting raw .bin file...")
-os.remove(bin_file)
-
-print("Done ✅")
-print(npz_file)
+        except Exception as e:
+            traceback.print_exc()
+            reply = ("error", e)
+        sys.stdout.flush()
+        try:
+            conn.send(reply)
+        except Exception:
+            # The exception itself didn't pickle
+            conn.send(("error", RuntimeError(repr(reply[1]))))
+
+
+def _worker_main(fd):
+    """Entry point of an ObservationWorker process: serve the parent on the connection at fd"""
+    _worker_loop(multiprocessing.connection.Connection(fd))
+
+
+class ObservationWorker:
+    """
+    A persistent child process running observations with one Observer, so
+    numpy, FFT plans and engine buffers stay loaded between runs. Output goes
+    to the parent's stdout.
+
+    The child is a fresh interpreter (fork + exec), never a bare fork of the
+    caller: run_observations.py has heartbeat, upload and resource-sampler
+    threads running when a worker is restarted, and a fork taken while one of
+    them holds a lock (stdout, logging, urllib3) can hang the child.
+    multiprocessing's spawn/forkserver would re-run the caller's __main__.
+    """
+
+    def __init__(self):
+        self._proc = None
+        self._conn = None
+        self._start()
+
+    def _start(self):
+        self._conn, child = multiprocessing.Pipe()
+        here = os.path.dirname(os.path.abspath(__file__))
+        code = (f"import sys; sys.path.insert(0, {here!r}); "
+                f"from capture_and_process import _worker_main; _worker_main({child.fileno()})")
+        # Same process group: Ctrl+C reaches the worker too, as with airspy_rx
+        self._proc = subprocess.Popen([sys.executable, "-c", code], pass_fds=(child.fileno(),))
+        child.close()
+
+    def _alive(self):
+        return self._proc.poll() is None
+
+    def run(self, argv, timeout=None):
+        """
+        Run one observation in the worker.
+
+        Args:
+            argv: capture_and_process.py arguments, e.g. ["--mode", "on"]
+            timeout: Seconds to wait before killing the worker and raising TimeoutError
+
+        Returns:
+            ObservationResult; exceptions raised in the worker are re-raised here
+        """
+        if not self._alive():
+            print(f"Observation worker exited (code {self._proc.returncode}), starting a new one", flush=True)
+            self._conn.close()
+            self._start()
+        self._conn.send(list(argv))
+        if not self._conn.poll(timeout):
+            self.kill()
+            raise TimeoutError(f"observation did not finish within {timeout}s")
+        try:
+            status, payload = self._conn.recv()
+        except EOFError:
+            self._proc.wait()
+            raise RuntimeError(f"observation worker died (exit code {self._proc.returncode})")
+        if status == "error":
+            raise payload
+        return payload
+
+    def kill(self):
+        """Stop the worker now (the next run() starts a fresh one)"""
+        self._proc.terminate()
+        try:
+            self._proc.wait(5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+
+    def close(self):
+        """Let the worker finish and exit"""
+        if self._alive():
+            try:
+                self._conn.send(None)
+            except OSError:
+                pass
+            try:
+                self._proc.wait(30)
+            except subprocess.TimeoutExpired:
+                self.kill()
+        self._conn.close()
+
+
+def main(argv=None):
+    result = Observer().run(parse_config(argv))
+    # Last line of output is the file produced, for scripts calling the CLI
+    print(result.output_path or result.bin_path)
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Local SQLite catalog of observations: one row of metadata and statistics per
+run, so selecting runs never needs to decompress an .npz.
+
+capture_and_process.py records every run it saves. Rows stay after the .npz
+is uploaded and deleted; path then only says where it was.
+
+    python3 catalog.py query --name cassiopeia --mode on --where "rfi_percentage < 5"
+    python3 catalog.py query --since 20251201 --where "snr_db >= 8" --format csv > good.csv
+    python3 catalog.py rebuild ../output archive/ --jobs 4     # backfill from existing .npz files and containers
+
+In Python:
+    with Catalog() as cat:
+        rows = cat.query(name="cassiopeia", mode="on", where=["rfi_percentage < 5"])
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Next to the scripts, like the heartbeat queue; not in the output dir, which is emptied by uploads
+CATALOG_PATH = os.environ.get("CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.sqlite"))
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", os.path.join(os.path.dirname(__file__), "..", "output"))
+
+# Scalar .npz fields kept in the catalog, with their SQLite types
+COLUMNS = {
+    # Key: one row per observation_name, mode, timestamp and gain settings
+    "observation_name": "TEXT",
+    "mode": "TEXT",
+    "timestamp": "TEXT",
+    "lna_gain": "INTEGER",
+    "mix_gain": "INTEGER",
+    "vga_gain": "INTEGER",
+    # Processing setup
+    "sample_rate": "INTEGER",
+    "fft_size": "INTEGER",
+    "averaging_windows": "INTEGER",
+    "channelizer": "TEXT",
+    "precision": "TEXT",
+    "fft_backend": "TEXT",
+    "zoom_offset_hz": "REAL",
+    "zoom_bandwidth_hz": "REAL",
+    # Spectrum statistics
+    "peak_power_db": "REAL",
+    "noise_floor_db": "REAL",
+    "median_power_db": "REAL",
+    "snr_db": "REAL",
+    "peak_frequency_hz": "REAL",
+    "hydrogen_offset_khz": "REAL",
+    "rfi_percentage": "REAL",
+    "sk_flagged_bins": "INTEGER",
+    "blanked_fraction": "REAL",
+    # Node performance
+    "samples_per_s": "REAL",
+    "realtime_factor": "REAL",
+    "throttle_level": "TEXT",
+    "cpu_temp_c": "REAL",
+}
+KEY = ("observation_name", "mode", "timestamp", "lna_gain", "mix_gain", "vga_gain")
+FILE_COLUMNS = {"path": "TEXT", "file_size": "INTEGER", "file_mtime": "REAL", "recorded_at": "TEXT"}
+ALL_COLUMNS = {**COLUMNS, **FILE_COLUMNS}
+DEFAULT_QUERY_COLUMNS = ["timestamp", "observation_name", "mode", "snr_db", "rfi_percentage",
+                         "peak_frequency_hz", "averaging_windows", "path"]
+OPERATORS = ("<=", ">=", "!=", "=", "<", ">")
+_CONDITION = re.compile(r"^\s*(\w+)\s*(<=|>=|!=|=|<|>)\s*(.+?)\s*$")
+
+
+def _python_value(value):
+    """numpy scalar / 0-d array → int, float, str or None for SQLite"""
+    if isinstance(value, np.ndarray):
+        if value.ndim != 0:
+            return None
+        value = value.item()
+    elif isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    return None
+
+
+def row_from_fields(fields):
+    """Catalog columns from a mapping of .npz fields (dict or np.load result); missing ones are None"""
+    keys = set(fields.keys()) if hasattr(fields, "keys") else set(fields.files)
+    row = {}
+    for name in COLUMNS:
+        if name not in keys:
+            row[name] = None
+            continue
+        try:
+            row[name] = _python_value(fields[name])
+        except ValueError:
+            # Object arrays need allow_pickle; never worth it for a catalog value
+            row[name] = None
+    return row
+
+
+def read_npz_row(path):
+    """
+    Catalog row for an .npz file. np.load is lazy per field, so only the
+    scalars are decompressed, never spectrum or freq_axis.
+    """
+    with np.load(path) as d:
+        row = row_from_fields(d)
+    st = os.stat(path)
+    row.update(path=os.path.abspath(path), file_size=st.st_size, file_mtime=st.st_mtime)
+    return row
+
+
+def _safe_read(path):
+    try:
+        return path, read_npz_row(path), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def parse_condition(text):
+    """'rfi_percentage < 5' → ('rfi_percentage < ?', 5.0); column and operator are checked"""
+    m = _CONDITION.match(text)
+    if not m:
+        raise ValueError(f"can't parse condition {text!r} (expected e.g. 'rfi_percentage < 5')")
+    column, op, value = m.groups()
+    if column not in ALL_COLUMNS:
+        raise ValueError(f"unknown column {column!r}")
+    value = value.strip("'\"")
+    if ALL_COLUMNS[column] != "TEXT":
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError(f"{column} needs a number, got {value!r}") from None
+    return f"{column} {op} ?", value
+
+
+class Catalog:
+    """
+    The catalog database. Safe to write from several processes (WAL mode, busy
+    timeout), e.g. the capture and processing workers of a pipelined campaign.
+    """
+
+    def __init__(self, path=CATALOG_PATH, timeout=30):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=timeout)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self._create()
+
+    def _create(self):
+        columns = ",\n".join(f"    {name} {kind}" for name, kind in ALL_COLUMNS.items())
+        with self.db:
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS observations (\n"
+                            f"    id INTEGER PRIMARY KEY,\n{columns},\n    UNIQUE ({', '.join(KEY)})\n)")
+            # Catalogs made before a column existed get it added
+            existing = {r["name"] for r in self.db.execute("PRAGMA table_info(observations)")}
+            for name, kind in ALL_COLUMNS.items():
+                if name not in existing:
+                    self.db.execute(f"ALTER TABLE observations ADD COLUMN {name} {kind}")
+            for name in ("observation_name, mode, timestamp", "timestamp", "snr_db", "rfi_percentage"):
+                index = "idx_" + name.replace(", ", "_")
+                self.db.execute(f"CREATE INDEX IF NOT EXISTS {index} ON observations ({name})")
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, row):
+        """Insert or update one observation (a row from row_from_fields/read_npz_row)"""
+        self.record_many([row])
+
+    def record_many(self, rows):
+        """Insert or update observations in one transaction"""
+        names = list(ALL_COLUMNS)
+        updates = ", ".join(f"{n} = excluded.{n}" for n in names if n not in KEY)
+        sql = (f"INSERT INTO observations ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+               f"ON CONFLICT ({', '.join(KEY)}) DO UPDATE SET {updates}")
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self.db:
+            self.db.executemany(sql, [[{**row, "recorded_at": now}.get(n) for n in names] for row in rows])
+
+    def query(self, name=None, mode=None, since=None, until=None, where=(), columns=None,
+              order_by="timestamp", descending=False, limit=None):
+        """
+        Observations matching every filter, as a list of dicts.
+
+        Args:
+            name, mode: Exact observation_name / mode
+            since, until: Timestamp bounds (YYYYMMDD or YYYYMMDD_HHMMSS, inclusive)
+            where: Conditions like "rfi_percentage < 5" (see parse_condition)
+            columns: Columns to return (default: all)
+            order_by: Sort column (default: timestamp)
+        """
+        columns = list(columns or ALL_COLUMNS)
+        for c in columns + [order_by]:
+            if c not in ALL_COLUMNS:
+                raise ValueError(f"unknown column {c!r}")
+        clauses, params = [], []
+        if name is not None:
+            clauses.append("observation_name = ?")
+            params.append(name)
+        if mode is not None:
+            clauses.append("mode = ?")
+            params.append(mode)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            # A bare date covers the whole day
+            clauses.append("timestamp <= ?")
+            params.append(until if "_" in until else until + "_999999")
+        for condition in where:
+            clause, value = parse_condition(condition)
+            clauses.append(clause)
+            params.append(value)
+        sql = f"SELECT {', '.join(columns)} FROM observations"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {order_by} {'DESC' if descending else 'ASC'}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [dict(r) for r in self.db.execute(sql, params)]
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM observations").fetchone()[0]
+
+
+def record_observation(npz_path, fields, path=CATALOG_PATH, file_size=None):
+    """
+    Record a just-saved run from the fields written to npz_path (no re-read of
+    the file). npz_path can also be a campaign container row, "<container>#<row>",
+    with the bytes appended for it as file_size.
+    """
+    row = row_from_fields(fields)
+    st = os.stat(npz_path.rsplit("#", 1)[0] if "#" in npz_path else npz_path)
+    row.update(path=os.path.abspath(npz_path), file_size=st.st_size if file_size is None else file_size,
+               file_mtime=st.st_mtime)
+    with Catalog(path) as cat:
+        cat.record(row)
+
+
+def find_npz(paths):
+    """.npz files in paths (files, directories or glob patterns), sorted, outside campaign containers"""
+    found = set()
+    for p in paths:
+        if os.path.isdir(p):
+            found.update(glob.glob(os.path.join(p, "**", "*.npz"), recursive=True))
+        elif any(c in p for c in "*?["):
+            found.update(f for f in glob.glob(p, recursive=True) if f.endswith(".npz"))
+        elif os.path.exists(p):
+            found.add(p)
+        else:
+            print(f"⚠️  Not found: {p}")
+    # Runs in campaign containers aren't .npz files (extras/ holds only parts of runs)
+    return sorted(f for f in found if ".campaign" + os.sep not in os.path.normpath(f))
+
+
+def campaign_rows(container):
+    """Catalog rows for every run of a campaign container (path "<container>#<row>")"""
+    # Imported here: campaign_store uses find_npz from this module
+    from campaign_store import CampaignStore, run_ref
+
+    store = CampaignStore(container)
+    mtime = os.stat(os.path.join(container, "schema.json")).st_mtime
+    rows = []
+    for run in store.runs():
+        row = row_from_fields(run)
+        row.update(path=os.path.abspath(run_ref(container, run.row)), file_size=None, file_mtime=mtime)
+        rows.append(row)
+    return rows
+
+
+def rebuild(paths, path=CATALOG_PATH, jobs=None, batch=200):
+    """
+    Backfill the catalog from .npz files, reading them in jobs processes, and
+    from campaign containers; returns (recorded, failed {path: error})
+    """
+    from campaign_store import find_campaigns
+
+    files = find_npz(paths)
+    jobs = jobs or os.cpu_count() or 1
+    recorded, failed, pending = 0, {}, []
+    with Catalog(path) as cat:
+        if jobs == 1 or len(files) < 2:
+            results = map(_safe_read, files)
+            pool = None
+        else:
+            pool = ProcessPoolExecutor(max_workers=jobs)
+            results = pool.map(_safe_read, files, chunksize=16)
+        try:
+            for file, row, error in results:
+                if error:
+                    failed[file] = error
+                    continue
+                pending.append(row)
+                if len(pending) >= batch:
+                    cat.record_many(pending)
+                    recorded += len(pending)
+                    pending = []
+            if pending:
+                cat.record_many(pending)
+                recorded += len(pending)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        for container in find_campaigns(paths):
+            try:
+                rows = campaign_rows(container)
+            except Exception as e:
+                failed[container] = f"{type(e).__name__}: {e}"
+                continue
+            cat.record_many(rows)
+            recorded += len(rows)
+    return recorded, failed
+
+
+def _format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.6g}" if abs(value) >= 1e5 else f"{value:.2f}"
+    return str(value)
+
+
+def print_table(rows, columns):
+    shown = [[os.path.basename(v) if c == "path" and v else _format_value(v) for c, v in
+              ((c, r[c]) for c in columns)] for r in rows]
+    widths = [max([len(c)] + [len(s[i]) for s in shown]) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for s in shown:
+        print("  ".join(v.ljust(w) for v, w in zip(s, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query or rebuild the local observation catalog")
+    parser.add_argument("--catalog", type=str, default=CATALOG_PATH, help="Catalog database (default: $CATALOG_PATH or catalog.sqlite next to the scripts)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_query = sub.add_parser("query", help="List observations matching filters")
+    p_query.add_argument("--name", type=str, default=None, help="Observation name")
+    p_query.add_argument("--mode", choices=["on", "off"], default=None)
+    p_query.add_argument("--since", type=str, default=None, help="From this timestamp (YYYYMMDD[_HHMMSS])")
+    p_query.add_argument("--until", type=str, default=None, help="Up to this timestamp (YYYYMMDD[_HHMMSS])")
+    p_query.add_argument("--where", action="append", default=[], help="Condition like 'rfi_percentage < 5' (repeatable; operators: " + " ".join(OPERATORS) + ")")
+    p_query.add_argument("--columns", type=str, default=",".join(DEFAULT_QUERY_COLUMNS), help="Comma-separated columns to show ('all' for every column)")
+    p_query.add_argument("--order-by", type=str, default="timestamp", help="Sort column (default: timestamp)")
+    p_query.add_argument("--desc", action="store_true", help="Sort descending")
+    p_query.add_argument("--limit", type=int, default=None, help="At most this many rows")
+    p_query.add_argument("--format", choices=["table", "csv", "json", "paths"], default="table", help="Output format (default: table; paths = one .npz path per line)")
+
+    p_rebuild = sub.add_parser("rebuild", help="Backfill the catalog from existing .npz files and campaign containers")
+    p_rebuild.add_argument("paths", nargs="*", default=None, help="Files, directories or glob patterns (default: $OUTPUT_DIR)")
+    p_rebuild.add_argument("--jobs", type=int, default=0, help="Reader processes (0 = one per CPU core, default: 0)")
+    args = parser.parse_args(argv)
+
+    if args.command == "rebuild":
+        t0 = time.perf_counter()
+        recorded, failed = rebuild(args.paths or [OUTPUT_DIR], args.catalog, jobs=args.jobs or None)
+        for file, error in failed.items():
+            print(f"❌ {file}: {error}")
+        with Catalog(args.catalog) as cat:
+            total = len(cat)
+        print(f"✅ Recorded {recorded} observation(s) in {time.perf_counter() - t0:.1f}s"
+              f"{f', {len(failed)} unreadable' if failed else ''}; {total} in {args.catalog}")
+        return 1 if failed else 0
+
+    columns = list(ALL_COLUMNS) if args.columns == "all" else [c.strip() for c in args.columns.split(",") if c.strip()]
+    if args.format == "paths":
+        columns = ["path"]
+    t0 = time.perf_counter()
+    try:
+        with Catalog(args.catalog) as cat:
+            rows = cat.query(name=args.name, mode=args.mode, since=args.since, until=args.until, where=args.where,
+                             columns=columns, order_by=args.order_by, descending=args.desc, limit=args.limit)
+    except ValueError as e:
+        parser.error(str(e))
+    elapsed_ms = (time.perf_counter() - t0) * 1e3
+
+    if args.format == "json":
+        json.dump(rows, sys.stdout, indent=2)
+        print()
+    elif args.format == "csv":
+        writer = csv.DictWriter(sys.stdout, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    elif args.format == "paths":
+        for r in rows:
+            print(r["path"])
+    else:
+        print_table(rows, columns)
+        print(f"\n{len(rows)} observation(s) in {elapsed_ms:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""
+FFT backends for the spectrum engine.
+
+  numpy   - np.fft (always available)
+  scipy   - scipy.fft with a workers= thread count
+  pyfftw  - FFTW plans, with wisdom saved to disk so repeat runs skip planning
+
+Select with --fft-backend or the FFT_BACKEND environment variable. "auto" picks
+the fastest one installed. Unavailable backends fall back to the next one down.
+
+np.fft is no faster in single precision (on NumPy 2.x complex64 takes about
+twice as long as complex128), so single-precision runs use scipy.fft instead
+of the default numpy backend when scipy is installed.
+"""
+
+import os
+import time
+
+import numpy as np
+
+FFT_BACKEND = os.environ.get("FFT_BACKEND", "numpy")
+FFT_THREADS = os.environ.get("FFT_THREADS", "1")
+FFTW_WISDOM_FILE = os.environ.get(
+    "FFTW_WISDOM_FILE",
+    os.path.join(os.path.expanduser("~"), ".cache", "spartanpi", "fftw_wisdom.bin"),
+)
+
+BACKEND_CHOICES = ["auto", "numpy", "scipy", "pyfftw"]
+# Fallback order, fastest first
+_PREFERENCE = ["pyfftw", "scipy", "numpy"]
+# np.fft functions accept out= from numpy 2.0
+_NUMPY_FFT_OUT = int(np.__version__.split(".")[0]) >= 2
+
+
+class NumpyBackend:
+    """np.fft along the last axis"""
+
+    name = "numpy"
+
+    def __init__(self, fft_size, threads=1):
+        self.fft_size = fft_size
+        self.threads = 1
+        self.fft_seconds = 0.0
+        self.plan_seconds = 0.0
+
+    def fft(self, x, out=None):
+        """
+        FFT of each row of x. The result may be written to out (same shape and
+        dtype as x) or to a backend-owned buffer reused by the next call.
+        """
+        t0 = time.perf_counter()
+        result = self._fft(x, out)
+        self.fft_seconds += time.perf_counter() - t0
+        return result
+
+    def _fft(self, x, out):
+        if _NUMPY_FFT_OUT:
+            return np.fft.fft(x, axis=-1, out=out)
+        return np.fft.fft(x, axis=-1)
+
+    def plan(self, shape, dtype=np.complex128):
+        """Prepare for transforms of the given batch shape (no-op unless the backend plans)"""
+
+    def save_wisdom(self):
+        """Persist planning results (no-op unless the backend plans)"""
+
+
+class ScipyBackend(NumpyBackend):
+    """scipy.fft with a configurable number of worker threads"""
+
+    name = "scipy"
+
+    def __init__(self, fft_size, threads=1):
+        import scipy.fft
+        super().__init__(fft_size)
+        self._scipy_fft = scipy.fft
+        self.threads = max(int(threads), 1)
+
+    def _fft(self, x, out):
+        # x is a temporary owned by the engine, so it may be overwritten
+        return self._scipy_fft.fft(x, axis=-1, workers=self.threads, overwrite_x=True)
+
+
+class PyfftwBackend(NumpyBackend):
+    """FFTW plans built with FFTW_MEASURE and cached as wisdom in FFTW_WISDOM_FILE"""
+
+    name = "pyfftw"
+
+    def __init__(self, fft_size, threads=1, wisdom_file=FFTW_WISDOM_FILE):
+        import pyfftw
+        super().__init__(fft_size)
+        self._pyfftw = pyfftw
+        self.threads = max(int(threads), 1)
+        self.wisdom_file = wisdom_file
+        self._plans = {}
+        self.wisdom_loaded = self._load_wisdom()
+        pyfftw.interfaces.cache.enable()
+
+    def _load_wisdom(self):
+        # Plain FFTW wisdom text (double, single, long double), NUL-separated;
+        # never unpickled, so a tampered cache file can't run code
+        try:
+            with open(self.wisdom_file, "rb") as f:
+                wisdom = tuple(f.read().split(b"\0"))
+            if len(wisdom) != 3:
+                return False
+            self._pyfftw.import_wisdom(wisdom)
+            return True
+        except (OSError, ValueError, TypeError):
+            return False
+
+    def save_wisdom(self):
+        try:
+            os.makedirs(os.path.dirname(self.wisdom_file), exist_ok=True)
+            tmp = self.wisdom_file + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(b"\0".join(self._pyfftw.export_wisdom()))
+            os.replace(tmp, self.wisdom_file)
+        except OSError as e:
+            print(f"WARNING: could not save FFTW wisdom to {self.wisdom_file}: {e}")
+
+    def plan(self, shape, dtype=np.complex128):
+        key = (tuple(shape), np.dtype(dtype))
+        if key not in self._plans:
+            t0 = time.perf_counter()
+            template = self._pyfftw.empty_aligned(shape, dtype=dtype)
+            self._plans[key] = self._pyfftw.builders.fft(
+                template, axis=-1, threads=self.threads,
+                planner_effort="FFTW_MEASURE", avoid_copy=False,
+            )
+            self.plan_seconds += time.perf_counter() - t0
+        return self._plans[key]
+
+    def _fft(self, x, out):
+        plan = self._plans.get((x.shape, x.dtype))
+        if plan is None:
+            # Odd-sized (final) batches don't get a measured plan of their own
+            return self._pyfftw.interfaces.numpy_fft.fft(
+                x, axis=-1, threads=self.threads, planner_effort="FFTW_ESTIMATE")
+        return plan(x)
+
+
+_BACKENDS = {"numpy": NumpyBackend, "scipy": ScipyBackend, "pyfftw": PyfftwBackend}
+
+
+def get_backend(name=None, fft_size=8192, threads=None, precision="double"):
+    """
+    Create an FFT backend, falling back to the next available one
+
+    Args:
+        name: "auto", "numpy", "scipy" or "pyfftw" (default: FFT_BACKEND env var)
+        fft_size: FFT window size
+        threads: Threads per transform for scipy/pyfftw (default: FFT_THREADS env var)
+        precision: "double" or "single"; single precision without a backend
+            chosen by name or FFT_BACKEND uses scipy instead of numpy
+
+    Returns:
+        Backend instance; check .name for the one actually in use
+    """
+    default = name is None and "FFT_BACKEND" not in os.environ
+    name = (name or FFT_BACKEND).lower()
+    threads = FFT_THREADS if threads is None else threads
+    try:
+        threads = int(threads)
+    except ValueError:
+        print(f"WARNING: invalid FFT thread count '{threads}', using 1")
+        threads = 1
+    if name not in BACKEND_CHOICES:
+        print(f"WARNING: unknown FFT backend '{name}', using numpy")
+        name = "numpy"
+    if precision == "single" and name == "numpy":
+        if default:
+            try:
+                return ScipyBackend(fft_size, threads)
+            except ImportError:
+                pass
+        print("WARNING: single precision is slower than double with numpy's FFT; "
+              "use --fft-backend scipy, pyfftw or auto (with scipy/pyfftw installed)")
+    candidates = _PREFERENCE if name == "auto" else _PREFERENCE[_PREFERENCE.index(name):]
+    for candidate in candidates:
+        try:
+            return _BACKENDS[candidate](fft_size, threads)
+        except ImportError:
+            if name != "auto":
+                print(f"WARNING: FFT backend '{candidate}' not installed, falling back")
+    return NumpyBackend(fft_size)
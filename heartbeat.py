@@ -4,15 +4,23 @@ Send periodic heartbeat pings to Astron00b backend
 """
 
 import requests
+import json
+import threading
 import time
 import os
 import argparse
+from collections import deque
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timezone
 
 # Configuration (can be overridden by environment variables)
 NODE_ID = os.environ.get("NODE_ID", "Spartan-001")
 BACKEND_URL = os.environ.get("BACKEND_URL", "https://astron00b.com")
 HEARTBEAT_INTERVAL = int(os.environ.get("HEARTBEAT_INTERVAL", "30"))  # seconds
+# Heartbeats that couldn't be sent yet survive restarts here
+HEARTBEAT_QUEUE = os.environ.get("HEARTBEAT_QUEUE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".heartbeat_queue.json"))
+HEARTBEAT_QUEUE_SIZE = 50      # oldest queued heartbeats are dropped beyond this
+HEARTBEAT_RETRY = 30           # seconds between flush attempts while the backend is unreachable
 
 def get_uptime_seconds():
     """Get system uptime in seconds"""
@@ -32,23 +40,8 @@ def get_load_average():
     except:
         return None
 
-def send_heartbeat(node_id, backend_url, run_index=None, total_runs=None, last_capture=None):
-    """
-    Send a single heartbeat ping to the backend
-    
-    Args:
-        node_id: Node identifier (e.g., "Spartan-001")
-        backend_url: Base URL of the backend (e.g., "https://astron00b.com")
-        run_index: Current run number (optional)
-        total_runs: Total runs in batch (optional)
-        last_capture: Last capture filename (optional)
-    
-    Returns:
-        True if successful, False otherwise
-    """
-    url = f"{backend_url}/api/nodes/heartbeat/{node_id}"
-    
-    # Build payload
+def build_payload(run_index=None, total_runs=None, last_capture=None):
+    """Heartbeat payload for this moment: timestamp, uptime, load and run progress"""
     payload = {
         "ts": datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
     }
@@ -70,15 +63,158 @@ def send_heartbeat(node_id, backend_url, run_index=None, total_runs=None, last_c
     
     if last_capture is not None:
         payload["last_capture"] = last_capture
+    return payload
+
+def send_heartbeat(node_id, backend_url, run_index=None, total_runs=None, last_capture=None, session=None):
+    """
+    Send a single heartbeat ping to the backend
+    
+    Args:
+        node_id: Node identifier (e.g., "Spartan-001")
+        backend_url: Base URL of the backend (e.g., "https://astron00b.com")
+        run_index: Current run number (optional)
+        total_runs: Total runs in batch (optional)
+        last_capture: Last capture filename (optional)
+        session: requests.Session to reuse its connection (optional)
+    
+    Returns:
+        True if successful, False otherwise
+    """
+    url = f"{backend_url}/api/nodes/heartbeat/{node_id}"
+    payload = build_payload(run_index, total_runs, last_capture)
     
     try:
-        response = requests.post(url, json=payload, timeout=10)
+        response = (session or requests).post(url, json=payload, timeout=10)
         response.raise_for_status()
         return True
     except requests.exceptions.RequestException as e:
         print(f"Heartbeat failed: {e}")
         return False
 
+class HeartbeatClient:
+    """
+    Non-blocking heartbeats for the observation loop.
+
+    heartbeat() only queues a payload; a background thread sends it over one
+    pooled requests.Session. While offline (radio silence) or while the
+    backend is unreachable, payloads stay in a ring buffer of the last
+    max_queued heartbeats, persisted to queue_path. When the network is back
+    they go out in one request: the newest heartbeat as usual, with the
+    earlier ones in its "queued" list (oldest first).
+    """
+
+    def __init__(self, node_id=NODE_ID, backend_url=BACKEND_URL, queue_path=HEARTBEAT_QUEUE,
+                 max_queued=HEARTBEAT_QUEUE_SIZE, timeout=10, retry_interval=HEARTBEAT_RETRY, log=print):
+        self.url = f"{backend_url}/api/nodes/heartbeat/{node_id}"
+        self.queue_path = queue_path
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.log = log
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._lock = threading.Lock()
+        self._pending = deque(self._load_queue(), maxlen=max_queued)
+        self._offline = False
+        self._sending = False
+        self._failing = False
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="heartbeat", daemon=True)
+        self._thread.start()
+        if self._pending:
+            self._wake.set()
+
+    def _load_queue(self):
+        try:
+            with open(self.queue_path) as f:
+                queued = json.load(f)
+            return queued if isinstance(queued, list) else []
+        except (OSError, ValueError):
+            return []
+
+    def _save_queue(self):
+        """Persist the ring buffer atomically (callers hold self._lock)"""
+        try:
+            if not self._pending:
+                if os.path.exists(self.queue_path):
+                    os.remove(self.queue_path)
+                return
+            tmp = self.queue_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(list(self._pending), f)
+            os.replace(tmp, self.queue_path)
+        except OSError as e:
+            self.log(f"Heartbeat queue not saved: {e}")
+
+    def heartbeat(self, run_index=None, total_runs=None, last_capture=None):
+        """Queue a heartbeat for the background thread; never blocks on the network"""
+        with self._lock:
+            self._pending.append(build_payload(run_index, total_runs, last_capture))
+            self._save_queue()
+        self._wake.set()
+
+    def set_offline(self, offline):
+        """Hold heartbeats in the queue (radio silence) or release them"""
+        self._offline = offline
+        if not offline:
+            self._wake.set()
+
+    @property
+    def queued(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _send_pending(self):
+        with self._lock:
+            batch = list(self._pending)
+        if not batch:
+            return True
+        payload = dict(batch[-1])
+        if len(batch) > 1:
+            payload["queued"] = batch[:-1]
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            if not self._failing:
+                # Once per outage; the queue keeps growing quietly until it ends
+                self.log(f"Heartbeat failed ({len(batch)} queued): {e}")
+            self._failing = True
+            return False
+        if self._failing or len(batch) > 1:
+            self.log(f"Heartbeat delivered ({len(batch)} in one request)")
+        self._failing = False
+        with self._lock:
+            # Anything queued meanwhile stays for the next round
+            for _ in range(min(len(batch), len(self._pending))):
+                self._pending.popleft()
+            self._save_queue()
+        return True
+
+    def _run(self):
+        retry = None
+        while not self._stop.is_set():
+            self._wake.wait(retry)
+            self._wake.clear()
+            if self._stop.is_set() or self._offline:
+                retry = None
+                continue
+            self._sending = True
+            ok = self._send_pending()
+            self._sending = False
+            retry = None if ok else self.retry_interval
+
+    def close(self, timeout=10):
+        """Give queued heartbeats up to timeout seconds to go out, then stop"""
+        deadline = time.monotonic() + timeout
+        self._wake.set()
+        while (self.queued or self._sending) and not self._offline and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=max(deadline - time.monotonic(), 0) + self.timeout)
+        self.session.close()
+
 def continuous_heartbeat(node_id, backend_url, interval=30):
     """
     Send heartbeats continuously at specified interval
@@ -93,9 +229,11 @@ def continuous_heartbeat(node_id, backend_url, interval=30):
     print(f"Interval: {interval}s")
     print("Press Ctrl+C to stop\n")
     
+    # One connection for the whole service instead of a new TLS handshake per ping
+    session = requests.Session()
     while True:
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        success = send_heartbeat(node_id, backend_url)
+        success = send_heartbeat(node_id, backend_url, session=session)
         
         if success:
             print(f"[{timestamp}] ✓ Heartbeat sent")
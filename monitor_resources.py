@@ -1,66 +1,258 @@
+"""
+Monitor system resources (CPU temperature, clock, throttling, CPU usage, memory)
+
+Everything is read straight from /sys and /proc: no vcgencmd fork and no
+blocking CPU measurement (usage is the /proc/stat delta since the previous
+sample). Samples go into a fixed-size ring and are appended to the CSV in
+batches through one open file.
+
+Standalone:
+    python3 monitor_resources.py --once
+    python3 monitor_resources.py --interval 30 --log-file my_resources.csv
+
+In-process (run_observations.py --resource-log):
+    sampler = ResourceSampler("resource_log.csv", interval=5)
+    sampler.start()
+    with sampler.stage("capture", run=3):
+        ...
+    sampler.stop()
+"""
+
+import argparse
+import os
+import threading
 import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
-import psutil
-import subprocess
-import argparse
 
-parser = argparse.ArgumentParser(description="Monitor system resources (CPU temp, CPU usage, memory)")
-parser.add_argument("--once", action="store_true", help="Run once and output to console instead of continuous CSV logging")
-parser.add_argument("--interval", type=int, default=60, help="Logging interval in seconds (default: 60)")
-parser.add_argument("--log-file", type=str, default="resource_log.csv", help="CSV log file path (default: resource_log.csv)")
-args = parser.parse_args()
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+CPU_FREQ = "/sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq"
+# Raspberry Pi firmware throttle flags (same bits as `vcgencmd get_throttled`)
+THROTTLED = "/sys/devices/platform/soc/soc:firmware/get_throttled"
+
+CSV_COLUMNS = ["timestamp", "cpu_temp_c", "cpu_percent", "mem_used_mb", "mem_available_mb",
+               "cpu_mhz", "throttled", "run", "stage"]
+
+
+def _read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def read_cpu_temp():
+    """SoC temperature in °C, or None if there is no thermal zone"""
+    raw = _read_first_line(THERMAL_ZONE)
+    return int(raw) / 1000 if raw else None
+
+
+def read_cpu_mhz():
+    """Current clock of CPU 0 in MHz, or None without cpufreq"""
+    raw = _read_first_line(CPU_FREQ)
+    return int(raw) // 1000 if raw else None
+
+
+def read_throttled():
+    """Firmware throttle flags as an int (0 = never throttled), or None off a Pi"""
+    raw = _read_first_line(THROTTLED)
+    return int(raw, 16) if raw else None
+
+
+def read_load_average():
+    """1-minute load average from /proc/loadavg, or None"""
+    raw = _read_first_line("/proc/loadavg")
+    return float(raw.split()[0]) if raw else None
+
+
+def read_cpu_times():
+    """(busy, total) jiffies over all CPUs from /proc/stat"""
+    fields = [int(v) for v in _read_first_line("/proc/stat").split()[1:]]
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)  # idle + iowait
+    total = sum(fields[:8])  # guest time is already counted in user/nice
+    return total - idle, total
+
+
+def read_meminfo():
+    """(used_mb, available_mb, total_mb) from /proc/meminfo"""
+    info = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            info[key] = int(value.split()[0])  # kB
+            if key == "MemAvailable":
+                break
+    total_kb = info["MemTotal"]
+    available_kb = info.get("MemAvailable", info.get("MemFree", 0))
+    return (total_kb - available_kb) // 1024, available_kb // 1024, total_kb // 1024
+
+
+class ResourceSampler:
+    """
+    Cheap resource samples, tagged with the observation run and stage.
+
+    sample() takes one reading (a few small file reads). start() samples every
+    interval seconds in a background thread, and entering or leaving a
+    stage() takes one extra sample so short stages are never missed. The last
+    ring_size samples stay in memory (samples); new ones are written to
+    log_file every flush_every samples and on stop().
+    """
+
+    def __init__(self, log_file=None, interval=60, ring_size=1024, flush_every=10):
+        self.log_file = log_file
+        self.interval = interval
+        self.flush_every = max(flush_every, 1)
+        self.samples = deque(maxlen=ring_size)
+        self._unflushed = []
+        self._stages = {}           # stage -> run, in the order they were entered
+        self._lock = threading.Lock()
+        self._file = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._cpu_prev = read_cpu_times()
+
+    @contextmanager
+    def stage(self, name, run=None):
+        """Tag samples taken inside the block with name (and run)"""
+        with self._lock:
+            self._stages[name] = run
+        self.sample()
+        try:
+            yield
+        finally:
+            self.sample()
+            with self._lock:
+                self._stages.pop(name, None)
+
+    def sample(self):
+        """Take, store and return one sample"""
+        busy, total = read_cpu_times()
+        used_mb, available_mb, total_mb = read_meminfo()
+        with self._lock:
+            prev_busy, prev_total = self._cpu_prev
+            self._cpu_prev = (busy, total)
+            cpu_percent = 100 * (busy - prev_busy) / (total - prev_total) if total > prev_total else 0.0
+            stats = {
+                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'cpu_temp': read_cpu_temp(),
+                'cpu_percent': round(cpu_percent, 1),
+                'mem_used_mb': used_mb,
+                'mem_available_mb': available_mb,
+                'mem_total_mb': total_mb,
+                'cpu_mhz': read_cpu_mhz(),
+                'throttled': read_throttled(),
+                'run': "+".join("" if r is None else str(r) for r in self._stages.values()),
+                'stage': "+".join(self._stages),
+            }
+            self.samples.append(stats)
+            self._unflushed.append(stats)
+            flush = len(self._unflushed) >= self.flush_every
+        if flush:
+            self.flush()
+        return stats
+
+    @property
+    def latest(self):
+        """Most recent sample (None before the first)"""
+        return self.samples[-1] if self.samples else None
+
+    def flush(self):
+        """Append unwritten samples to log_file"""
+        with self._lock:
+            rows, self._unflushed = self._unflushed, []
+            if not rows or self.log_file is None:
+                return
+            if self._file is None:
+                new = not os.path.exists(self.log_file) or os.path.getsize(self.log_file) == 0
+                self._file = open(self.log_file, "a")
+                if new:
+                    self._file.write(",".join(CSV_COLUMNS) + "\n")
+            for s in rows:
+                self._file.write(f"{s['timestamp']},{_csv(s['cpu_temp'])},{s['cpu_percent']},{s['mem_used_mb']},"
+                                 f"{s['mem_available_mb']},{_csv(s['cpu_mhz'])},{_csv(s['throttled'])},"
+                                 f"{s['run']},{s['stage']}\n")
+            self._file.flush()
+
+    def start(self):
+        """Sample every interval seconds in a background thread
+
+        Start it after any worker processes exist, a fork taken while this
+        thread holds a lock can deadlock the child.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="resources", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self.sample()
+            if self._stop.wait(self.interval):
+                break
+
+    def stop(self):
+        """Stop the background thread, write what is left and close the file"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _csv(value):
+    return "" if value is None else value
+
 
 def get_system_stats():
-    """Collect system resource statistics"""
-    # Get CPU temp
-    temp_output = subprocess.check_output(["vcgencmd", "measure_temp"]).decode()
-    cpu_temp = float(temp_output.strip().split('=')[1].split("'")[0])
-
-    # Get CPU and memory info
-    cpu_percent = psutil.cpu_percent(interval=1)
-    mem = psutil.virtual_memory()
-    used_mb = mem.used // (1024 * 1024)
-    available_mb = mem.available // (1024 * 1024)
-    total_mb = mem.total // (1024 * 1024)
-    
-    return {
-        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'cpu_temp': cpu_temp,
-        'cpu_percent': cpu_percent,
-        'mem_used_mb': used_mb,
-        'mem_available_mb': available_mb,
-        'mem_total_mb': total_mb
-    }
-
-if args.once:
-    # Single run mode - output to console
-    stats = get_system_stats()
-    print(f"System Resources at {stats['timestamp']}")
-    print(f"  CPU Temperature: {stats['cpu_temp']:.1f}°C")
-    print(f"  CPU Usage:       {stats['cpu_percent']:.1f}%")
-    print(f"  Memory Used:     {stats['mem_used_mb']} MB / {stats['mem_total_mb']} MB ({stats['mem_used_mb']/stats['mem_total_mb']*100:.1f}%)")
-    print(f"  Memory Available: {stats['mem_available_mb']} MB")
-else:
-    # Continuous logging mode - write to CSV
-    LOG_FILE = args.log_file
-    
-    # Write header
-    with open(LOG_FILE, "w") as f:
-        f.write("timestamp,cpu_temp_c,cpu_percent,mem_used_mb,mem_available_mb\n")
-    
-    print(f"Logging system resources to {LOG_FILE} every {args.interval} seconds...")
+    """Collect system resource statistics (CPU usage over the last 0.2s)"""
+    sampler = ResourceSampler()
+    time.sleep(0.2)
+    return sampler.sample()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monitor system resources (CPU temp, CPU usage, memory)")
+    parser.add_argument("--once", action="store_true", help="Run once and output to console instead of continuous CSV logging")
+    parser.add_argument("--interval", type=int, default=60, help="Logging interval in seconds (default: 60)")
+    parser.add_argument("--log-file", type=str, default="resource_log.csv", help="CSV log file path (default: resource_log.csv)")
+    parser.add_argument("--flush-every", type=int, default=10, help="Write to the CSV every N samples (default: 10)")
+    args = parser.parse_args(argv)
+
+    if args.once:
+        # Single run mode - output to console
+        stats = get_system_stats()
+        print(f"System Resources at {stats['timestamp']}")
+        if stats['cpu_temp'] is not None:
+            print(f"  CPU Temperature: {stats['cpu_temp']:.1f}°C")
+        if stats['cpu_mhz'] is not None:
+            print(f"  CPU Clock:       {stats['cpu_mhz']} MHz")
+        if stats['throttled'] is not None:
+            print(f"  Throttled:       {stats['throttled']:#x}" + (" ⚠️" if stats['throttled'] else ""))
+        print(f"  CPU Usage:       {stats['cpu_percent']:.1f}%")
+        print(f"  Memory Used:     {stats['mem_used_mb']} MB / {stats['mem_total_mb']} MB ({stats['mem_used_mb']/stats['mem_total_mb']*100:.1f}%)")
+        print(f"  Memory Available: {stats['mem_available_mb']} MB")
+        return
+
+    # Continuous logging mode - write to CSV (a fresh file, as before)
+    open(args.log_file, "w").close()
+    print(f"Logging system resources to {args.log_file} every {args.interval} seconds...")
     print("Press Ctrl+C to stop.")
-    
+    sampler = ResourceSampler(args.log_file, interval=args.interval, flush_every=args.flush_every)
+    sampler.start()
     try:
         while True:
-            stats = get_system_stats()
-            
-            # Log to CSV
-            with open(LOG_FILE, "a") as f:
-                f.write(f"{stats['timestamp']},{stats['cpu_temp']},{stats['cpu_percent']},{stats['mem_used_mb']},{stats['mem_available_mb']}\n")
-            
-            time.sleep(args.interval)
+            time.sleep(3600)
     except KeyboardInterrupt:
-        print(f"\nStopped logging. Data saved to {LOG_FILE}")
+        sampler.stop()
+        print(f"\nStopped logging. Data saved to {args.log_file}")
 
 
+if __name__ == "__main__":
+    main()
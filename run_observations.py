@@ -1,13 +1,27 @@
 import argparse
+import contextlib
+import queue
 import subprocess
+import threading
 import time
 import os
 import shutil
 from datetime import datetime
 
+from campaign_store import CampaignStore, split_ref
+from capture_and_process import OUTPUT_FORMATS, ObservationWorker, output_dir
+from monitor_resources import ResourceSampler
+from stack_spectra import stack_files
+from stage_timer import StageTimer
+from upload_npz import Uploader, UploadError
+
+def log(msg):
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {msg}", flush=True)
+
 # Import heartbeat functionality
 try:
-    from heartbeat import send_heartbeat
+    from heartbeat import HeartbeatClient
     HEARTBEAT_ENABLED = True
     NODE_ID = os.environ.get("NODE_ID", "Spartan-001")
     BACKEND_URL = os.environ.get("BACKEND_URL", "https://astron00b.com")
@@ -15,10 +29,6 @@ except ImportError:
     HEARTBEAT_ENABLED = False
     log("WARNING: heartbeat.py not found, heartbeat disabled")
 
-def log(msg):
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{ts}] {msg}", flush=True)
-
 def check_disk_space(path="/"):
     """Check disk space and return stats in MB"""
     stat = shutil.disk_usage(path)
@@ -34,14 +44,12 @@ def check_disk_space(path="/"):
     }
 
 def send_heartbeat_safe(run_index=None, total_runs=None, last_capture=None):
-    """Send heartbeat with error handling (non-blocking)"""
+    """Queue a heartbeat; the client sends it in the background (or after radio silence)"""
     if not HEARTBEAT_ENABLED:
         return
     
     try:
-        send_heartbeat(
-            NODE_ID, 
-            BACKEND_URL, 
+        heartbeat_client.heartbeat(
             run_index=run_index, 
             total_runs=total_runs, 
             last_capture=last_capture
@@ -51,170 +59,452 @@ def send_heartbeat_safe(run_index=None, total_runs=None, last_capture=None):
         log(f"Heartbeat error (non-fatal): {e}")
 
 def radio_down():
+    # Nothing may transmit during the capture window
+    with campaign_timer.stage("upload_cancel"):
+        stop_pause_upload()
     if args.no_radio_silence:
         log("Radio silence SKIPPED (--no-radio-silence flag set)")
         return
     
-    log("Radio silence ON: disabling wlan0 and eth0")
-    for iface in ("wlan0", "eth0"):
-        r = subprocess.run(["sudo", "ifconfig", iface, "down"], check=False, capture_output=True)
-        if r.returncode != 0:
-            log(f"  {iface} down → WARNING: failed (rc={r.returncode}) - continuing anyway")
-        else:
-            log(f"  {iface} down → OK")
+    if HEARTBEAT_ENABLED:
+        # Heartbeats from here on wait in the client's queue
+        heartbeat_client.set_offline(True)
+    log(f"Radio silence ON: disabling {' and '.join(network.interfaces)}{network.note}")
+    with campaign_timer.stage("radio_down"):
+        for iface in network.interfaces:
+            rc = network.down(iface)
+            if rc != 0:
+                log(f"  {iface} down → WARNING: failed (rc={rc}) - continuing anyway")
+            else:
+                log(f"  {iface} down → OK")
 
 def radio_up():
     if args.no_radio_silence:
         return
     
-    log("Radio silence OFF: enabling eth0 and wlan0")
-    subprocess.run(["sudo", "ifconfig", "eth0", "up"], check=False, capture_output=True)
-    subprocess.run(["sudo", "ifconfig", "wlan0", "up"], check=False, capture_output=True)
+    log(f"Radio silence OFF: enabling {' and '.join(reversed(network.interfaces))}{network.note}")
+    with campaign_timer.stage("radio_up"):
+        for iface in reversed(network.interfaces):
+            network.up(iface)
     log("Radio silence OFF (capture complete)")
 
 
 def wait_for_network(max_seconds=30):
     """Wait until we can resolve DNS + ping something. Keeps it simple."""
+    with campaign_timer.stage("wait_for_network"):
+        return _wait_for_network(max_seconds)
+
+def _wait_for_network(max_seconds):
     log("Waiting for network to come back...")
     deadline = time.time() + max_seconds
     while time.time() < deadline:
-        # DNS resolution check (won't hang)
-        r = subprocess.run(["getent", "hosts", "google.com"], capture_output=True, text=True)
-        if r.returncode == 0:
+        if network.is_up():
             log("Network looks up (DNS OK).")
+            release_heartbeats()
             return True
         time.sleep(1)
     log("WARNING: network did not look up within timeout (continuing anyway).")
+    release_heartbeats()
     return False
 
+class IfconfigNetwork:
+    """Radio silence for real: interfaces down/up with sudo ifconfig, DNS to check it's back"""
+    interfaces = ("wlan0", "eth0")
+    note = ""
+
+    def check(self):
+        # Fail fast if sudo will block
+        subprocess.run(["sudo", "-n", "true"], check=True)
+
+    def down(self, iface):
+        return subprocess.run(["sudo", "ifconfig", iface, "down"], check=False, capture_output=True).returncode
+
+    def up(self, iface):
+        return subprocess.run(["sudo", "ifconfig", iface, "up"], check=False, capture_output=True).returncode
+
+    def is_up(self):
+        # DNS resolution check (won't hang)
+        return subprocess.run(["getent", "hosts", "google.com"], capture_output=True, text=True).returncode == 0
+
+class NoopNetwork(IfconfigNetwork):
+    """Goes through the radio silence steps without touching the network or needing sudo (dev boxes, CI)"""
+    note = " (no-op)"
+
+    def check(self):
+        pass
+
+    def down(self, iface):
+        return 0
+
+    def up(self, iface):
+        return 0
+
+    def is_up(self):
+        return True
+
+NETWORK_CONTROLLERS = {"ifconfig": IfconfigNetwork, "noop": NoopNetwork}
+
+def release_heartbeats():
+    """Let heartbeats queued during radio silence go out in one batch"""
+    if HEARTBEAT_ENABLED:
+        heartbeat_client.set_offline(False)
+
 parser = argparse.ArgumentParser()
 parser.add_argument("--runs", type=int, default=1)
 parser.add_argument("--pause", type=int, default=180)
 parser.add_argument("--mode", choices=["on", "off"], required=True)
 parser.add_argument("--name", type=str, default="observation", help="Observation name for filename")
 parser.add_argument("--no-radio-silence", action="store_true", help="Skip network disable (for laptops/systems without sudo)")
+parser.add_argument("--network", choices=NETWORK_CONTROLLERS, default="ifconfig", help="How radio silence is applied: ifconfig (sudo) or noop for dev boxes/CI (default: ifconfig)")
+parser.add_argument("--airspy-rx", type=str, default=None, help="Capture command for every run, e.g. 'python3 airspy_replay.py --rate max' (default: $AIRSPY_RX or airspy_rx)")
+parser.add_argument("--stream", action="store_true", help="Stream airspy_rx output straight into the FFT (no capture.bin on disk)")
+parser.add_argument("--workers", type=int, default=1, help="FFT worker processes per capture (0 = one per CPU core)")
+parser.add_argument("--adaptive", action="store_true", help="Scale FFT workers/batch size to CPU temperature and load, deferring optional work when hot")
+parser.add_argument("--pipeline", action="store_true", help="Process each capture in the background while the next run pauses/captures")
+parser.add_argument("--queue-size", type=int, default=1, help="With --pipeline: captures that may wait for processing before capturing blocks (default: 1)")
+parser.add_argument("--upload-during-pause", action="store_true", help="Upload finished results in the background during each pause instead of all at the end")
+parser.add_argument("--resource-log", type=str, default=None, help="Sample CPU temperature/clock/usage and memory to this CSV, tagged with run and stage")
+parser.add_argument("--resource-interval", type=float, default=5, help="With --resource-log: seconds between samples (default: 5)")
+parser.add_argument("--profile", type=str, default=None, metavar="DIR", help="Save a cProfile dump of each run's processing stage to DIR")
+parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="npz", help="One .npz per run, or append every run to one campaign container (<name>.campaign) (default: npz)")
+parser.add_argument("--stack", action="store_true", help="Add each run to its observation's ON/OFF stack (stack_spectra.py) before the results are uploaded and deleted")
+parser.add_argument("--quiet-processing", action="store_true", help="With --pipeline: never process while a capture (radio silence window) is in progress")
 args = parser.parse_args()
 
-# Fail fast if sudo will block
-subprocess.run(["sudo", "-n", "true"], check=True)
+if args.pipeline and args.stream:
+    parser.error("--pipeline needs a capture file to hand over; it can't be combined with --stream")
+
+network = NETWORK_CONTROLLERS[args.network]()
+if not args.no_radio_silence:
+    network.check()
 CAPTURE_MIN_PER_RUN = 10
 capture_timeout = 60 * CAPTURE_MIN_PER_RUN * args.runs
 
 log(f"Capture timeout set to {capture_timeout//60} minutes")
 
+# Observation workers start before any thread below (heartbeat, resource sampler, uploads)
+if args.pipeline:
+    # One warm worker per stage
+    capture_worker, processing_worker = ObservationWorker(), ObservationWorker()
+else:
+    worker = ObservationWorker()
+
 # Send initial heartbeat
 if HEARTBEAT_ENABLED:
+    heartbeat_client = HeartbeatClient(NODE_ID, BACKEND_URL, log=log)
     log(f"Heartbeat enabled: Node {NODE_ID} → {BACKEND_URL}")
     send_heartbeat_safe(run_index=0, total_runs=args.runs)
 
 # Collect all captured files for batch upload at the end
 captured_files = []
+# Where the campaign's wall time goes (each run's own stages are in its .npz)
+campaign_timer = StageTimer()
+# One uploader (and manifest) for the whole campaign
+uploader = Uploader(local_dir=output_dir, log=log)
+# In-process resource telemetry (--resource-log); its thread starts after the workers exist
+resources = None
+if args.resource_log:
+    resources = ResourceSampler(args.resource_log, interval=args.resource_interval)
+    resources.start()
+    log(f"Resource samples every {args.resource_interval}s → {args.resource_log}")
 
-try:
-    for i in range(args.runs):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # Check disk space before capture
-        disk = check_disk_space()
-        log(f"Disk space: {disk['free_mb']} MB free ({disk['percent_used']:.1f}% used)")
-        
-        # Warn if disk space is low
-        if disk['free_mb'] < 1000:
-            log(f"WARNING: Low disk space! Only {disk['free_mb']} MB remaining")
-        if disk['free_mb'] < 500:
-            log("ERROR: Critically low disk space (< 500 MB). Aborting.")
-            raise RuntimeError(f"Insufficient disk space: {disk['free_mb']} MB free")
+@contextlib.contextmanager
+def stage(name, run=None):
+    """Time the block as a campaign stage and tag resource samples taken inside it"""
+    with campaign_timer.stage(name), (resources.stage(name, run) if resources else contextlib.nullcontext()):
+        yield
+
+def check_disk_before_capture():
+    """Log free disk space and abort if it is critically low"""
+    disk = check_disk_space()
+    log(f"Disk space: {disk['free_mb']} MB free ({disk['percent_used']:.1f}% used)")
+    
+    # Warn if disk space is low
+    if disk['free_mb'] < 1000:
+        log(f"WARNING: Low disk space! Only {disk['free_mb']} MB remaining")
+    if disk['free_mb'] < 500:
+        log("ERROR: Critically low disk space (< 500 MB). Aborting.")
+        raise RuntimeError(f"Insufficient disk space: {disk['free_mb']} MB free")
+
+def processing_args(run_no):
+    """capture_and_process.py options that affect processing"""
+    extra = []
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+        extra += ["--profile", os.path.join(args.profile, f"{args.name}_run{run_no}.prof")]
+    if args.workers != 1:
+        extra += ["--workers", str(args.workers)]
+    if args.adaptive:
+        extra.append("--adaptive")
+    if args.output_format != "npz":
+        extra += ["--output-format", args.output_format]
+    return extra
+
+def run_observation(worker, extra_args, label="Capture"):
+    """Run one capture_and_process observation in a persistent worker; returns its ObservationResult"""
+    argv = ["--mode", args.mode, "--name", args.name] + extra_args
+    if args.airspy_rx:
+        argv += ["--airspy-rx", args.airspy_rx]
+    try:
+        result = worker.run(argv, timeout=capture_timeout)
+    except TimeoutError:
+        log(f"❌ {label} did not finish within {capture_timeout}s - worker stopped")
+        raise subprocess.TimeoutExpired(f"{label.lower()} {' '.join(argv)}", capture_timeout)
+    except subprocess.CalledProcessError as capture_error:
+        # The worker already printed the traceback and airspy_rx's own output
+        log(f"❌ {label} failed: {capture_error.cmd[0]} exited with code {capture_error.returncode}")
+        raise  # Re-raise to trigger cleanup
+    except Exception as capture_error:
+        log(f"❌ {label} failed: {capture_error!r}")
+        raise
+    log(f"{label} took {result.timings.get('total_s', 0):.1f}s ({stage_summary(result.stages)})")
+    return result
+
+def stage_summary(stages):
+    """One-line breakdown of an ObservationResult's top-level stages"""
+    parts = []
+    for name, s in stages.items():
+        if "." in name:
+            continue
+        part = f"{name} {s['wall_s']:.1f}s"
+        if s["samples"]:
+            part += f" at {s['samples_per_s'] / 1e6:.1f} Msamples/s"
+        parts.append(part)
+    return ", ".join(parts)
+
+def result_exists(path):
+    """True if a captured .npz, or campaign container row ("<container>#<row>"), is there"""
+    ref = split_ref(path)
+    if ref is not None:
+        return ref[1] < len(CampaignStore(ref[0]))
+    return path.endswith(".npz") and os.path.exists(path)
+
+def upload_paths(paths):
+    """What to upload for captured results: the .npz files, and the campaign containers rows went to"""
+    containers = sorted({ref[0] for ref in map(split_ref, paths) if ref is not None})
+    return containers + [path for path in paths if split_ref(path) is None and os.path.exists(path)]
+
+def record_capture(npz_path):
+    """Queue a produced .npz (or container row) for the batch upload; returns False if the path looks wrong"""
+    log(f"Capture produced: {npz_path}")
+    if npz_path and result_exists(npz_path):
+        captured_files.append(npz_path)
+        return True
+    log(f"WARNING: Unexpected output path: {npz_path}")
+    return False
+
+def stack_results():
+    """With --stack: add results not stacked yet to their stacks (stacks skip runs they already have)"""
+    if not args.stack:
+        return
+    ready = [path for path in captured_files if result_exists(path)]
+    if ready:
+        with stage("stack"):
+            try:
+                stack_files(ready, log=log)
+            except Exception as e:
+                log(f"WARNING: stacking failed (results are still uploaded): {e!r}")
+
+def start_pause_upload():
+    """With --upload-during-pause: send finished results while the network is up"""
+    if not args.upload_during_pause:
+        return
+    stack_results()
+    ready = [path for path in captured_files if result_exists(path)]
+    if ready:
+        log(f"Uploading {len(ready)} result(s) in the background during the pause")
+        uploader.start(upload_paths(ready), delete=True)
+
+def stop_pause_upload():
+    """Cancel any background upload; interrupted files stay pending for the next pause"""
+    report = uploader.cancel()
+    if report is None:
+        return
+    log(f"Pause upload: {len(report.uploaded)} uploaded, {len(report.failed)} failed"
+        + (f", {len(report.cancelled)} cancelled for the capture (still pending)" if report.cancelled else ""))
+
+def run_sequential():
+    """Capture and process each run in turn, inside the radio silence window"""
+    try:
+        for i in range(args.runs):
+            check_disk_before_capture()
+            log(f"Starting {args.mode} run {i+1}/{args.runs}")
+
+            # Only silence during RF capture/processing
+            radio_down()
+            npz_path = None  # Initialize to handle errors
+            try:
+                log(f"Starting capture (run {i+1}/{args.runs})")
+                extra = processing_args(i+1)
+                if args.stream:
+                    extra.append("--stream")
+                with stage("capture+fft", i+1):
+                    npz_path = run_observation(worker, extra).output_path
+                # Add to list for batch upload later
+                record_capture(npz_path)
+            finally:
+                # Always re-enable network even if capture fails
+                radio_up()
+
+            # Wait for network, then send heartbeat while network is up
+            wait_for_network(max_seconds=45)
         
-        log(f"Starting {args.mode} run {i+1}/{args.runs}")
-
-        # Only silence during RF capture/processing
-        radio_down()
-        npz_path = None  # Initialize to handle errors
-        try:
-            log(f"Starting capture (run {i+1}/{args.runs})")
-            r=subprocess.run(
-                ["python3", "capture_and_process.py", "--mode", args.mode, "--name", args.name],
-                check=True,
-                capture_output=True,
-                text=True,
-                timeout=capture_timeout,  
+            # Send heartbeat with progress (network is now up) - only if capture succeeded
+            if npz_path and result_exists(npz_path):
+                send_heartbeat_safe(
+                    run_index=i+1, 
+                    total_runs=args.runs, 
+                    last_capture=os.path.basename(npz_path)
+                )
+
+            if i < args.runs - 1:
+                log(f"Pausing for {args.pause} seconds before next run")
+                start_pause_upload()
+                with stage("pause", i+1):
+                    time.sleep(args.pause)
+    finally:
+        worker.close()
+
+def run_pipelined():
+    """
+    Capture stage (this thread) and processing stage (background thread),
+    connected by a bounded queue of raw capture files. The FFT for run N runs
+    during run N's pause and, unless --quiet-processing, run N+1's capture.
+    """
+    jobs = queue.Queue(maxsize=max(args.queue_size, 1))
+    # Held for each capture; with --quiet-processing also for each processing job
+    rf_window = threading.Lock()
+    errors = []
+
+    def process_job(bin_path, timestamp, run_no):
+        with stage("processing", run_no):
+            result = run_observation(
+                processing_worker,
+                ["--from-file", bin_path, "--timestamp", timestamp] + processing_args(run_no),
+                label="Processing",
             )
-            # Print captured output so it's visible in logs
-            if r.stdout:
-                for line in r.stdout.strip().splitlines():
-                    print(line, flush=True)
-            if r.stderr:
-                for line in r.stderr.strip().splitlines():
-                    print(line, flush=True)
-            
-            npz_path = r.stdout.strip().splitlines()[-1]
-            log(f"Capture produced: {npz_path}")
-            
-            # Add to list for batch upload later
-            if npz_path.endswith(".npz") and os.path.exists(npz_path):
-                captured_files.append(npz_path)
-            else:
-                log(f"WARNING: Unexpected output path: {npz_path}")
-                
-        except subprocess.CalledProcessError as capture_error:
-            # Show the actual error from capture script
-            log(f"❌ Capture failed with exit code {capture_error.returncode}")
-            if capture_error.stdout:
-                log("=== Capture stdout ===")
-                print(capture_error.stdout)
-            if capture_error.stderr:
-                log("=== Capture stderr ===")
-                print(capture_error.stderr)
-            raise  # Re-raise to trigger cleanup
-
-        finally:
-            # Always re-enable network even if capture fails
-            radio_up()
-
-        # Wait for network, then send heartbeat while network is up
-        wait_for_network(max_seconds=45)
-        
-        # Send heartbeat with progress (network is now up) - only if capture succeeded
-        if npz_path and npz_path.endswith(".npz") and os.path.exists(npz_path):
+        record_capture(result.output_path)
+
+    def processing_stage():
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            bin_path, timestamp, run_no = job
+            log(f"Processing run {run_no}/{args.runs} ({os.path.basename(bin_path)})")
+            try:
+                if args.quiet_processing:
+                    with rf_window:
+                        process_job(bin_path, timestamp, run_no)
+                else:
+                    process_job(bin_path, timestamp, run_no)
+            except Exception as e:
+                log(f"❌ Processing of run {run_no} failed: {e}")
+                log(f"Raw capture kept for reprocessing: {bin_path}")
+                errors.append(e)
+
+    processor = threading.Thread(target=processing_stage, name="processing", daemon=True)
+    processor.start()
+    try:
+        for i in range(args.runs):
+            if errors:
+                raise errors[0]
+            check_disk_before_capture()
+            log(f"Starting {args.mode} run {i+1}/{args.runs} (pipelined, {jobs.qsize()} waiting for processing)")
+
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            bin_path = f"capture_{timestamp}.bin"
+            with rf_window:
+                radio_down()
+                try:
+                    log(f"Starting capture (run {i+1}/{args.runs})")
+                    with stage("capture", i+1):
+                        bin_path = run_observation(capture_worker, ["--capture-only", "--bin-file", bin_path]).bin_path
+                finally:
+                    radio_up()
+
+            # Blocks while the queue is full, so unprocessed captures can't pile up on disk
+            jobs.put((bin_path, timestamp, i+1))
+
+            wait_for_network(max_seconds=45)
             send_heartbeat_safe(
-                run_index=i+1, 
-                total_runs=args.runs, 
-                last_capture=os.path.basename(npz_path)
+                run_index=i+1,
+                total_runs=args.runs,
+                last_capture=os.path.basename(captured_files[-1]) if captured_files else None
             )
 
-        if i < args.runs - 1:
-            log(f"Pausing for {args.pause} seconds before next run")
-            time.sleep(args.pause)
+            if i < args.runs - 1:
+                log(f"Pausing for {args.pause} seconds before next run")
+                start_pause_upload()
+                with stage("pause", i+1):
+                    time.sleep(args.pause)
+    finally:
+        # Let the processing stage drain what was captured, then stop it
+        jobs.put(None)
+        log("Waiting for processing of remaining captures...")
+        processor.join()
+        capture_worker.close()
+        processing_worker.close()
+    if errors:
+        raise errors[0]
+
+def upload_results():
+    """Upload pending results in-process; returns the UploadReport"""
+    report = uploader.upload(delete=True)
+    mb = report.bytes_uploaded / (1024 * 1024)
+    log(f"Uploaded {len(report.uploaded)} file(s), {mb:.1f} MB in {report.seconds:.1f}s"
+        + (f", {len(report.skipped)} already uploaded" if report.skipped else ""))
+    log(f"Cleaned up {len(report.deleted)} local file(s)")
+    return report
+
+def emergency_upload():
+    """Best-effort upload of whatever was captured before a failure"""
+    if not captured_files:
+        return
+    stack_results()
+    log(f"Attempting emergency upload of {len(captured_files)} captured files...")
+    try:
+        report = upload_results()
+    except Exception as upload_err:
+        log(f"Emergency upload failed: {upload_err}")
+        log(f"Files remain in {output_dir}/: {[os.path.basename(f) for f in captured_files]}")
+        return
+    if report.failed:
+        log(f"Emergency upload incomplete - {len(report.failed)} file(s) remain in {output_dir}/:")
+        for name in sorted(report.failed):
+            log(f"  - {name}")
+    else:
+        log("Emergency upload successful")
+
+try:
+    if args.upload_during_pause:
+        log("Incremental upload: results are uploaded during pauses, cancelled before each capture")
+    if args.pipeline:
+        log(f"Pipelined mode: queue size {args.queue_size}"
+            + (", no processing during captures" if args.quiet_processing else ""))
+        run_pipelined()
+    else:
+        run_sequential()
     
     # ===== Batch Upload at the End =====
     if captured_files:
         log(f"\n{'='*60}")
-        log(f"All captures complete. Starting batch upload of {len(captured_files)} files...")
+        remaining = sum(result_exists(path) for path in captured_files)
+        log(f"All captures complete. Starting batch upload of {remaining} files...")
         log(f"{'='*60}")
         
         wait_for_network(max_seconds=45)
         
-        # Upload all files at once
+        # Upload every pending .npz and changed container file (including
+        # leftovers from earlier failed uploads); each .npz is deleted as soon
+        # as its own upload is confirmed
+        stack_results()
         log("Uploading results...")
-        subprocess.run(
-            ["python3", "upload_npz.py"],
-            check=True,
-            timeout=60*20,  # 20 min safety for batch uploads
-        )
-        
-        # ✅ Delete files only after successful upload
-        log("Upload successful. Cleaning up local files...")
-        total_size_mb = 0
-        for npz_path in captured_files:
-            if os.path.exists(npz_path):
-                file_size_mb = os.path.getsize(npz_path) // (1024 * 1024)
-                total_size_mb += file_size_mb
-                os.remove(npz_path)
-                log(f"  Deleted: {os.path.basename(npz_path)} ({file_size_mb} MB)")
-            else:
-                log(f"  WARNING: File not found: {npz_path}")
-        
-        log(f"Cleaned up {len(captured_files)} files ({total_size_mb} MB total)")
+        with stage("upload"):
+            report = upload_results()
+        if report.failed:
+            raise UploadError(report.failed)
+        log("Upload successful.")
         
         # Log final disk space
         disk_after = check_disk_space()
@@ -225,41 +515,34 @@ try:
     else:
         log("No files captured to upload.")
 
-except subprocess.CalledProcessError as e:
-    log(f"UPLOAD FAILED: {e.cmd} returned exit code {e.returncode}")
-    log(f"❌ Files NOT deleted - they remain in ../output/")
-    if captured_files:
-        log(f"Protected files ({len(captured_files)}):")
-        for f in captured_files:
-            log(f"  - {os.path.basename(f)}")
-    log("\nTo retry upload manually: python3 upload_npz.py")
+except UploadError as e:
+    log(f"UPLOAD FAILED: {e}")
+    log(f"❌ Failed files NOT deleted - they remain in {output_dir}/:")
+    for name in sorted(e.failed):
+        log(f"  - {name}: {e.failed[name]}")
+    log("\nTo retry upload manually: python3 upload_npz.py --delete-local (only the failed files are sent)")
     raise
 except subprocess.TimeoutExpired as e:
     log(f"TIMEOUT: {e.cmd} exceeded {e.timeout}s")
     # Try to upload any captured files before exiting
-    if captured_files:
-        log(f"Attempting emergency upload of {len(captured_files)} captured files...")
-        try:
-            subprocess.run(["python3", "upload_npz.py"], timeout=60*20)
-            log("Emergency upload successful")
-        except Exception as upload_err:
-            log(f"Emergency upload failed: {upload_err}")
-            log(f"Files remain in ../output/: {[os.path.basename(f) for f in captured_files]}")
+    emergency_upload()
     raise
 except Exception as e:
     log(f"ERROR encountered: {e}")
     # Try to upload any captured files before exiting
-    if captured_files:
-        log(f"Attempting emergency upload of {len(captured_files)} captured files...")
-        try:
-            subprocess.run(["python3", "upload_npz.py"], timeout=60*20)
-            log("Emergency upload successful")
-        except Exception as upload_err:
-            log(f"Emergency upload failed: {upload_err}")
-            log(f"Files remain in ../output/: {[os.path.basename(f) for f in captured_files]}")
+    emergency_upload()
     raise
 finally:
     # Belt-and-braces: ensure network is up when script exits
     radio_up()
     log("Final cleanup: network forced ON")
+    if resources:
+        resources.stop()
+    log("Campaign stage timing (this process; processing CPU is in each .npz):")
+    for line in campaign_timer.report().splitlines():
+        log(f"  {line}")
+    if HEARTBEAT_ENABLED:
+        # Last chance for the final heartbeat; anything left stays queued on disk
+        heartbeat_client.set_offline(False)
+        heartbeat_client.close(timeout=15)
 
@@ -0,0 +1,876 @@
+"""
+Vectorized FFT engine for raw Airspy IQ captures.
+
+Instead of one Python-level iteration per FFT window, samples are converted,
+DC-corrected, windowed and FFT'd as a 2-D (n_windows x fft_size) batch.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from fft_backends import get_backend
+
+DEFAULT_BATCH_WINDOWS = 64    # 64 x 8192 complex128 = 8 MB per intermediate array
+PRECISIONS = ["double", "single"]
+WATERFALL_DTYPES = ["float16", "float32"]
+SK_EXCLUDE_MODES = ["off", "bins", "windows"]
+SK_MIN_BATCH_WINDOWS = 16     # below this a per-batch SK estimate (or per-bin mean) is too noisy to act on
+BLANK_ACTIONS = ["zero", "drop"]
+CHANNELIZERS = ["hann", "pfb"]
+ZOOM_GUARD = 0.25             # output rate >= zoom bandwidth x (1 + guard)
+ZOOM_STOPBAND_DB = 70         # zoom filter attenuation from the output Nyquist frequency on
+
+
+class ImpulseBlanker:
+    """
+    Time-domain blanking of impulsive interference (ignition noise, switching
+    supplies) before the FFT.
+
+    Each batch, the noise power is estimated robustly from the median of
+    |x|^2 over a subsample of the batch, smoothed across batches. Samples
+    whose magnitude exceeds `threshold` x the RMS noise amplitude are either
+    zeroed ("zero") or their whole window is dropped ("drop"). The default
+    threshold of 6 gives a false-alarm rate of ~1e-16 per sample on Gaussian noise.
+    """
+
+    def __init__(self, threshold=6.0, action="zero", smoothing=0.1, subsample=16):
+        if action not in BLANK_ACTIONS:
+            raise ValueError(f"blanking action must be one of {BLANK_ACTIONS}, got {action!r}")
+        self.threshold = threshold
+        self.action = action
+        self.smoothing = smoothing
+        self.subsample = subsample
+        self.noise_power = None
+        self.blanked_samples = 0
+        self.blanked_windows = 0
+        self.total_samples = 0
+
+    def apply(self, iq, recentre=True):
+        """
+        Blank one batch of windows, shape (n_windows, fft_size).
+
+        recentre: The windows were DC-corrected by their mean, which included
+            the impulses; when zeroing, re-centre the rest of each hit window
+            on the mean of its unblanked samples
+
+        Returns:
+            (iq, kept): the (possibly shortened) batch and a boolean mask of
+            the windows kept, or None if no window was dropped
+        """
+        mag2 = iq.real**2 + iq.imag**2
+        # For complex Gaussian noise, median(|x|^2) = ln(2) * mean power
+        batch_power = np.median(mag2.ravel()[::self.subsample]) / np.log(2)
+        if self.noise_power is None:
+            self.noise_power = batch_power
+        else:
+            self.noise_power += self.smoothing * (batch_power - self.noise_power)
+        self.total_samples += iq.size
+        hits = mag2 > self.threshold**2 * self.noise_power
+        if not hits.any():
+            return iq, None
+        bad = hits.any(axis=1)
+        self.blanked_windows += int(bad.sum())
+        if self.action == "zero":
+            rows = np.flatnonzero(bad)
+            hit = hits[rows]
+            hit_iq = iq[rows]
+            hit_iq[hit] = 0
+            if recentre:
+                clean = iq.shape[1] - hit.sum(axis=1, keepdims=True)
+                offset = hit_iq.sum(axis=1, keepdims=True) / np.maximum(clean, 1)
+                hit_iq -= np.where(hit, 0, offset).astype(iq.dtype)
+            iq[rows] = hit_iq
+            self.blanked_samples += int(hit.sum())
+            return iq, None
+        self.blanked_samples += int(bad.sum()) * iq.shape[1]
+        return iq[~bad], ~bad
+
+    def merge(self, other):
+        """Fold in the counters of another ImpulseBlanker"""
+        self.blanked_samples += other.blanked_samples
+        self.blanked_windows += other.blanked_windows
+        self.total_samples += other.total_samples
+
+    @property
+    def blanked_fraction(self):
+        """Fraction of samples zeroed or lost with dropped windows"""
+        return self.blanked_samples / max(self.total_samples, 1)
+
+
+class SpectralKurtosis:
+    """
+    Per-bin spectral kurtosis (SK) RFI flagging, computed in the same pass as
+    the spectrum from running sums of power (the accumulator's power_sum) and
+    power^2 (kept here).
+
+    For Gaussian noise, including the hydrogen line, SK is ~1. Continuous
+    narrowband RFI pushes it below 1 and transient RFI above 1. A bin is
+    flagged when SK falls outside 1 +/- sigma * sqrt(4 / M) for M windows.
+
+    exclude:
+        off     - only flag; nothing is removed from the spectrum
+        bins    - each batch, drop bins whose SK over that batch is out of range
+        windows - drop each window in which more than window_fraction of the
+                  bins are over sigma standard deviations from the running
+                  per-bin mean (broadband bursts). Windows are judged one by
+                  one, so the result doesn't depend on the batch size; until
+                  SK_MIN_BATCH_WINDOWS windows are in, the reference is the
+                  per-bin median of the current batch.
+    """
+
+    def __init__(self, fft_size, sigma=3.0, exclude="off", window_fraction=0.1):
+        if exclude not in SK_EXCLUDE_MODES:
+            raise ValueError(f"SK exclude mode must be one of {SK_EXCLUDE_MODES}, got {exclude!r}")
+        self.sigma = sigma
+        self.exclude = exclude
+        self.window_fraction = window_fraction
+        self.power_sq_sum = np.zeros(fft_size)
+        # Per-bin window counts; only needed once bins can be dropped independently
+        self.bin_windows = np.zeros(fft_size, dtype=np.int64) if exclude == "bins" else None
+        self.flagged_windows = 0
+        self.excluded_cells = 0
+        self.total_cells = 0
+        self._sq_sum = np.empty(fft_size)
+        self._hits = np.empty((0, fft_size), dtype=bool)
+
+    @staticmethod
+    def estimate(s1, s2, m):
+        """SK estimator from sum of power s1, sum of power^2 s2 over m windows"""
+        m = np.asarray(m, dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sk = (m + 1) / (m - 1) * (m * s2 / s1**2 - 1)
+        return np.where((s1 > 0) & (m > 1), sk, 1.0)
+
+    def outliers(self, sk, m):
+        """Boolean mask of bins whose SK is outside the expected range"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tol = self.sigma * np.sqrt(4.0 / np.asarray(m, dtype=np.float64))
+        return np.abs(sk - 1) > tol
+
+    def flag_windows(self, power, power_sum, n_windows, scratch):
+        """
+        Find broadband bursts in one batch (exclude="windows" only).
+
+        Args:
+            power: Per-window power, shape (n_windows, fft_size)
+            power_sum: Running power sum over the windows accepted so far
+            n_windows: Number of windows accepted so far
+            scratch: Buffer of power's shape and dtype to work in
+
+        Returns:
+            Indices of the windows to drop
+        """
+        n = len(power)
+        if self.exclude != "windows" or n == 0:
+            return np.empty(0, dtype=np.intp)
+        if n_windows >= SK_MIN_BATCH_WINDOWS:
+            mean = power_sum / n_windows
+            std = np.sqrt(np.maximum(self.power_sq_sum / n_windows - mean**2, 0))
+        else:
+            # Power of Gaussian noise is exponential: mean = std = median / ln(2)
+            mean = std = np.median(power, axis=0) / np.log(2)
+        if len(self._hits) < n:
+            self._hits = np.empty((n, power.shape[1]), dtype=bool)
+        hits = self._hits[:n]
+        np.subtract(power, mean, out=scratch)
+        np.abs(scratch, out=scratch)
+        np.greater(scratch, self.sigma * std, out=hits)
+        bad = np.flatnonzero(np.count_nonzero(hits, axis=1) > self.window_fraction * power.shape[1])
+        self.flagged_windows += len(bad)
+        self.excluded_cells += len(bad) * power.shape[1]
+        return bad
+
+    def screen(self, power, power_sum, n, scratch):
+        """
+        Check one batch and record its power^2 sum.
+
+        Args:
+            power: Per-window power, shape (n_windows, fft_size); rows of
+                windows dropped by flag_windows() are zero
+            power_sum: power summed over windows (float64)
+            n: Number of windows in power that were not dropped
+            scratch: Buffer of power's shape and dtype to work in
+
+        Returns:
+            Boolean keep mask over bins
+        """
+        self.total_cells += power.size
+        keep = np.ones(power.shape[1], dtype=bool)
+        sq_sum = np.square(power, out=scratch).sum(axis=0, dtype=np.float64, out=self._sq_sum)
+        if self.exclude == "bins" and n >= SK_MIN_BATCH_WINDOWS:
+            keep = ~self.outliers(self.estimate(power_sum, sq_sum, n), n)
+            self.excluded_cells += n * int((~keep).sum())
+        if keep.all():
+            self.power_sq_sum += sq_sum
+        else:
+            self.power_sq_sum += sq_sum * keep
+        if self.bin_windows is not None:
+            self.bin_windows += n * keep
+        return keep
+
+    def merge(self, other):
+        """Fold in the sums and counters of another SpectralKurtosis"""
+        self.power_sq_sum += other.power_sq_sum
+        if self.bin_windows is not None:
+            self.bin_windows += other.bin_windows
+        self.flagged_windows += other.flagged_windows
+        self.excluded_cells += other.excluded_cells
+        self.total_cells += other.total_cells
+
+    def result(self, power_sum, n_windows):
+        """(SK, RFI mask) over the whole capture, in natural FFT order"""
+        m = self.bin_windows if self.bin_windows is not None else n_windows
+        sk = self.estimate(power_sum, self.power_sq_sum, m)
+        return sk, self.outliers(sk, m)
+
+
+class Waterfall:
+    """
+    Time-resolved (dynamic) spectrum built from the same per-window powers as
+    the integrated spectrum, so it needs no second pass over the samples.
+
+    Each row averages windows_per_row consecutive windows and is stored
+    fftshift-ed, optionally averaged down by `decimate` adjacent bins. Rows are
+    divided by their own median (kept in `scales`) so float16 storage keeps its
+    precision around the noise floor: power = rows * scales[:, None].
+    Memory use grows with the number of rows, not the number of samples.
+    Rows span windows_per_row windows of capture time; windows dropped before
+    the FFT (e.g. by the impulse blanker) are left out of that row's average.
+    """
+
+    def __init__(self, fft_size, windows_per_row, decimate=1, dtype="float16"):
+        if fft_size % decimate:
+            raise ValueError(f"waterfall decimation {decimate} must divide fft_size {fft_size}")
+        if dtype not in WATERFALL_DTYPES:
+            raise ValueError(f"waterfall dtype must be one of {WATERFALL_DTYPES}, got {dtype!r}")
+        self.windows_per_row = max(int(windows_per_row), 1)
+        self.decimate = decimate
+        self.dtype = np.dtype(dtype)
+        self.rows = []
+        self.scales = []
+        self.counts = []
+        self._row = np.zeros(fft_size)
+        self._row_windows = 0
+        self._row_elapsed = 0
+
+    def add(self, power, kept=None):
+        """
+        Add per-window power, shape (n_windows, fft_size), in natural FFT order.
+
+        kept: Boolean mask over the batch's original windows when some were
+            dropped; power then holds only the kept ones
+        """
+        elapsed = len(power) if kept is None else len(kept)
+        positions = np.arange(len(power)) if kept is None else np.flatnonzero(kept)
+        i = 0
+        while i < elapsed:
+            take = min(self.windows_per_row - self._row_elapsed, elapsed - i)
+            lo, hi = np.searchsorted(positions, [i, i + take])
+            self._row += power[lo:hi].sum(axis=0, dtype=np.float64)
+            self._row_windows += hi - lo
+            self._row_elapsed += take
+            i += take
+            if self._row_elapsed == self.windows_per_row:
+                self._emit()
+
+    def _emit(self):
+        row = np.fft.fftshift(self._row / max(self._row_windows, 1))
+        if self.decimate > 1:
+            row = row.reshape(-1, self.decimate).mean(axis=1)
+        scale = float(np.median(row)) or 1.0
+        row = np.minimum(row / scale, np.finfo(self.dtype).max)
+        self.rows.append(row.astype(self.dtype))
+        self.scales.append(scale)
+        self.counts.append(self._row_elapsed)
+        self._row[:] = 0
+        self._row_windows = 0
+        self._row_elapsed = 0
+
+    def finish(self):
+        """Emit the final, possibly partial, row"""
+        if self._row_elapsed:
+            self._emit()
+
+    def merge(self, other):
+        """Append the (finished) rows of a later stretch of the same capture"""
+        self.rows.extend(other.rows)
+        self.scales.extend(other.scales)
+        self.counts.extend(other.counts)
+
+    def arrays(self):
+        """(rows, scales, windows of capture time per row) as arrays"""
+        self.finish()
+        channels = len(self._row) // self.decimate
+        return (np.array(self.rows, dtype=self.dtype).reshape(-1, channels),
+                np.array(self.scales), np.array(self.counts, dtype=np.int64))
+
+
+class DownConverter:
+    """
+    Digital down-conversion front end for a zoom FFT.
+
+    Mixes the stream by -offset_hz, low-pass filters it and decimates it, so
+    the FFT sees only the sub-band of interest at a lower sample rate. The
+    decimation leaves a guard band: output_rate >= bandwidth_hz * (1 + guard),
+    with the filter passing +/- bandwidth_hz / 2 and reaching stopband_db of
+    attenuation at the output Nyquist frequency, so nothing folds back into
+    the requested band. The edges of the output spectrum (outside
+    +/- bandwidth_hz / 2) are the filter's roll-off.
+
+    The FIR (Kaiser-windowed sinc) only evaluates the outputs that are kept.
+    taps_per_phase=None sizes it for stopband_db over the transition band.
+    Mixer phase, filter history and decimation phase carry over between
+    calls, so blocks can be any length. Remove the receiver's DC offset before
+    process(): after mixing it would sit at -offset_hz, inside the sub-band.
+    """
+
+    def __init__(self, sample_rate, offset_hz=0.0, bandwidth_hz=1e6, taps_per_phase=None,
+                 guard=ZOOM_GUARD, stopband_db=ZOOM_STOPBAND_DB):
+        if not 0 < bandwidth_hz <= sample_rate:
+            raise ValueError(f"zoom bandwidth must be in (0, {sample_rate}] Hz, got {bandwidth_hz}")
+        self.sample_rate = sample_rate
+        self.offset_hz = offset_hz
+        self.bandwidth_hz = bandwidth_hz
+        self.decimation = max(int(sample_rate // (bandwidth_hz * (1 + guard))), 1)
+        self.output_rate = sample_rate / self.decimation
+        # Transition band from the passband edge to the output Nyquist, in cycles/sample;
+        # without decimation there is no folding, so only a minimum width is kept
+        transition = max((self.output_rate - bandwidth_hz) / 2, 0.02 * sample_rate) / sample_rate
+        if taps_per_phase:
+            n_taps = int(taps_per_phase) * self.decimation + 1
+        else:
+            n_taps = int(np.ceil((stopband_db - 7.95) / (14.36 * transition))) | 1
+        cutoff = min(bandwidth_hz / 2 / sample_rate + transition / 2, 0.5)
+        # Kaiser's beta for the requested attenuation
+        a = max(stopband_db - 21, 0)
+        beta = 0.1102 * (stopband_db - 8.7) if stopband_db > 50 else 0.5842 * a**0.4 + 0.07886 * a
+        n = np.arange(n_taps) - (n_taps - 1) / 2
+        taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(n_taps, beta)
+        # Reversed, so a dot product with the newest-last window is the convolution
+        self.taps = (taps / taps.sum())[::-1].astype(np.float32)
+        self.reset()
+
+    def reset(self, start_sample=0):
+        """Start over at absolute input sample index start_sample"""
+        self._next = start_sample
+        self._history = np.zeros(len(self.taps) - 1, dtype=np.complex64)
+
+    def _mix(self, x):
+        n = np.arange(self._next, self._next + len(x))
+        return x * np.exp(-2j * np.pi * self.offset_hz / self.sample_rate * n).astype(np.complex64)
+
+    def prime(self, x):
+        """Feed samples that precede the first output (fills filter history only)"""
+        mixed = np.concatenate([self._history, self._mix(x)])
+        self._history = mixed[len(mixed) - len(self._history):]
+        self._next += len(x)
+
+    def process(self, x):
+        """Down-convert a block of complex64 samples; returns the decimated output"""
+        ext = np.concatenate([self._history, self._mix(x)])
+        # Outputs fall on absolute input indices that are multiples of the decimation;
+        # row r of the sliding view ends on absolute index self._next + r
+        first = -self._next % self.decimation
+        y = sliding_window_view(ext, len(self.taps))[first::self.decimation] @ self.taps
+        self._history = ext[len(ext) - len(self._history):]
+        self._next += len(x)
+        return y.astype(np.complex64, copy=False)
+
+
+class PolyphaseFilterbank:
+    """
+    Critically sampled polyphase filterbank (PFB) front end to the FFT.
+
+    Each output frame is the weighted sum of the current window and the
+    taps - 1 windows before it, weighted by a Hamming-windowed sinc prototype
+    filter spanning taps x fft_size samples. The FFT of that frame has a much
+    flatter channel response and less leakage between bins than a single Hann
+    window, and every sample contributes at full weight to some frame.
+
+    One frame is produced per window (hop = fft_size). The first taps - 1
+    frames of a stream are discarded while the history fills, unless prime()
+    supplied the windows before it. Windows dropped by the impulse blanker
+    are removed from the stream before filtering.
+    """
+
+    def __init__(self, fft_size, taps=4):
+        if taps < 1:
+            raise ValueError(f"PFB needs at least 1 tap, got {taps}")
+        self.fft_size = fft_size
+        self.taps = taps
+        n = np.arange(taps * fft_size)
+        h = np.sinc((n - taps * fft_size / 2) / fft_size) * np.hamming(taps * fft_size)
+        self.coeffs = h.reshape(taps, fft_size)
+        self.coeffs32 = self.coeffs.astype(np.float32)
+        self._history = np.zeros((taps - 1, fft_size), dtype=np.complex64)
+        self._filled = 0
+        self._stack = np.empty((0, fft_size), dtype=np.complex64)
+        self._scratch = None
+
+    def reset(self):
+        """Start a new stream with an empty history"""
+        self._history[:] = 0
+        self._filled = 0
+
+    def prime(self, windows):
+        """Fill the history with the (DC-corrected) windows that precede the stream"""
+        hist = self.taps - 1
+        windows = windows[len(windows) - min(hist, len(windows)):]
+        if len(windows):
+            self._history[hist - len(windows):] = windows
+        self._filled = len(windows)
+
+    def apply(self, iq, out):
+        """
+        Filter a (n, fft_size) batch of windows into out (same shape).
+
+        Returns:
+            Number of leading frames in out that are still filling the history
+            and should be discarded
+        """
+        n, hist = len(iq), self.taps - 1
+        if len(self._stack) < n + hist:
+            self._stack = np.empty((n + hist, self.fft_size), dtype=np.complex64)
+        stack = self._stack[:n + hist]
+        stack[:hist] = self._history
+        stack[hist:] = iq
+        coeffs = self.coeffs32 if out.dtype == np.complex64 else self.coeffs
+        if self._scratch is None or self._scratch.dtype != out.dtype or len(self._scratch) < n:
+            self._scratch = np.empty((max(n, 1), self.fft_size), dtype=out.dtype)
+        scratch = self._scratch[:n]
+        np.multiply(stack[0:n], coeffs[0], out=out)
+        for t in range(1, self.taps):
+            out += np.multiply(stack[t:t + n], coeffs[t], out=scratch)
+        self._history[:] = stack[n:]
+        skip = min(max(hist - self._filled, 0), n)
+        self._filled = min(self._filled + n, hist)
+        return skip
+
+
+def _drop_leading(kept, n, skip):
+    """Kept-window mask after also dropping the first `skip` of the n windows that reached the FFT"""
+    kept = np.ones(n, dtype=bool) if kept is None else kept.copy()
+    kept[np.flatnonzero(kept)[:skip]] = False
+    return kept
+
+
+class SpectrumAccumulator:
+    """
+    Accumulates the averaged power spectrum of interleaved int16 IQ samples
+    (the airspy_rx output format), fft_size samples per window.
+
+    Args:
+        fft_size: FFT window size in samples
+        batch_windows: Windows processed per batch (caps peak memory)
+        backend: FFT backend from fft_backends.get_backend() (default: numpy)
+        precision: "double" (complex128 FFT) or "single" (complex64 FFT).
+            Sums are always accumulated in float64.
+        compare_precision: Also run the double-precision path on the same
+            samples so precision_report() can measure the deviation
+        waterfall: Optional Waterfall fed with every batch's per-window power
+        sk: Optional SpectralKurtosis for RFI flagging/exclusion
+        blanker: Optional ImpulseBlanker applied to the samples before the FFT
+        frontend: Optional DownConverter; windows are then cut from its
+            decimated output instead of the raw samples
+        channelizer: "hann" (Hann-windowed FFT) or "pfb" (polyphase filterbank)
+        pfb_taps: Prototype filter length in windows for the PFB
+    """
+
+    def __init__(self, fft_size, batch_windows=DEFAULT_BATCH_WINDOWS, backend=None,
+                 precision="double", compare_precision=False, waterfall=None, sk=None,
+                 blanker=None, frontend=None, channelizer="hann", pfb_taps=4):
+        if channelizer not in CHANNELIZERS:
+            raise ValueError(f"channelizer must be one of {CHANNELIZERS}, got {channelizer!r}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {PRECISIONS}, got {precision!r}")
+        self.fft_size = fft_size
+        self.batch_windows = max(int(batch_windows), 1)
+        self.precision = precision
+        self.compare_precision = compare_precision and precision != "double"
+        self.backend = backend or get_backend("numpy", fft_size)
+        self.backend.plan((self.batch_windows, fft_size),
+                          np.complex64 if precision == "single" else np.complex128)
+        self.window = np.hanning(fft_size)
+        self.window32 = self.window.astype(np.float32)
+        # Window repeated for each I and Q, to multiply the float view of a
+        # complex batch without ufunc casting buffers
+        self._window_iq = np.repeat(self.window, 2)
+        self._window_iq32 = self._window_iq.astype(np.float32)
+        # Reusable per-batch buffers, so the steady-state Hann path allocates nothing
+        # of batch size: raw bytes -> complex64 samples -> windowed -> FFT -> power
+        fft_dtype = np.complex64 if precision == "single" else np.complex128
+        power_dtype = np.float32 if precision == "single" else np.float64
+        shape = (self.batch_windows, fft_size)
+        self._raw = bytearray(self.batch_bytes)
+        self._iq = np.empty(shape, dtype=np.complex64)
+        self._windowed = np.empty(shape, dtype=fft_dtype)
+        self._spec = np.empty(shape, dtype=fft_dtype)
+        self._power = np.empty(shape, dtype=power_dtype)
+        self._scratch = np.empty(shape, dtype=power_dtype)
+        self._batch_sum = np.empty(fft_size)
+        # Power is summed in natural FFT order; fftshift happens once in spectrum()
+        self.power_sum = np.zeros(fft_size)
+        self.n_windows = 0
+        # Raw int16 IQ bytes added, and seconds consume() spent waiting on reads
+        self.bytes_in = 0
+        self.read_seconds = 0.0
+        self.waterfall = waterfall
+        self.sk = sk
+        self.blanker = blanker
+        self.frontend = frontend
+        self.channelizer = channelizer
+        self.pfb = PolyphaseFilterbank(fft_size, pfb_taps) if channelizer == "pfb" else None
+        # Down-converted samples left over after cutting whole windows
+        self._carry = np.empty(0, dtype=np.complex64)
+        if self.compare_precision:
+            self.reference_backend = get_backend("numpy", fft_size)
+            self.reference_power_sum = np.zeros(fft_size)
+            self.reference_pfb = PolyphaseFilterbank(fft_size, pfb_taps) if self.pfb else None
+
+    def reset(self, waterfall=None, sk=None, blanker=None, frontend=None):
+        """
+        Start a new capture with fresh per-capture state objects, keeping the
+        preallocated buffers, window and FFT plans
+        """
+        self.power_sum[:] = 0
+        self.n_windows = 0
+        self.bytes_in = 0
+        self.read_seconds = 0.0
+        self.waterfall = waterfall
+        self.sk = sk
+        self.blanker = blanker
+        self.frontend = frontend
+        self._carry = np.empty(0, dtype=np.complex64)
+        if self.pfb is not None:
+            self.pfb.reset()
+        if self.compare_precision:
+            self.reference_power_sum[:] = 0
+            if self.reference_pfb is not None:
+                self.reference_pfb.reset()
+
+    @property
+    def buffer_bytes(self):
+        """Memory held by the preallocated per-batch buffers"""
+        return len(self._raw) + sum(b.nbytes for b in (
+            self._iq, self._windowed, self._spec, self._power, self._scratch))
+
+    @property
+    def batch_bytes(self):
+        """Bytes of raw int16 IQ in one full batch"""
+        return self.batch_windows * self.fft_size * 4
+
+    def add_samples(self, data):
+        """
+        Add a block of interleaved int16 IQ samples (any length).
+
+        Only whole windows are used; a trailing partial window is dropped
+        (with a front end, it is carried over to the next block instead).
+        """
+        self.bytes_in += data.nbytes
+        if self.frontend is not None:
+            self._add_downconverted(data)
+            return
+        n = len(data) // (2 * self.fft_size)
+        step = self.batch_windows * 2 * self.fft_size
+        for start in range(0, n * 2 * self.fft_size, step):
+            block = data[start:min(start + step, n * 2 * self.fft_size)]
+            self._add_batch(block.reshape(-1, self.fft_size, 2))
+
+    def _add_batch(self, iq16):
+        """Process up to batch_windows windows, shape (n, fft_size, 2) int16"""
+        n = len(iq16)
+        iq = self._iq[:n]
+        # int16 I/Q pairs convert straight into the complex64 buffer's float32 view
+        np.copyto(iq.view(np.float32).reshape(n, self.fft_size, 2), iq16)
+        self._process(iq)
+
+    def _to_complex(self, data):
+        """
+        Interleaved int16 IQ to complex64, DC-corrected per fft_size raw
+        samples (a trailing partial window by its own mean)
+        """
+        x = np.empty(len(data) // 2, dtype=np.complex64)
+        np.copyto(x.view(np.float32).reshape(-1, 2), data[:len(x) * 2].reshape(-1, 2))
+        whole = len(x) // self.fft_size * self.fft_size
+        windows = x[:whole].reshape(-1, self.fft_size)
+        windows -= windows.mean(axis=1, keepdims=True)
+        if whole < len(x):
+            x[whole:] -= x[whole:].mean()
+        return x
+
+    def prime(self, data, start_sample):
+        """
+        Feed the int16 IQ samples just before this accumulator's share of a
+        capture: they fill the front end and PFB histories but are not
+        accumulated. start_sample is the absolute sample index of data[0];
+        data must start on a window boundary.
+        """
+        x = self._to_complex(data)
+        if self.frontend is not None:
+            n_fir = len(self.frontend.taps) - 1
+            self.frontend.reset(start_sample)
+            if start_sample > 0:
+                # The serial path had a full filter history here
+                self.frontend.prime(x[:n_fir])
+                x = x[n_fir:]
+            x = self.frontend.process(x)
+        if self.pfb is not None:
+            windows = x[len(x) % self.fft_size:].reshape(-1, self.fft_size)
+            self.pfb.prime(windows)
+            if self.compare_precision and self.reference_pfb is not None:
+                self.reference_pfb.prime(windows)
+
+    def _add_downconverted(self, data):
+        """Down-convert raw samples and process every whole window of the output"""
+        # The receiver's DC spike has to go before mixing moves it into the sub-band
+        y = self.frontend.process(self._to_complex(data))
+        if len(self._carry):
+            y = np.concatenate([self._carry, y])
+        n = len(y) // self.fft_size
+        for start in range(0, n, self.batch_windows):
+            m = min(self.batch_windows, n - start)
+            iq = self._iq[:m]
+            iq.reshape(-1)[:] = y[start * self.fft_size:(start + m) * self.fft_size]
+            self._process(iq)
+        self._carry = y[n * self.fft_size:]
+
+    def _process(self, iq):
+        """DC-correct, blank, window, FFT and accumulate a (n, fft_size) complex64 batch"""
+        n = len(iq)
+        # DC offset removal, per window (the front end did it before mixing)
+        if self.frontend is None:
+            iq -= iq.mean(axis=1, keepdims=True)
+        kept = None
+        if self.blanker is not None:
+            iq, kept = self.blanker.apply(iq, recentre=self.frontend is None)
+            n = len(iq)
+            if n == 0:
+                self._skip_batch(kept)
+                return
+        if self.compare_precision:
+            ref_windowed = np.empty(iq.shape, dtype=np.complex128)
+            if self.reference_pfb is not None:
+                self.reference_pfb.apply(iq, ref_windowed)
+            else:
+                np.multiply(iq, self.window, out=ref_windowed)
+        windowed = self._windowed[:n]
+        if self.pfb is not None:
+            skip = self.pfb.apply(iq, windowed)
+            if skip:
+                kept = _drop_leading(kept, n, skip)
+                windowed = windowed[skip:]
+                n -= skip
+                if self.compare_precision:
+                    ref_windowed = ref_windowed[skip:]
+                if n == 0:
+                    self._skip_batch(kept)
+                    return
+        elif self.precision == "single":
+            np.multiply(iq.view(np.float32).reshape(n, -1), self._window_iq32,
+                        out=windowed.view(np.float32).reshape(n, -1))
+        else:
+            np.copyto(windowed, iq)
+            flat = windowed.view(np.float64).reshape(n, -1)
+            np.multiply(flat, self._window_iq, out=flat)
+        spec = self.backend.fft(windowed, out=self._spec[:n])
+        power = np.square(spec.real, out=self._power[:n])
+        power += np.square(spec.imag, out=self._scratch[:n])
+        if self.waterfall is not None:
+            self.waterfall.add(power, kept)
+        bad = None
+        if self.sk is not None and self.sk.exclude == "windows":
+            bad = self.sk.flag_windows(power, self.power_sum, self.n_windows, self._scratch[:n])
+            if len(bad):
+                power[bad] = 0
+            else:
+                bad = None
+        n_used = n if bad is None else n - len(bad)
+        batch_sum = power.sum(axis=0, dtype=np.float64, out=self._batch_sum)
+        keep = True
+        if self.sk is not None:
+            keep = self.sk.screen(power, batch_sum, n_used, self._scratch[:n])
+            if not keep.any():
+                return
+        if keep is True or keep.all():
+            self.power_sum += batch_sum
+        else:
+            self.power_sum += batch_sum * keep
+        self.n_windows += n_used
+        if self.compare_precision:
+            ref = self.reference_backend.fft(ref_windowed)
+            ref_power = ref.real**2 + ref.imag**2
+            if bad is not None:
+                ref_power[bad] = 0
+            self.reference_power_sum += ref_power.sum(axis=0) * keep
+
+    def _skip_batch(self, kept):
+        """Account for a batch in which no window reached the accumulator"""
+        if self.waterfall is not None:
+            self.waterfall.add(np.empty((0, self.fft_size)), kept)
+
+    def partial(self):
+        """State to hand back from a worker process for merge()"""
+        state = {"power_sum": self.power_sum, "n_windows": self.n_windows,
+                 "fft_seconds": self.backend.fft_seconds, "bytes_in": self.bytes_in}
+        if self.compare_precision:
+            state["reference_power_sum"] = self.reference_power_sum
+        if self.waterfall is not None:
+            self.waterfall.finish()
+            state["waterfall"] = self.waterfall
+        if self.sk is not None:
+            state["sk"] = self.sk
+        if self.blanker is not None:
+            state["blanker"] = self.blanker
+        return state
+
+    def merge(self, state):
+        """Fold in a partial() result computed elsewhere, e.g. by a worker"""
+        self.power_sum += state["power_sum"]
+        self.n_windows += state["n_windows"]
+        self.backend.fft_seconds += state["fft_seconds"]
+        self.bytes_in += state["bytes_in"]
+        if self.compare_precision:
+            self.reference_power_sum += state["reference_power_sum"]
+        if self.waterfall is not None:
+            self.waterfall.merge(state["waterfall"])
+        if self.sk is not None:
+            self.sk.merge(state["sk"])
+        if self.blanker is not None:
+            self.blanker.merge(state["blanker"])
+
+    def consume(self, f):
+        """Read f (file or pipe) to EOF, one batch at a time, into a reused buffer"""
+        raw = memoryview(self._raw)
+        samples = np.frombuffer(self._raw, dtype=np.int16)
+        while True:
+            filled = 0
+            t0 = time.perf_counter()
+            while filled < len(raw):
+                got = f.readinto(raw[filled:])
+                if not got:
+                    break
+                filled += got
+            self.read_seconds += time.perf_counter() - t0
+            self.add_samples(samples[:filled // 2])
+            if filled < len(raw):
+                break
+
+    def spectrum(self):
+        """Averaged, fftshift-ed power spectrum"""
+        if self.sk is not None and self.sk.bin_windows is not None:
+            return np.fft.fftshift(self.power_sum / np.maximum(self.sk.bin_windows, 1))
+        return np.fft.fftshift(self.power_sum / max(self.n_windows, 1))
+
+    def rfi_flags(self):
+        """fftshift-ed (SK, RFI mask), or None without spectral kurtosis"""
+        if self.sk is None:
+            return None
+        sk, mask = self.sk.result(self.power_sum, self.n_windows)
+        return np.fft.fftshift(sk), np.fft.fftshift(mask)
+
+    def precision_report(self):
+        """
+        Max and mean relative deviation of this spectrum from the
+        double-precision one, or None if compare_precision is off
+        """
+        if not self.compare_precision:
+            return None
+        ref = self.reference_power_sum
+        rel = np.abs(self.power_sum - ref) / np.maximum(ref, np.finfo(np.float64).tiny)
+        return {"max_rel_dev": float(rel.max()), "mean_rel_dev": float(rel.mean())}
+
+
+def auto_workers():
+    """Number of CPU cores this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _process_file_slice(path, fft_size, batch_windows, backend_name, fft_threads, options,
+                        first_window, n_windows):
+    """Worker: memory-map windows [first_window, first_window + n_windows) of path"""
+    data = np.memmap(path, dtype=np.int16, mode='r',
+                     offset=first_window * fft_size * 4,
+                     shape=(n_windows * fft_size * 2,))
+    acc = SpectrumAccumulator(fft_size, batch_windows,
+                              backend=get_backend(backend_name, fft_size, fft_threads),
+                              **options)
+    # Pick up the front end's mixer phase and filter history and the PFB's
+    # history where the previous slice ends
+    start = first_window * fft_size
+    decimation = acc.frontend.decimation if acc.frontend is not None else 1
+    lead = 0
+    if acc.pfb is not None:
+        lead += (acc.pfb.taps - 1) * fft_size * decimation
+    if acc.frontend is not None:
+        lead += len(acc.frontend.taps) - 1
+    lead = min(lead, start)
+    if acc.frontend is not None:
+        acc.frontend.reset(start)
+    if lead:
+        # Whole windows, so the DC correction matches the serial path
+        w0 = (start - lead) // fft_size
+        before = np.memmap(path, dtype=np.int16, mode='r', offset=w0 * fft_size * 4,
+                           shape=((first_window - w0) * fft_size * 2,))
+        acc.prime(before, w0 * fft_size)
+    step = acc.batch_windows * fft_size * 2
+    for start in range(0, len(data), step):
+        acc.add_samples(data[start:start + step])
+    return acc.partial()
+
+
+def process_file_parallel(path, fft_size, workers=0, batch_windows=DEFAULT_BATCH_WINDOWS,
+                          backend=None, **options):
+    """
+    Accumulate the spectrum of a raw capture file across a process pool.
+
+    The file is split into contiguous, window-aligned slices, one per worker.
+    Each worker memory-maps its own slice and returns a partial power sum,
+    which is reduced into a single SpectrumAccumulator.
+
+    Args:
+        path: Raw interleaved int16 IQ file (airspy_rx -r output)
+        fft_size: FFT window size in samples
+        workers: Worker processes (0 = one per available core)
+        batch_windows: Windows per batch inside each worker
+        backend: FFT backend for this process; workers create their own of the
+            same kind, reusing any wisdom it saved while planning
+        **options: Further SpectrumAccumulator arguments (precision,
+            compare_precision, and fresh waterfall, sk, blanker, frontend
+            objects). Slices are aligned to waterfall rows and the front
+            end's decimation, so only the capture's last row can be partial.
+            Each worker primes the front end and PFB from the samples before
+            its slice, so the result matches a single-process run.
+
+    Returns:
+        SpectrumAccumulator holding the combined result
+    """
+    total_windows = os.path.getsize(path) // (fft_size * 4)
+    workers = workers or auto_workers()
+    workers = max(1, min(workers, total_windows))
+
+    acc = SpectrumAccumulator(fft_size, batch_windows, backend=backend, **options)
+    # Planning happened in the constructor; share it with the workers
+    acc.backend.save_wisdom()
+    bounds = np.linspace(0, total_windows, workers + 1).astype(int)
+    align = acc.waterfall.windows_per_row if acc.waterfall is not None else 1
+    if acc.frontend is not None:
+        align *= acc.frontend.decimation
+    if align > 1:
+        bounds = np.minimum((bounds + align // 2) // align * align, total_windows)
+        bounds[-1] = total_windows
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_process_file_slice, path, fft_size, batch_windows,
+                        acc.backend.name, acc.backend.threads, options, lo, hi - lo)
+            for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo
+        ]
+        for future in futures:
+            acc.merge(future.result())
+    return acc
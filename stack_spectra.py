@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Stack ON and OFF runs into a calibrated H-line profile, (ON - OFF) / OFF, on a
+radial-velocity axis.
+
+    python3 stack_spectra.py ../output/                       # One stack per observation name
+    python3 stack_spectra.py "../output/cassiopeia_*.npz" --name cassiopeia
+    python3 catalog.py query --name cassiopeia --where "rfi_percentage < 5" --format paths | python3 stack_spectra.py -
+    python3 stack_spectra.py ../output/cassiopeia.campaign    # Every run of a campaign container
+
+Each stack (STACK_DIR/<name>_stack.npz) keeps the window-weighted sums of the
+ON and OFF spectra and the runs already in them, so running it again only
+adds the new runs, and .npz files that have since been uploaded and deleted
+stay counted. Files are read one at a time; memory use doesn't grow with
+the number of runs.
+
+Every run in a stack must match its fft_size, spectrum sample rate,
+channelizer, zoom centre and gains; other runs are rejected with the reason.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from analyze_spectrum import H_LINE_HZ, radial_velocity_km_s
+from campaign_store import CampaignStore, find_campaigns, is_campaign, run_ref, split_ref
+from catalog import find_npz
+
+STACK_DIR = os.environ.get("STACK_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "stacks"))
+MODES = ("on", "off")
+# Fields that must agree for runs to be stacked together
+COMPAT_FIELDS = ("fft_size", "spectrum_sample_rate", "channelizer", "zoom_offset_hz", "lna_gain", "mix_gain", "vga_gain")
+PEAK_WINDOW_KM_S = 300       # Search for the profile peak within this velocity range
+
+
+def _scalar(data, key, default=None):
+    if key not in data.files:
+        return default
+    value = data[key]
+    return value.item() if value.ndim == 0 else value
+
+
+def run_key(data):
+    """Identifies a run within a stack: mode and timestamp"""
+    return f"{_scalar(data, 'mode')}_{_scalar(data, 'timestamp')}"
+
+
+def compat_signature(data):
+    """The COMPAT_FIELDS of a run (or stack), spectrum_sample_rate falling back to sample_rate"""
+    sig = {key: _scalar(data, key) for key in COMPAT_FIELDS}
+    if sig["spectrum_sample_rate"] is None:
+        sig["spectrum_sample_rate"] = _scalar(data, "sample_rate")
+    sig["channelizer"] = sig["channelizer"] or "hann"
+    sig["zoom_offset_hz"] = sig["zoom_offset_hz"] or 0.0
+    return sig
+
+
+class SpectrumStack:
+    """
+    Weighted ON and OFF sums for one observation name. Each run's spectrum is
+    an average over averaging_windows FFT windows, so it is added with that
+    many windows of weight: the stack is the mean over every window of every
+    run, exactly as if it had been one long capture.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.signature = None
+        self.freq_axis = None
+        self.sums = {}        # mode -> window-weighted sum of spectra (float64)
+        self.weights = {}     # mode -> total windows
+        self.runs = {}        # mode -> number of runs
+        self.included = set()
+
+    @classmethod
+    def load(cls, path):
+        """A stack saved by save()"""
+        with np.load(path) as d:
+            stack = cls(str(d["observation_name"]))
+            stack.signature = {key: _scalar(d, f"compat_{key}") for key in COMPAT_FIELDS}
+            stack.freq_axis = d["freq_axis"]
+            for mode in MODES:
+                if f"{mode}_sum" in d.files:
+                    stack.sums[mode] = d[f"{mode}_sum"]
+                    stack.weights[mode] = int(d[f"{mode}_windows"])
+                    stack.runs[mode] = int(d[f"{mode}_runs"])
+            stack.included = set(d["included"].tolist())
+        return stack
+
+    def check(self, data):
+        """Why data can't join this stack, or None if it can"""
+        if _scalar(data, "observation_name") != self.name:
+            return f"observation_name {_scalar(data, 'observation_name')!r} is not {self.name!r}"
+        mode = _scalar(data, "mode")
+        if mode not in MODES:
+            return f"unknown mode {mode!r}"
+        if not _scalar(data, "averaging_windows"):
+            return "no averaging_windows"
+        if self.signature is not None:
+            sig = compat_signature(data)
+            diff = [f"{k} {sig[k]} != {self.signature[k]}" for k in COMPAT_FIELDS if sig[k] != self.signature[k]]
+            if diff:
+                return "incompatible: " + ", ".join(diff)
+        return None
+
+    def add(self, path):
+        """
+        Add one run file (or container row); returns None if it was added,
+        otherwise why not ("already stacked" or a compatibility problem)
+        """
+        with open_run(path) as data:
+            key = run_key(data)
+            if key in self.included:
+                return "already stacked"
+            problem = self.check(data)
+            if problem:
+                return problem
+            freq_axis = data["freq_axis"]
+            if self.freq_axis is not None and not np.allclose(freq_axis, self.freq_axis):
+                return "freq_axis differs from the stack's"
+            mode = _scalar(data, "mode")
+            windows = int(_scalar(data, "averaging_windows"))
+            spectrum = data["spectrum"].astype(np.float64)
+            if self.signature is None:
+                self.signature = compat_signature(data)
+                self.freq_axis = freq_axis
+            if mode in self.sums:
+                self.sums[mode] += windows * spectrum
+            else:
+                self.sums[mode] = windows * spectrum
+            self.weights[mode] = self.weights.get(mode, 0) + windows
+            self.runs[mode] = self.runs.get(mode, 0) + 1
+            self.included.add(key)
+        return None
+
+    def mean(self, mode):
+        """Window-weighted mean spectrum of mode, or None without runs"""
+        if not self.weights.get(mode):
+            return None
+        return self.sums[mode] / self.weights[mode]
+
+    def calibrated(self):
+        """(ON - OFF) / OFF, or None until both modes have runs"""
+        on, off = self.mean("on"), self.mean("off")
+        if on is None or off is None:
+            return None
+        return (on - off) / np.where(off > 0, off, np.nan)
+
+    def velocity_axis(self):
+        """Radial velocity of each bin in km/s (freq_axis is relative to the tuned H-line frequency)"""
+        return radial_velocity_km_s(self.freq_axis / 1e3)
+
+    def profile_peak(self, window_km_s=PEAK_WINDOW_KM_S):
+        """(velocity km/s, (ON-OFF)/OFF) of the profile's strongest bin within window_km_s, or None"""
+        profile = self.calibrated()
+        if profile is None:
+            return None
+        velocity = self.velocity_axis()
+        near = (np.abs(velocity) <= window_km_s) & np.isfinite(profile)
+        # The DC bin holds the receiver's residual offset, not hydrogen
+        near[len(near) // 2] = False
+        if not near.any():
+            return None
+        idx = np.flatnonzero(near)[np.argmax(profile[near])]
+        return float(velocity[idx]), float(profile[idx])
+
+    def save(self, path):
+        """Write the stack (sums for further runs, plus means, profile and velocity axis)"""
+        fields = dict(
+            observation_name=self.name,
+            freq_axis=self.freq_axis,
+            velocity_km_s=self.velocity_axis(),
+            rest_frequency_hz=H_LINE_HZ,
+            included=np.array(sorted(self.included), dtype=str),
+            updated=time.strftime("%Y%m%d_%H%M%S"),
+            **{f"compat_{k}": v for k, v in self.signature.items()},
+        )
+        for mode in MODES:
+            if mode in self.sums:
+                fields.update({
+                    f"{mode}_sum": self.sums[mode],
+                    f"{mode}_windows": self.weights[mode],
+                    f"{mode}_runs": self.runs[mode],
+                    f"{mode}_mean": self.mean(mode),
+                })
+        profile = self.calibrated()
+        if profile is not None:
+            fields["calibrated"] = profile
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, **fields)
+        os.replace(tmp, path)
+
+
+def open_run(path):
+    """np.load() of an .npz, or the CampaignRun of a container row ("<container>#<row>")"""
+    ref = split_ref(path)
+    if ref is not None:
+        return CampaignStore(ref[0]).run(ref[1])
+    return np.load(path)
+
+
+def find_runs(paths):
+    """
+    Run files in paths: .npz files, directories and glob patterns as for
+    find_npz, plus campaign containers (every row, also inside directories)
+    and container rows
+    """
+    runs = [p for p in paths if split_ref(p) is not None]
+    for container in find_campaigns(p for p in paths if p not in runs):
+        runs += [run_ref(container, row) for row in range(len(CampaignStore(container)))]
+    rest = [p for p in paths if p not in runs and not is_campaign(p)]
+    return runs + find_npz(rest) if rest else runs
+
+
+def stack_path(name, stack_dir=STACK_DIR):
+    safe_name = "".join(c if c.isalnum() or c in ('-', '_') else '_' for c in name)
+    return os.path.join(stack_dir, f"{safe_name}_stack.npz")
+
+
+def stack_files(paths, stack_dir=STACK_DIR, names=None, rebuild=False, log=print):
+    """
+    Add run files to their observation's stack in stack_dir (created or
+    updated), one file at a time.
+
+    Args:
+        paths: .npz run files or container rows ("<container>#<row>")
+        names: Only stack these observation names (default: all)
+        rebuild: Start the stacks over instead of adding to them
+
+    Returns:
+        {name: SpectrumStack}
+    """
+    os.makedirs(stack_dir, exist_ok=True)
+    stacks, added, skipped, rejected = {}, {}, {}, {}
+    for path in paths:
+        try:
+            with open_run(path) as d:
+                name = _scalar(d, "observation_name")
+        except Exception as e:
+            log(f"❌ {os.path.basename(path)}: unreadable ({type(e).__name__}: {e})")
+            continue
+        if name is None or (names and name not in names):
+            continue
+        if name not in stacks:
+            existing = stack_path(name, stack_dir)
+            stacks[name] = (SpectrumStack.load(existing) if os.path.exists(existing) and not rebuild
+                            else SpectrumStack(name))
+            added[name], skipped[name], rejected[name] = [], 0, []
+        reason = stacks[name].add(path)
+        if reason is None:
+            added[name].append(path)
+        elif reason == "already stacked":
+            skipped[name] += 1
+        else:
+            rejected[name].append((path, reason))
+
+    for name, stack in stacks.items():
+        if added[name]:
+            stack.save(stack_path(name, stack_dir))
+        on, off = stack.runs.get("on", 0), stack.runs.get("off", 0)
+        log(f"📚 {name}: +{len(added[name])} run(s) → {on} ON / {off} OFF "
+            f"({stack.weights.get('on', 0):,} / {stack.weights.get('off', 0):,} windows)"
+            + (f", {skipped[name]} already stacked" if skipped[name] else "")
+            + (f" → {stack_path(name, stack_dir)}" if added[name] else ""))
+        for path, reason in rejected[name]:
+            log(f"  ⚠️  {os.path.basename(path)} not stacked: {reason}")
+        peak = stack.profile_peak()
+        if peak is not None:
+            log(f"  Profile peak: {peak[1]:+.4f} (ON-OFF)/OFF at {peak[0]:+.1f} km/s")
+        elif not (on and off):
+            log(f"  No calibrated profile yet (needs both ON and OFF runs)")
+    return stacks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stack ON/OFF runs into calibrated (ON-OFF)/OFF profiles")
+    parser.add_argument("paths", nargs="+", help=".npz files, directories, glob patterns or campaign containers ('-' = read paths from stdin)")
+    parser.add_argument("--name", action="append", default=None, help="Only stack this observation name (repeatable)")
+    parser.add_argument("--stack-dir", type=str, default=STACK_DIR, help="Where stacks are kept (default: $STACK_DIR or ../stacks)")
+    parser.add_argument("--rebuild", action="store_true", help="Start the stacks over from the given files")
+    args = parser.parse_args(argv)
+
+    paths = [p for p in args.paths if p != "-"]
+    if "-" in args.paths:
+        paths += [line.strip() for line in sys.stdin if line.strip()]
+    files = find_runs(paths)
+    if not files:
+        print("No .npz files or container runs found")
+        return 1
+    stacks = stack_files(files, args.stack_dir, names=args.name, rebuild=args.rebuild)
+    if not stacks:
+        print("No runs matched")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
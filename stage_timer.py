@@ -0,0 +1,117 @@
+"""
+Wall time, CPU time and bytes per named stage of a run
+
+    timer = StageTimer()
+    with timer.stage("process") as s:
+        engine.consume(f)
+        s.bytes = s.samples = ...
+    timer.fields()    # arrays for the .npz
+    timer.report()    # table for the log
+
+Stage names with a dot ("process.fft") are parts of the stage before the dot.
+Throughput (samples/s) is only given for stages that set samples.
+
+CPU time is this process plus any child processes it has waited for
+(airspy_rx, --workers pools), from os.times().
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def cpu_seconds():
+    """CPU time used so far by this process and its reaped children"""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class _Stage:
+    """A running stage; set bytes and samples before it stops"""
+    __slots__ = ("name", "bytes", "samples", "wall0", "cpu0")
+
+    def __init__(self, name, nbytes, samples):
+        self.name = name
+        self.bytes = nbytes
+        self.samples = samples
+        self.wall0, self.cpu0 = time.perf_counter(), cpu_seconds()
+
+
+class StageTimer:
+    """
+    Accumulates wall seconds, CPU seconds, bytes and calls per stage, in the
+    order stages were first seen. Safe to use from several threads, though
+    CPU time is process-wide and so overlaps between concurrent stages.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, nbytes=0, samples=0):
+        """Time the block as stage name"""
+        handle = self.start(name, nbytes, samples)
+        try:
+            yield handle
+        finally:
+            self.stop(handle)
+
+    def start(self, name, nbytes=0, samples=0):
+        """Start timing stage name, for stages that don't fit one block"""
+        return _Stage(name, nbytes, samples)
+
+    def stop(self, handle):
+        """Record a stage begun with start()"""
+        self.add(handle.name, time.perf_counter() - handle.wall0, cpu_seconds() - handle.cpu0,
+                 handle.bytes, handle.samples)
+
+    def add(self, name, wall_s, cpu_s=np.nan, nbytes=0, samples=0):
+        """Record a stage measured elsewhere (cpu_s NaN if unknown)"""
+        with self._lock:
+            s = self.stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "bytes": 0, "samples": 0, "calls": 0})
+            s["wall_s"] += wall_s
+            s["cpu_s"] += cpu_s
+            s["bytes"] += int(nbytes)
+            s["samples"] += int(samples)
+            s["calls"] += 1
+
+    def samples_per_s(self, name):
+        """Throughput of stage name in IQ samples per second (NaN without samples)"""
+        s = self.stages.get(name)
+        if not s or not s["samples"] or s["wall_s"] <= 0:
+            return np.nan
+        return s["samples"] / s["wall_s"]
+
+    def as_dict(self):
+        """{stage: {wall_s, cpu_s, bytes, samples, calls, samples_per_s}}"""
+        with self._lock:
+            names = list(self.stages)
+        return {name: dict(self.stages[name], samples_per_s=self.samples_per_s(name)) for name in names}
+
+    def fields(self, prefix="stage_"):
+        """Parallel arrays for np.savez: names, wall_s, cpu_s, bytes, samples, samples_per_s"""
+        stages = self.as_dict()
+        return {
+            f"{prefix}names": np.array(list(stages), dtype=str),
+            f"{prefix}wall_s": np.array([s["wall_s"] for s in stages.values()], dtype=np.float64),
+            f"{prefix}cpu_s": np.array([s["cpu_s"] for s in stages.values()], dtype=np.float64),
+            f"{prefix}bytes": np.array([s["bytes"] for s in stages.values()], dtype=np.int64),
+            f"{prefix}samples": np.array([s["samples"] for s in stages.values()], dtype=np.int64),
+            f"{prefix}samples_per_s": np.array([s["samples_per_s"] for s in stages.values()], dtype=np.float64),
+        }
+
+    def report(self):
+        """Human-readable table, one line per stage"""
+        lines = [f"{'Stage':<18s}{'Wall s':>9s}{'CPU s':>9s}{'MB':>9s}{'Msamp/s':>9s}"]
+        for name, s in self.as_dict().items():
+            cpu = f"{s['cpu_s']:>9.2f}" if np.isfinite(s["cpu_s"]) else f"{'-':>9s}"
+            mb = f"{s['bytes'] / 1e6:>9.1f}" if s["bytes"] else f"{'-':>9s}"
+            rate = f"{s['samples_per_s'] / 1e6:>9.2f}" if np.isfinite(s["samples_per_s"]) else f"{'-':>9s}"
+            calls = f" x{s['calls']}" if s["calls"] > 1 else ""
+            label = "  " + name.split(".", 1)[1] if "." in name else name
+            lines.append(f"{label:<18s}{s['wall_s']:>9.2f}{cpu}{mb}{rate}{calls}")
+        return "\n".join(lines)
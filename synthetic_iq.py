@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Synthetic captures in the exact airspy_rx -r format (interleaved int16 I/Q),
+for testing and benchmarking without an Airspy:
+
+    python3 synthetic_iq.py capture.bin --seconds 10 --tone-offset 150000 --impulses-per-s 20
+    python3 capture_and_process.py --mode on --name synthetic --from-file capture.bin --keep-bin
+
+Each file holds Gaussian noise, an optional tone at a known offset from the
+tuned frequency (1420.405751 MHz) and optional impulsive RFI: short
+broadband bursts, like the ignition and switching noise that --blank removes.
+"""
+
+import argparse
+
+import numpy as np
+
+SAMPLE_RATE = 3_000_000
+NOISE_RMS = 300.0          # Per I/Q component, in ADC counts
+TONE_AMPLITUDE = 20.0      # Counts; ~11 dB above the noise in an 8192-point Hann spectrum
+IMPULSE_AMPLITUDE = 20000.0
+IMPULSE_LENGTH = 8         # Samples per burst
+CHUNK_SAMPLES = 1 << 20
+
+
+def bin_centred(offset_hz, fft_size, sample_rate=SAMPLE_RATE):
+    """offset_hz moved onto the nearest bin centre of an fft_size FFT (no scalloping loss)"""
+    bin_hz = sample_rate / fft_size
+    return round(offset_hz / bin_hz) * bin_hz
+
+
+def expected_snr_db(tone_amplitude, noise_rms, fft_size, decimation=1):
+    """
+    snr_db (peak over the noise floor) that capture_and_process.py should
+    report for a bin-centred tone in a Hann-windowed spectrum: the tone
+    puts A²·(Σw)² in its bin and complex noise 2σ²·Σw² in every bin, a ratio
+    of A²·N / (3σ²) for a Hann window. int16 rounding adds 1/12 to σ², and
+    decimation by D narrows each bin (and the noise in it) by D.
+    """
+    noise_var = noise_rms**2 + 1 / 12
+    ratio = tone_amplitude**2 * fft_size * decimation / (3 * noise_var)
+    return 10 * np.log10(1 + ratio)
+
+
+def generate(n_samples, tone_offset_hz=None, tone_amplitude=TONE_AMPLITUDE, noise_rms=NOISE_RMS,
+             impulses_per_s=0.0, impulse_amplitude=IMPULSE_AMPLITUDE, impulse_length=IMPULSE_LENGTH,
+             sample_rate=SAMPLE_RATE, seed=0, chunk_samples=CHUNK_SAMPLES):
+    """
+    Yield the capture as int16 arrays of interleaved I/Q, chunk_samples
+    complex samples at a time (the tone stays phase-continuous across chunks)
+    """
+    rng = np.random.default_rng(seed)
+    burst_rate = impulses_per_s / sample_rate
+    for start in range(0, n_samples, chunk_samples):
+        n = min(chunk_samples, n_samples - start)
+        iq = rng.normal(0, noise_rms, (n, 2))
+        if tone_offset_hz is not None and tone_amplitude:
+            phase = 2 * np.pi * tone_offset_hz / sample_rate * np.arange(start, start + n)
+            iq[:, 0] += tone_amplitude * np.cos(phase)
+            iq[:, 1] += tone_amplitude * np.sin(phase)
+        if burst_rate:
+            for t in np.flatnonzero(rng.random(n) < burst_rate):
+                # Broadband burst: random-phase samples at full impulse amplitude
+                length = min(impulse_length, n - t)
+                angle = rng.uniform(0, 2 * np.pi, length)
+                iq[t:t + length, 0] += impulse_amplitude * np.cos(angle)
+                iq[t:t + length, 1] += impulse_amplitude * np.sin(angle)
+        np.rint(iq, out=iq)
+        yield np.clip(iq, -32768, 32767).astype(np.int16).ravel()
+
+
+def write_capture(path, n_samples, **options):
+    """Write a synthetic capture of n_samples complex samples to path; returns its size in bytes"""
+    size = 0
+    with open(path, "wb") as f:
+        for chunk in generate(n_samples, **options):
+            f.write(chunk.tobytes())
+            size += chunk.nbytes
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic airspy_rx capture (interleaved int16 IQ)")
+    parser.add_argument("path", help="Output .bin file")
+    parser.add_argument("--seconds", type=float, default=10, help=f"Capture length at {SAMPLE_RATE/1e6:g} MSPS (default: 10)")
+    parser.add_argument("--tone-offset", type=float, default=150e3, help="Tone offset from the tuned frequency, Hz (default: 150000)")
+    parser.add_argument("--tone-amplitude", type=float, default=TONE_AMPLITUDE, help=f"Tone amplitude in counts, 0 = none (default: {TONE_AMPLITUDE:g})")
+    parser.add_argument("--noise-rms", type=float, default=NOISE_RMS, help=f"Noise RMS per I/Q component in counts (default: {NOISE_RMS:g})")
+    parser.add_argument("--impulses-per-s", type=float, default=0, help="Impulsive RFI bursts per second (default: 0)")
+    parser.add_argument("--impulse-amplitude", type=float, default=IMPULSE_AMPLITUDE, help=f"Burst amplitude in counts (default: {IMPULSE_AMPLITUDE:g})")
+    parser.add_argument("--impulse-length", type=int, default=IMPULSE_LENGTH, help=f"Samples per burst (default: {IMPULSE_LENGTH})")
+    parser.add_argument("--fft-size", type=int, default=8192, help="Move the tone onto a bin centre of this FFT size, 0 = leave as given (default: 8192)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args(argv)
+
+    tone = bin_centred(args.tone_offset, args.fft_size) if args.fft_size else args.tone_offset
+    n_samples = int(args.seconds * SAMPLE_RATE)
+    size = write_capture(args.path, n_samples, tone_offset_hz=tone, tone_amplitude=args.tone_amplitude,
+                         noise_rms=args.noise_rms, impulses_per_s=args.impulses_per_s,
+                         impulse_amplitude=args.impulse_amplitude, impulse_length=args.impulse_length,
+                         seed=args.seed)
+    print(f"Wrote {args.path}: {n_samples:,} samples ({size / 1e6:.0f} MB), tone at {tone:+.1f} Hz")
+    if args.tone_amplitude:
+        print(f"Expected SNR ({args.fft_size or 8192}-point Hann): {expected_snr_db(args.tone_amplitude, args.noise_rms, args.fft_size or 8192):.1f} dB")
+
+
+if __name__ == "__main__":
+    main()
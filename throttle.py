@@ -0,0 +1,98 @@
+"""
+Thermal- and load-aware processing settings (capture_and_process.py --adaptive)
+
+Just before the FFT of each run, AdaptiveThrottle reads the CPU temperature,
+the firmware throttle flags and the load average (see monitor_resources.py)
+and scales the requested workers and batch size down on a warm or hot node,
+deferring optional work (waterfall, precision comparison, flag-only SK) when
+hot. A throttled Pi then takes predictably longer instead of running into the
+capture timeout.
+"""
+
+import os
+from dataclasses import dataclass
+
+from monitor_resources import read_cpu_temp, read_load_average, read_throttled
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+THROTTLE_WARM_C = _env_float("THROTTLE_WARM_C", 70)   # Pi 4 firmware starts capping the clock at 80°C
+THROTTLE_HOT_C = _env_float("THROTTLE_HOT_C", 77)
+THROTTLE_LOAD = _env_float("THROTTLE_LOAD", 1.5)      # 1-minute load per core that counts as "warm"
+MIN_BATCH_WINDOWS = 8
+
+LEVELS = ("normal", "warm", "hot")
+DEFERRABLE = ("compare_precision", "waterfall", "sk")
+DEFERRED_AT = {"normal": (), "warm": ("compare_precision",), "hot": DEFERRABLE}
+
+
+@dataclass
+class ThrottlePlan:
+    """Processing settings for one run"""
+    level: str                # "normal", "warm" or "hot"
+    reason: str
+    cpu_temp: float           # None without a thermal zone
+    load: float               # 1-minute load average per core
+    workers: int
+    batch_windows: int
+    deferred: tuple = ()      # Optional features to skip this run
+
+
+class AdaptiveThrottle:
+    """
+    Picks workers, batch size and deferred features from the node's state.
+
+    normal: settings as requested.
+    warm (>= warm_c, or load above load_per_cpu per core): half the workers
+        and batch, no precision comparison (it doubles the FFT work).
+    hot (>= hot_c, or the firmware is capping the clock right now): one
+        worker, a quarter of the batch, no waterfall or flag-only SK either.
+
+    Only flag-only SK (--sk-exclude off) is optional: with exclusion on it
+    changes the spectrum itself.
+    """
+
+    def __init__(self, warm_c=THROTTLE_WARM_C, hot_c=THROTTLE_HOT_C, load_per_cpu=THROTTLE_LOAD,
+                 cpus=None):
+        self.warm_c = warm_c
+        self.hot_c = hot_c
+        self.load_per_cpu = load_per_cpu
+        self.cpus = cpus or os.cpu_count() or 1
+
+    def level(self):
+        """(level, reason, cpu_temp, load per core) right now"""
+        temp = read_cpu_temp()
+        load = (read_load_average() or 0.0) / self.cpus
+        throttled = read_throttled() or 0
+        if throttled & 0x6:
+            return "hot", f"firmware throttling (flags {throttled:#x})", temp, load
+        if temp is not None and temp >= self.hot_c:
+            return "hot", f"{temp:.1f}°C >= {self.hot_c:g}°C", temp, load
+        if temp is not None and temp >= self.warm_c:
+            return "warm", f"{temp:.1f}°C >= {self.warm_c:g}°C", temp, load
+        if load >= self.load_per_cpu:
+            return "warm", f"load {load:.2f} per core >= {self.load_per_cpu:g}", temp, load
+        return "normal", "", temp, load
+
+    def plan(self, workers, batch_windows, optional=()):
+        """
+        Args:
+            workers: Requested FFT worker processes (already resolved, >= 1)
+            batch_windows: Requested FFT windows per batch
+            optional: Enabled features that may be deferred (see DEFERRABLE)
+
+        Returns:
+            ThrottlePlan
+        """
+        level, reason, temp, load = self.level()
+        step = LEVELS.index(level)
+        workers = 1 if level == "hot" else max(workers >> step, 1)
+        batch_windows = max(batch_windows >> step, min(batch_windows, MIN_BATCH_WINDOWS))
+        deferred = tuple(f for f in DEFERRED_AT[level] if f in optional)
+        return ThrottlePlan(level, reason, temp, load, workers, batch_windows, deferred)
@@ -1,59 +1,441 @@
+"""
+Upload .npz results and campaign containers to Google Drive (or any rclone remote).
+
+    python3 upload_npz.py [--jobs 4] [--retries 3] [--delete-local] [files ...]
+
+Files are sent in parallel (one `rclone copyto` per file, --jobs at a time),
+each retried with backoff. An on-disk manifest (.upload_manifest.json in the
+output directory) records every file's SHA-256 and upload state, so a rerun
+only sends what is missing or has changed. Local files are kept unless
+--delete-local, which deletes each one as soon as its own upload is confirmed
+(run_observations.py always does).
+
+A campaign container (*.campaign, see campaign_store.py) goes up as one
+item, mirrored into a folder of the same name: `rclone copy --checksum` only
+sends the files an appended run changed, and schema.json, which says how many
+rows are complete, follows once they're there. Containers are never deleted
+locally; later runs append to them.
+
+Exits with code 1 if any upload failed; those files stay on disk.
+"""
+
+import argparse
+import hashlib
+import json
 import os
+import shutil
+import signal
 import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from campaign_store import CampaignStore, is_campaign
 
 # === Config ===
 # Use environment variable or default to ../output relative to script
 LOCAL_DIR = os.environ.get("OUTPUT_DIR", os.path.join(os.path.dirname(__file__), "..", "output"))
 REMOTE_DIR = os.environ.get("REMOTE_DIR", "gdrive:")  # your Drive folder
+try:
+    UPLOAD_JOBS = max(int(os.environ.get("UPLOAD_JOBS", "4")), 1)
+except ValueError:
+    UPLOAD_JOBS = 4
+UPLOAD_RETRIES = 3
+UPLOAD_TIMEOUT = 60 * 10      # seconds per rclone call
+MANIFEST_NAME = ".upload_manifest.json"
+CANCELLED = "cancelled"
+
+
+class UploadError(Exception):
+    """Some files could not be uploaded"""
+
+    def __init__(self, failed):
+        super().__init__(f"{len(failed)} file(s) failed to upload: {', '.join(sorted(failed))}")
+        self.failed = failed
+
+
+@dataclass
+class UploadReport:
+    """Outcome of Uploader.upload(); file names, not paths"""
+    uploaded: list = field(default_factory=list)
+    failed: dict = field(default_factory=dict)      # name -> last error
+    skipped: list = field(default_factory=list)     # already uploaded, per the manifest
+    deleted: list = field(default_factory=list)
+    cancelled: list = field(default_factory=list)   # stopped by cancel(), still pending
+    bytes_uploaded: int = 0
+    seconds: float = 0.0
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _kill(proc):
+    """Kill proc's whole process group"""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def remote_path(remote, name):
+    """Destination for name inside remote ("gdrive:" or "gdrive:folder")"""
+    return remote + name if remote.endswith((":", "/")) else f"{remote}/{name}"
+
+
+def container_files(path):
+    """{relative name: [size, mtime]} of a campaign container's files"""
+    files = {}
+    for f in CampaignStore(path).files():
+        st = os.stat(f)
+        files[os.path.relpath(f, path)] = [st.st_size, st.st_mtime]
+    return files
+
+
+class Uploader:
+    """
+    Parallel, resumable uploads of the .npz files and campaign containers in
+    local_dir.
+
+    The manifest maps each file name to its size, mtime, sha256, state
+    ("pending", "uploaded" or "failed"), attempt count and last error. Hashes
+    are only recomputed when size or mtime change. Entries for files that no
+    longer exist locally are dropped. A container's entry has its total size,
+    newest mtime, the SHA-256 of its schema.json, and the size/mtime of each
+    of its files at the last confirmed upload ("sent").
+
+    start() runs upload() in a background thread. cancel() kills in-flight
+    rclone transfers, makes the running upload return early (cancelled files
+    stay "pending") and waits for the background thread.
+    """
+
+    def __init__(self, local_dir=LOCAL_DIR, remote=REMOTE_DIR, jobs=UPLOAD_JOBS,
+                 retries=UPLOAD_RETRIES, timeout=UPLOAD_TIMEOUT, log=print):
+        self.local_dir = local_dir
+        self.remote = remote
+        self.jobs = max(int(jobs), 1)
+        self.retries = max(int(retries), 0)
+        self.timeout = timeout
+        self.log = log
+        self.manifest_path = os.path.join(local_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._procs = set()
+        self._thread = None
+        self._report = None
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        """Write the manifest atomically (callers hold self._lock)"""
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def _update(self, name, **fields):
+        with self._lock:
+            self.manifest.setdefault(name, {}).update(fields)
+            self._save_manifest()
+
+    def default_paths(self):
+        """Every .npz and campaign container in local_dir"""
+        return [os.path.join(self.local_dir, f) for f in sorted(os.listdir(self.local_dir))
+                if f.endswith(".npz") or (f.endswith(".campaign") and is_campaign(os.path.join(self.local_dir, f)))]
+
+    def _scan_container(self, name, path):
+        """Manifest entry for a container, marked pending if any of its files changed"""
+        files = container_files(path)
+        size = sum(s for s, _ in files.values())
+        mtime = max((m for _, m in files.values()), default=0.0)
+        entry = self.manifest.get(name, {})
+        if entry.get("size") != size or entry.get("mtime") != mtime:
+            entry = {"size": size, "mtime": mtime, "sha256": sha256_file(os.path.join(path, "schema.json")),
+                     "state": "pending", "attempts": 0, "sent": entry.get("sent", {})}
+            self.manifest[name] = entry
+        entry["files"] = files
+        return entry
+
+    def unsent_bytes(self, path):
+        """Bytes an upload of path would send: the whole file, or a container's changed files"""
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+        entry = self.manifest.get(os.path.basename(path), {})
+        sent = entry.get("sent", {})
+        return sum(size for rel, (size, mtime) in entry.get("files", {}).items() if sent.get(rel) != [size, mtime])
+
+    def scan(self, paths=None):
+        """
+        Bring the manifest up to date for paths (default: every .npz and
+        campaign container in local_dir) and return the paths that still
+        need uploading
+        """
+        everything = paths is None
+        if everything:
+            paths = self.default_paths()
+        pending = []
+        with self._lock:
+            for path in paths:
+                name = os.path.basename(os.path.normpath(path))
+                if is_campaign(path):
+                    if self._scan_container(name, path)["state"] != "uploaded":
+                        pending.append(path)
+                    continue
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entry = self.manifest.get(name, {})
+                if entry.get("size") != st.st_size or entry.get("mtime") != st.st_mtime:
+                    # New or changed since it was last hashed
+                    entry = {"size": st.st_size, "mtime": st.st_mtime, "sha256": sha256_file(path),
+                             "state": "pending", "attempts": 0}
+                    self.manifest[name] = entry
+                if entry["state"] != "uploaded":
+                    pending.append(path)
+            if everything:
+                # Only a scan of all of local_dir knows which entries are stale; paths given
+                # explicitly may live elsewhere and must keep the entries just made for them
+                present = set(os.listdir(self.local_dir))
+                for name in [n for n in self.manifest if n not in present]:
+                    del self.manifest[name]
+            self._save_manifest()
+        return pending
+
+    def is_uploaded(self, path):
+        """True if the manifest says path's current contents are uploaded"""
+        entry = self.manifest.get(os.path.basename(os.path.normpath(path)), {})
+        if is_campaign(path):
+            files = container_files(path)
+            return entry.get("state") == "uploaded" and entry.get("sent") == files
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return (entry.get("state") == "uploaded" and entry.get("size") == st.st_size
+                and entry.get("mtime") == st.st_mtime)
+
+    def start(self, paths=None, delete=False):
+        """Run upload(paths, delete) in a background thread"""
+        self.cancel()
+        self._cancel.clear()
+        self._report = None
+
+        def run():
+            try:
+                self._report = self._upload(paths, delete)
+            except Exception as e:
+                self.log(f"Background upload failed: {e}")
+
+        self._thread = threading.Thread(target=run, name="upload", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """
+        Stop the background upload, if any: kill in-flight rclone calls, start
+        no new ones and wait for the thread. Returns its UploadReport (None if
+        nothing was running)
+        """
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return None
+        self._cancel.set()
+        with self._lock:
+            procs = list(self._procs)
+        for proc in procs:
+            _kill(proc)
+        thread.join()
+        return self._report
+
+    def _rclone(self, path):
+        """One upload attempt; returns None on success or an error string"""
+        # --checksum: skip transfers the remote already has identical contents for
+        options = ["--checksum", "--retries", "1", "--low-level-retries", "10"]
+        name = os.path.basename(os.path.normpath(path))
+        if not os.path.isdir(path):
+            return self._run(["rclone", "copyto", path, remote_path(self.remote, name)] + options)
+        # Container: the data first, then the schema.json that makes its new rows count. The
+        # schema is copied before the data goes, so rows appended meanwhile wait for the next upload
+        schema = os.path.join(path, ".schema.upload")
+        shutil.copyfile(os.path.join(path, "schema.json"), schema)
+        try:
+            error = self._run(["rclone", "copy", path, remote_path(self.remote, name), "--exclude", "schema.json",
+                               "--exclude", ".*", "--exclude", "*.tmp"] + options)
+            if error is None and self._cancel.is_set():
+                return CANCELLED
+            if error is None:
+                error = self._run(["rclone", "copyto", schema, remote_path(self.remote, f"{name}/schema.json")] + options)
+            return error
+        finally:
+            os.remove(schema)
+
+    def _run(self, cmd):
+        """Run one rclone command; returns None on success or an error string"""
+        try:
+            # Own process group, so cancel() can take down anything rclone spawned
+            proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                                    start_new_session=True)
+        except OSError as e:
+            return str(e)
+        with self._lock:
+            self._procs.add(proc)
+        try:
+            _, stderr = proc.communicate(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            _kill(proc)
+            proc.communicate()
+            return f"timed out after {self.timeout}s"
+        finally:
+            with self._lock:
+                self._procs.discard(proc)
+        if proc.returncode != 0:
+            return (stderr.strip().splitlines() or [f"exit code {proc.returncode}"])[-1]
+        return None
+
+    def _upload_one(self, path, delete):
+        name = os.path.basename(os.path.normpath(path))
+        error = CANCELLED
+        for attempt in range(self.retries + 1):
+            # Backoff doubles as a cancellation point
+            if self._cancel.wait(min(2 ** attempt, 30) if attempt else 0):
+                error = CANCELLED
+                break
+            with self._lock:
+                self.manifest[name]["attempts"] = self.manifest[name].get("attempts", 0) + 1
+            error = self._rclone(path)
+            if error is None:
+                break
+            if self._cancel.is_set():
+                error = CANCELLED
+                break
+        if error is CANCELLED:
+            # Killed or never started: not a failure, it goes again next time
+            self._update(name, state="pending", error=None)
+            return name, CANCELLED, False
+        if error is not None:
+            self._update(name, state="failed", error=error)
+            self.log(f"Uploading {name}... ❌ FAILED")
+            self.log(f"  Error: {error}")
+            return name, error, False
+        fields = {"sent": self.manifest[name].get("files", {})} if os.path.isdir(path) else {}
+        self._update(name, state="uploaded", error=None, uploaded_at=time.strftime("%Y-%m-%dT%H:%M:%S"), **fields)
+        self.log(f"Uploading {name}... ✅ SUCCESS")
+        deleted = False
+        if delete and not os.path.isdir(path):
+            os.remove(path)
+            deleted = True
+        return name, None, deleted
+
+    def upload(self, paths=None, delete=False):
+        """
+        Upload whatever in paths (default: every .npz and campaign container
+        in local_dir) isn't uploaded yet, jobs files at a time.
+
+        Args:
+            paths: Files and containers to consider (default: every .npz and
+                campaign container in local_dir)
+            delete: Remove each local file once its upload is confirmed,
+                including files the manifest already lists as uploaded
+                (never containers)
+
+        Returns:
+            UploadReport
+        """
+        self.cancel()
+        self._cancel.clear()
+        return self._upload(paths, delete)
+
+    def _upload(self, paths, delete):
+        t0 = time.perf_counter()
+        report = UploadReport()
+        if paths is None:
+            paths = self.default_paths()
+        pending = self.scan(paths)
+        for path in paths:
+            if path not in pending and self.is_uploaded(path):
+                report.skipped.append(os.path.basename(os.path.normpath(path)))
+                if delete and not os.path.isdir(path):
+                    os.remove(path)
+                    report.deleted.append(os.path.basename(path))
+        sizes = {path: self.unsent_bytes(path) for path in pending}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = {pool.submit(self._upload_one, path, delete): path for path in pending}
+            for future, path in futures.items():
+                name, error, deleted = future.result()
+                if error is None:
+                    report.uploaded.append(name)
+                    report.bytes_uploaded += sizes[path]
+                elif error is CANCELLED:
+                    report.cancelled.append(name)
+                else:
+                    report.failed[name] = error
+                if deleted:
+                    report.deleted.append(name)
+        with self._lock:
+            # Forget deleted files now rather than at the next scan
+            for name in report.deleted:
+                self.manifest.pop(name, None)
+            self._save_manifest()
+        report.seconds = time.perf_counter() - t0
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upload .npz results and campaign containers with rclone")
+    parser.add_argument("files", nargs="*", help="Files or containers to upload (default: every .npz and *.campaign in $OUTPUT_DIR)")
+    parser.add_argument("--jobs", type=int, default=UPLOAD_JOBS, help=f"Parallel transfers (default: $UPLOAD_JOBS or {UPLOAD_JOBS})")
+    parser.add_argument("--retries", type=int, default=UPLOAD_RETRIES, help=f"Retries per file, with backoff (default: {UPLOAD_RETRIES})")
+    parser.add_argument("--delete-local", action="store_true", help="Delete each local file once its upload is confirmed (default: keep them)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(LOCAL_DIR):
+        print(f"Output directory not found: {LOCAL_DIR}")
+        return 1
+    uploader = Uploader(jobs=args.jobs, retries=args.retries)
+    pending = uploader.scan(args.files or None)
+    if not pending and not args.files and not uploader.default_paths():
+        print("No .npz files or campaign containers found to upload.")
+        return 0
+
+    print(f"Found {len(pending)} file(s) to upload")
+    print(f"Destination: {REMOTE_DIR} ({uploader.jobs} parallel)\n")
+    report = uploader.upload(args.files or None, delete=args.delete_local)
+
+    # Summary
+    total = len(report.uploaded) + len(report.failed)
+    print("\n" + "="*60)
+    print("UPLOAD SUMMARY")
+    print("="*60)
+    print(f"Successful: {len(report.uploaded)}/{total}")
+    print(f"Failed:     {len(report.failed)}/{total}")
+    if report.skipped:
+        print(f"Skipped:    {len(report.skipped)} (already uploaded)")
+    print(f"Sent:       {report.bytes_uploaded / 1e6:.1f} MB in {report.seconds:.1f}s")
+    if report.deleted:
+        print(f"Deleted:    {len(report.deleted)} local file(s)")
+
+    if report.failed:
+        print("\n❌ UPLOAD FAILED - these files will NOT be deleted:")
+        for name in sorted(report.failed):
+            print(f"  - {name}")
+        print("\nFiles remain in:", LOCAL_DIR)
+        print("Rerun to retry; files already uploaded are not sent again.")
+        return 1  # Exit with error code
+    print("\n✅ All uploads successful")
+    return 0
 
-# === Upload all .npz files ===
-files_to_upload = [f for f in os.listdir(LOCAL_DIR) if f.endswith(".npz")]
-
-if not files_to_upload:
-    print("No .npz files found to upload.")
-    sys.exit(0)
-
-print(f"Found {len(files_to_upload)} file(s) to upload")
-print(f"Destination: {REMOTE_DIR}\n")
-
-upload_failed = False
-successful_uploads = []
-failed_uploads = []
-
-for filename in files_to_upload:
-    local_path = os.path.join(LOCAL_DIR, filename)
-    print(f"Uploading {filename}... ", end="", flush=True)
-    
-    result = subprocess.run(
-        ["rclone", "copy", local_path, REMOTE_DIR, "-v"],
-        capture_output=True,
-        text=True
-    )
-    
-    if result.returncode != 0:
-        print(f"❌ FAILED")
-        print(f"  Error: {result.stderr.strip()}")
-        upload_failed = True
-        failed_uploads.append(filename)
-    else:
-        print(f"✅ SUCCESS")
-        successful_uploads.append(filename)
-
-# Summary
-print("\n" + "="*60)
-print("UPLOAD SUMMARY")
-print("="*60)
-print(f"Successful: {len(successful_uploads)}/{len(files_to_upload)}")
-print(f"Failed:     {len(failed_uploads)}/{len(files_to_upload)}")
-
-if failed_uploads:
-    print("\n❌ UPLOAD FAILED - Files will NOT be deleted:")
-    for f in failed_uploads:
-        print(f"  - {f}")
-    print("\nFiles remain in:", LOCAL_DIR)
-    sys.exit(1)  # Exit with error code to prevent deletion
-else:
-    print("\n✅ All uploads successful - safe to delete local files")
-    sys.exit(0)
 
+if __name__ == "__main__":
+    sys.exit(main())